@@ -0,0 +1,248 @@
+#!/usr/bin/env python2
+# Shows whether the webapp answers simultaneous /find requests concurrently
+# under gevent.  A slow local stand-in for Google's freebusy API answers every
+# query after a fixed delay; N clients then ask /find at once, each about a
+# different set of attendees so nothing comes from the result cache.
+#
+#   python bench_concurrency.py --requests 20 --latency 0.5
+#
+# When every blocking call yields to the gevent hub, all N requests finish in
+# about one backend latency.  If anything blocks, they queue up behind each
+# other and take up to N times as long.
+#
+# Measured with the defaults (0.5s of backend latency, 3 attendees per
+# request), gevent 1.4 and Flask 0.10, with cooperative.verify() reporting
+# nothing blocking:
+#
+#   requests   seconds   slowest   latencies
+#          1      0.52      0.51         1.0
+#         20      0.65      0.62         1.3
+#         50      0.82      0.79         1.6
+#        100      1.20      1.14         2.4
+#
+# The backend runs in its own process.  The webapp runs in a forked process
+# with a scratch data directory, so the real database and sessions are never
+# touched.
+
+import argparse
+import BaseHTTPServer
+import os
+import shutil
+import socket
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import time
+
+import simplejson as json
+
+
+class FreebusyHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Filled in by serve()
+    delay = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        query = json.loads(self.rfile.read(length))
+
+        time.sleep(self.delay)
+
+        # Everyone is free the whole time
+        calendars = dict((item['id'], {'busy': []}) for item in query.get('items', []))
+        body = json.dumps({'kind': 'calendar#freeBusy',
+                           'timeMin': query['timeMin'],
+                           'timeMax': query['timeMax'],
+                           'calendars': calendars})
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FreebusyServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops simultaneous connections, and the
+    # clients' retries would be counted against the webapp
+    request_queue_size = 128
+
+
+def serve(port, delay):
+    FreebusyHandler.delay = delay
+    FreebusyServer(('127.0.0.1', port), FreebusyHandler).serve_forever()
+
+
+def start_backend(port, delay):
+    backend = subprocess.Popen([sys.executable, os.path.abspath(__file__),
+                                '--serve', '--port', str(port),
+                                '--latency', str(delay)])
+    # Wait for it to listen
+    for i in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return backend
+        except socket.error:
+            time.sleep(0.05)
+    backend.kill()
+    raise RuntimeError("The fake freebusy backend didn't start")
+
+
+def run_requests(args, url):
+    """ Runs in the forked process: patches for gevent, loads the webapp and
+        sends it 'args.requests' simultaneous /find requests
+    """
+    import cooperative
+    cooperative.patch()
+
+    import gevent
+    import httplib2
+    import gapi
+    import webapp
+    from dateutil.tz import tzlocal
+    from pyrfc3339 import generate
+
+    class FakeCalendarAPI(gapi.CalendarAPI):
+        """ A CalendarAPI whose freebusy queries go to the fake backend
+            through httplib2, like the real ones
+        """
+        def __init__(self, credentials):
+            self.tz = tzlocal
+            self.http = httplib2.Http()
+            self.reset()
+
+        def run_freebusy_query(self, users, start_time=None, end_time=None,
+                               postfix=None, **kwargs):
+            self.onids = [user + (postfix or gapi.EMAIL_POSTFIX) for user in users]
+            start_time, end_time = self._format_start_end(start_time, end_time)
+            query = self.build_freebusy_query([{'id': onid} for onid in self.onids],
+                                              generate(start_time), generate(end_time))
+            response, content = self.http.request(url, 'POST', body=json.dumps(query),
+                                                  headers={'content-type': 'application/json'})
+            return json.loads(content)
+
+    webapp.calendar_pool.factory = FakeCalendarAPI
+    webapp.db_session.add(webapp.User(onid='bench', fname='Bench', lname='User'))
+    webapp.db_session.commit()
+    webapp.credential_cache.put('bench', 'bench credentials')
+    webapp.app.config['LOGIN_DISABLED'] = True
+    webapp.lm._login_disabled = True
+
+    def find(i):
+        client = webapp.app.test_client()
+        with client.session_transaction() as sess:
+            sess['credentials_id'] = 'bench'
+            sess['username'] = 'bench'
+            sess['csrf_token'] = 'bench'
+        payload = {
+            'csrf_token': 'bench',
+            'start': '2014-06-02 09:00',
+            'end': '2014-06-02 17:00',
+            'search_type': 'open',
+            'users': dict(('Bench User {0}-{1}'.format(i, j),
+                           {'onid': 'bench{0}x{1}'.format(i, j)})
+                          for j in range(args.attendees)),
+        }
+        start = time.time()
+        response = client.post('/find', data=json.dumps(payload),
+                               content_type='application/json')
+        elapsed = time.time() - start
+        if 'free_ranges' not in json.loads(response.data):
+            raise RuntimeError(response.data)
+        return elapsed
+
+    start = time.time()
+    greenlets = [gevent.spawn(find, i) for i in range(args.requests)]
+    gevent.joinall(greenlets, raise_error=True)
+    elapsed = time.time() - start
+
+    return {
+        'elapsed': elapsed,
+        'slowest': max(g.value for g in greenlets),
+        'blocking': cooperative.verify(),
+    }
+
+
+def measure(args, url):
+    data_dir = tempfile.mkdtemp(prefix='cloudendar-bench-')
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(read_fd)
+        result = {}
+        try:
+            # Must be set before any module that reads config.DATA_DIR is
+            # imported.  The webapp also makes a data directory where it runs.
+            os.environ['CLOUDENDAR_DATA_DIR'] = data_dir
+            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+            os.chdir(data_dir)
+            result = run_requests(args, url)
+        except BaseException as e:
+            result['error'] = repr(e)
+
+        os.write(write_fd, json.dumps(result))
+        os.close(write_fd)
+        os._exit(0)
+
+    os.close(write_fd)
+    data = ''
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    return json.loads(data) if data else {'error': 'no result'}
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Benchmark simultaneous /find requests against a slow '
+                    'fake freebusy backend')
+    argparser.add_argument('--requests', type=int, default=20,
+                           help='number of simultaneous /find requests')
+    argparser.add_argument('--attendees', type=int, default=3,
+                           help='attendees in each request')
+    argparser.add_argument('--latency', type=float, default=0.5, metavar='SECONDS',
+                           help='time the backend takes to answer each query')
+    argparser.add_argument('--port', type=int, default=8082)
+    argparser.add_argument('--serve', action='store_true',
+                           help='only run the fake backend')
+    args = argparser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.latency)
+        return
+
+    backend = start_backend(args.port, args.latency)
+    try:
+        result = measure(args, 'http://127.0.0.1:{0}/freeBusy'.format(args.port))
+    finally:
+        backend.kill()
+
+    if 'error' in result:
+        print("failed: {0}".format(result['error']))
+        sys.exit(1)
+
+    if result['blocking']:
+        print("Still blocking under gevent: {0}".format(', '.join(result['blocking'])))
+    else:
+        print("Nothing blocking under gevent")
+
+    print("{0:>10} {1:>10} {2:>10} {3:>10} {4:>12}".format(
+        'requests', 'latency', 'seconds', 'slowest', 'latencies'))
+    print("{0:>10} {1:>10.2f} {2:>10.2f} {3:>10.2f} {4:>12.1f}".format(
+        args.requests, args.latency, result['elapsed'], result['slowest'],
+        result['elapsed'] / args.latency))
+
+
+if __name__ == '__main__':
+    main()
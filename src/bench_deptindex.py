@@ -0,0 +1,121 @@
+#!/usr/bin/env python2
+# Replays the directory lookups getValidCourses() makes, against the results
+# files an earlier getOSUCatalog.py run left on disk, and reports how many
+# directory searches each instructor costs with findDeptKey alone and with the
+# DeptIndex trying up to 1, 2 or 3 keys.
+#
+#   python bench_deptindex.py [results file] [onid results file]
+#
+# The instructors are split in two by name.  The index learns from the ONID
+# matches of one half and then resolves the other, and the other way around,
+# so no instructor is found through their own earlier match.  A search is
+# taken to find an instructor only with the department key that found them
+# before; instructors that were never found are never found.  Each run is
+# repeated once, with the index's counts from the first, as the next scrape
+# would see them.
+#
+# Measured against the files in this directory (2551 instructor/course code
+# pairs, 1917 instructors):
+#
+#   keys tried       searches  per instructor  pairs found
+#   findDeptKey          2271           1.185         1464
+#   index, 1             2271           1.185         1464
+#   index, 2             2672           1.394         1531
+#   index, 3             2812           1.467         1552
+#
+# findDeptKey's key is always among those tried, so the index never finds
+# fewer instructors than it does alone.
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import zlib
+
+from importer import ONID_RESULTS_FILE, RESULTS_FILE, read_onids, read_sections
+
+
+def half(instructor):
+    return zlib.crc32(instructor.encode('utf-8')) % 2
+
+
+def replay(pairs, onids, fallback, limit, train):
+    """ Resolves the instructors outside half 'train' with an index learned
+        from the ONID matches inside it.  With 'limit' None, only the
+        fallback key is tried.  Returns (instructors, searches, pairs found).
+    """
+    from deptindex import DeptIndex
+    from getOSUCatalog import getDirectoryUrl
+
+    # The key that found each instructor
+    keys = dict((instructor, deptkey) for onid, instructor, college, deptkey in onids)
+
+    directory = tempfile.mkdtemp(prefix='cloudendar-bench-')
+    try:
+        path = os.path.join(directory, 'data.db')
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE OSUcatalog (instructor, coursecode, college);")
+        conn.execute("CREATE TABLE oniduser (onid_id, instructor, college, url);")
+        conn.executemany("INSERT INTO OSUcatalog VALUES (?, ?, ?);", pairs)
+        conn.executemany("INSERT INTO oniduser VALUES (?, ?, ?, ?);",
+                         [(onid, instructor, college, getDirectoryUrl(instructor, deptkey))
+                          for onid, instructor, college, deptkey in onids
+                          if half(instructor) == train])
+        conn.commit()
+        conn.close()
+
+        index = DeptIndex(path)
+        index.learn()
+
+        tasks = sorted(set((instructor, coursecode) for instructor, coursecode, college in pairs
+                           if half(instructor) != train))
+        for run in range(2):
+            # resolveOnids() makes each distinct search once
+            searches = {}
+            found = 0
+            for instructor, coursecode in tasks:
+                if limit is None:
+                    candidates = [fallback(coursecode)]
+                else:
+                    candidates = index.candidates(coursecode, fallback(coursecode), limit)
+                for deptkey in candidates:
+                    hit = searches.setdefault((instructor, deptkey),
+                                              keys.get(instructor) == deptkey)
+                    index.record(coursecode, deptkey, hit)
+                    if hit:
+                        found += 1
+                        break
+        index.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return len(set(instructor for instructor, coursecode in tasks)), len(searches), found
+
+
+def main():
+    results_path = sys.argv[1] if len(sys.argv) > 1 else RESULTS_FILE
+    onid_path = sys.argv[2] if len(sys.argv) > 2 else ONID_RESULTS_FILE
+
+    from getOSUCatalog import findDeptKey
+
+    pairs = sorted(set((course['Instructor'], course['course'].split(' ')[0], course['dept'])
+                       for course in read_sections(results_path)))
+    onids = list(read_onids(onid_path))
+
+    print("{0:<16} {1:>9} {2:>15} {3:>12}".format(
+        'keys tried', 'searches', 'per instructor', 'pairs found'))
+    for label, limit in [('findDeptKey', None), ('index, 1', 1),
+                         ('index, 2', 2), ('index, 3', 3)]:
+        instructors = searches = found = 0
+        for train in (0, 1):
+            i, s, f = replay(pairs, onids, findDeptKey, limit, train)
+            instructors += i
+            searches += s
+            found += f
+        print("{0:<16} {1:>9} {2:>15.3f} {3:>12}".format(
+            label, searches, float(searches) / instructors, found))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python2
+# Micro-benchmark of scraper.parse_courseinfo and scraper.courseinfo_to_fields
+# (precompiled patterns and fixed-format date/time parsing from fastparse.py)
+# against the original re.match()/dateutil/strptime versions, over the
+# sections in results_file.txt.
+#
+# Usage: python bench_fastparse.py [results file] [repeat]
+
+import re
+import sys
+import time
+
+from datetime import datetime
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+
+import scraper
+
+from importer import read_sections
+
+
+RESULTS_FILE = 'results_file.txt'
+
+
+# The original implementations, kept here as the baseline
+def reference_parse_courseinfo(course):
+    DayTimeDate = course.get('Day/Time/Date')
+    Instructor = course.get('Instructor')
+
+    day_re = re.match('^(\w+)\s+(\d{4})-(\d{4}).*$', DayTimeDate)
+    if day_re:
+        days = list(day_re.group(1))
+        days = map(lambda day: scraper.DAY_MAP.get(day), days)
+        start_time = day_re.group(2)
+        end_time = day_re.group(3)
+    else:
+        days = None
+        start_time = None
+        end_time = None
+
+    names = re.match('^(\w+),\s+(\w+).*$', Instructor)
+    if names:
+        instructor = {
+            'fname': names.group(2),
+            'lname': names.group(1),
+        }
+    else:
+        instructor = None
+
+    return {
+        'instructor' : instructor,
+        'start_date': course.get('StartDate'),
+        'end_date': course.get('EndDate'),
+        'start_time': start_time,
+        'end_time': end_time,
+        'days': days,
+        'weeks': course.get('Weeks'),
+        'dept': course.get('dept'),
+        'crn': course.get('CRN'),
+        'sec': course.get('Sec'),
+        'term': course.get('Term'),
+        'course': course.get('course'),
+    }
+
+
+def reference_courseinfo_to_fields(info):
+    course_start_date = parser.parse(info.get('start_date')).date()
+    course_end_date = parser.parse(info.get('end_date')).date()
+
+    start_time = info.get('start_time')
+    end_time = info.get('end_time')
+
+    weekdays = info.get('days')
+
+    start_date = None
+    end_date = None
+    duration = None
+
+    if weekdays is not None and start_time is not None and end_time is not None:
+        start_weekday = weekdays[0]
+        end_weekday = weekdays[len(weekdays) - 1]
+
+        start_date = course_start_date + relativedelta(weekday=start_weekday(+1))
+        end_date = course_end_date + relativedelta(weekday=end_weekday(-1))
+
+        start_time_dt = datetime.strptime(start_time, '%H%M')
+        end_time_dt = datetime.strptime(end_time, '%H%M')
+        duration = end_time_dt - start_time_dt
+        start_time = start_time_dt.time()
+        end_time = end_time_dt.time()
+
+    return dict(
+        start_date=start_date,
+        end_date=end_date,
+        start_time=start_time,
+        end_time=end_time,
+        weekdays=weekdays,
+        duration=duration,
+        description=info.get('course'),
+        crn=info.get('crn'),
+        sec=info.get('sec'),
+        term=info.get('term'),
+    )
+
+
+def run(courses, parse, to_fields, repeat):
+    results = None
+    start = time.time()
+    for i in xrange(repeat):
+        results = [to_fields(parse(course)) for course in courses]
+    return time.time() - start, results
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else RESULTS_FILE
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    courses = list(read_sections(path))
+    print("{0} sections, {1} repetition(s)".format(len(courses), repeat))
+
+    ref_elapsed, ref_results = run(courses, reference_parse_courseinfo,
+                                   reference_courseinfo_to_fields, repeat)
+    fast_elapsed, fast_results = run(courses, scraper.parse_courseinfo,
+                                     scraper.courseinfo_to_fields, repeat)
+
+    mismatches = sum(1 for a, b in zip(ref_results, fast_results) if a != b)
+
+    total = len(courses) * repeat
+    print("{0:<10} {1:>10} {2:>14}".format('version', 'seconds', 'sections/s'))
+    print("{0:<10} {1:>10.3f} {2:>14.0f}".format('original', ref_elapsed, total / ref_elapsed))
+    print("{0:<10} {1:>10.3f} {2:>14.0f}".format('fast', fast_elapsed, total / fast_elapsed))
+    print("speedup: {0:.1f}x, mismatched sections: {1}".format(
+        ref_elapsed / fast_elapsed, mismatches))
+
+
+if __name__ == '__main__':
+    main()
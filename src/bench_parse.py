@@ -0,0 +1,131 @@
+#!/usr/bin/env python2
+# Compares parse time and peak memory of the BeautifulSoup ('soup') and lxml
+# ('lxml') course page parsers in scraper.py and getOSUCatalog.py over a
+# directory of saved catalog course pages.
+#
+# Usage: python bench_parse.py <page directory> [repeat]
+#
+# Each parser runs in its own forked process so that its peak RSS can be read
+# back with os.wait4() without the other parser's allocations getting in the
+# way.
+
+import os
+import resource
+import sys
+import time
+
+import simplejson as json
+
+import getOSUCatalog
+import scraper
+
+
+# Dummy course URL handed to getOSUCatalog, which reads the subject code and
+# course number out of it.
+PAGE_URL = 'http://catalog.oregonstate.edu/CourseDetail.aspx?subjectcode=X&coursenumber=0&campus=corvallis&Columns=ajkmn'
+
+
+def load_pages(page_dir):
+    pages = []
+    for name in sorted(os.listdir(page_dir)):
+        path = os.path.join(page_dir, name)
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+    return pages
+
+
+def run_scraper(pages, mode):
+    sections = 0
+    for text in pages:
+        try:
+            sections += len(list(scraper.parse_course_page(text, mode)))
+        except (AttributeError, IndexError):
+            # Not a course page
+            continue
+    return sections
+
+
+def run_catalog(pages, mode):
+    getOSUCatalog.parseMode = mode
+    sections = 0
+    for text in pages:
+        try:
+            sections += len(list(getOSUCatalog.parse_course_page(text, PAGE_URL)))
+        except (AttributeError, IndexError, TypeError):
+            continue
+    return sections
+
+
+def measure(func, pages, mode, repeat):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(read_fd)
+        # getOSUCatalog is chatty; keep its progress messages out of the report
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+
+        base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        for i in xrange(repeat):
+            sections = func(pages, mode)
+        elapsed = time.time() - start
+
+        os.write(write_fd, json.dumps({'elapsed': elapsed,
+                                       'sections': sections,
+                                       'base_rss': base_rss}))
+        os.close(write_fd)
+        os._exit(0)
+
+    os.close(write_fd)
+    data = ''
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read_fd)
+
+    _, status, usage = os.wait4(pid, 0)
+    if status != 0 or not data:
+        raise RuntimeError("Benchmark child for mode '{0}' failed".format(mode))
+
+    result = json.loads(data)
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss'] = usage.ru_maxrss
+    result['parse_rss'] = usage.ru_maxrss - result['base_rss']
+    return result
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: {0} <page directory> [repeat]".format(sys.argv[0]))
+        sys.exit(1)
+
+    pages = load_pages(sys.argv[1])
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    if not pages:
+        print("No pages found in {0}".format(sys.argv[1]))
+        sys.exit(1)
+
+    modes = ['soup']
+    if scraper.lxml_html is not None:
+        modes.append('lxml')
+
+    print("{0} pages, {1} repetition(s)".format(len(pages), repeat))
+    print("{0:<14} {1:<6} {2:>10} {3:>10} {4:>10} {5:>12}".format(
+        'parser', 'mode', 'seconds', 'pages/s', 'sections', 'peak +KB'))
+
+    for name, func in (('scraper', run_scraper), ('getOSUCatalog', run_catalog)):
+        for mode in modes:
+            result = measure(func, pages, mode, repeat)
+            rate = len(pages) * repeat / result['elapsed'] if result['elapsed'] else 0
+            print("{0:<14} {1:<6} {2:>10.3f} {3:>10.1f} {4:>10} {5:>12}".format(
+                name, mode, result['elapsed'], rate, result['sections'],
+                result['parse_rss']))
+
+
+if __name__ == '__main__':
+    main()
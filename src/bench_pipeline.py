@@ -0,0 +1,131 @@
+#!/usr/bin/env python2
+# Runs the full main() pipelines of scraper.py and getOSUCatalog.py against a
+# recorded page corpus and reports pages/sec and sections/sec.
+#
+# Record a corpus first with either script's --record option, e.g.
+#
+#   python scraper.py --record data/corpus
+#   python getOSUCatalog.py --record data/corpus
+#
+# then benchmark against it with
+#
+#   python bench_pipeline.py data/corpus --latency 0.05
+#
+# Each run happens in a forked process with its own scratch data directory,
+# so the real database, journal and caches are never touched and every run
+# starts cold.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import simplejson as json
+
+
+def run_scraper(args):
+    import scraper
+    return scraper.main(fetch_workers=args.fetch_workers,
+                        parse_workers=args.parse_workers,
+                        resolve_workers=args.resolve_workers,
+                        batch_size=args.batch_size)
+
+
+def run_catalog(args):
+    import getOSUCatalog
+    return getOSUCatalog.main()
+
+
+PIPELINES = {
+    'scraper': run_scraper,
+    'catalog': run_catalog,
+}
+
+
+def measure(name, args):
+    data_dir = tempfile.mkdtemp(prefix='cloudendar-bench-')
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(read_fd)
+        result = {}
+        try:
+            # Must be set before any module that reads config.DATA_DIR is
+            # imported.  getOSUCatalog also writes its result files to the
+            # working directory.
+            os.environ['CLOUDENDAR_DATA_DIR'] = data_dir
+            os.chdir(data_dir)
+            if not args.verbose:
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+
+            import fetcher
+            fetcher.configure('replay', os.path.abspath(args.corpus), args.latency)
+
+            start = time.time()
+            sections = PIPELINES[name](args)
+            result['elapsed'] = time.time() - start
+            result['sections'] = sections
+            result['pages'] = fetcher.stats['pages']
+        except BaseException as e:
+            result['error'] = repr(e)
+
+        os.write(write_fd, json.dumps(result))
+        os.close(write_fd)
+        os._exit(0)
+
+    os.close(write_fd)
+    data = ''
+    while True:
+        chunk = os.read(read_fd, 4096)
+        if not chunk:
+            break
+        data += chunk
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    shutil.rmtree(data_dir, ignore_errors=True)
+
+    return json.loads(data) if data else {'error': 'no result'}
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Benchmark the scraper pipelines against a recorded corpus')
+    argparser.add_argument('corpus', help='corpus directory recorded with --record')
+    argparser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS',
+                           help='delay added to every replayed page')
+    argparser.add_argument('--pipeline', choices=sorted(PIPELINES.keys()),
+                           action='append',
+                           help='pipeline to run; may be repeated (default: all)')
+    argparser.add_argument('--fetch-workers', type=int, default=4)
+    argparser.add_argument('--parse-workers', type=int, default=2)
+    argparser.add_argument('--resolve-workers', type=int, default=4)
+    argparser.add_argument('--batch-size', type=int, default=50)
+    argparser.add_argument('--verbose', action='store_true',
+                           help="show the pipelines' own output")
+    args = argparser.parse_args()
+
+    if not os.path.isdir(args.corpus):
+        print("No corpus at {0}".format(args.corpus))
+        sys.exit(1)
+
+    print("{0:<10} {1:>10} {2:>8} {3:>10} {4:>10} {5:>12}".format(
+        'pipeline', 'seconds', 'pages', 'pages/s', 'sections', 'sections/s'))
+
+    for name in args.pipeline or sorted(PIPELINES.keys()):
+        result = measure(name, args)
+        if 'error' in result:
+            print("{0:<10} failed: {1}".format(name, result.get('error')))
+            continue
+
+        elapsed = result.get('elapsed') or 1e-9
+        print("{0:<10} {1:>10.2f} {2:>8} {3:>10.1f} {4:>10} {5:>12.1f}".format(
+            name, elapsed, result.get('pages'), result.get('pages') / elapsed,
+            result.get('sections'), result.get('sections') / elapsed))
+
+
+if __name__ == '__main__':
+    main()
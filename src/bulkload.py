@@ -0,0 +1,102 @@
+import csv
+import itertools
+import sqlite3
+
+
+# Settings for connections doing bulk loads.  WAL lets readers keep using the
+# old contents of a table while a load is in progress, and with WAL, NORMAL
+# synchronization is still safe against corruption; only the very last
+# transaction can be lost if the machine goes down mid-load.
+BULK_PRAGMAS = [
+    "PRAGMA journal_mode = WAL;",
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -16000;",
+]
+
+CHUNK_SIZE = 1000
+
+
+def connect(path):
+    """ Opens a connection tuned for bulk loading.  Transactions on it are
+        managed explicitly by load().
+    """
+    conn = sqlite3.connect(path, isolation_level=None)
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def load(conn, sql, rows, reject_path=None, chunk_size=CHUNK_SIZE, reject_mode='wb'):
+    """ Inserts 'rows' with the statement 'sql' in a single transaction.
+
+        Rows are streamed through executemany() in chunks, each under its own
+        savepoint.  If a chunk fails, it is rolled back and retried one row at
+        a time, and rows that still fail are written, with the error, to the
+        CSV file 'reject_path' instead of aborting the load.  Pass
+        reject_mode='ab' to add to the file rather than replace it.
+
+        Returns a (loaded, rejected) tuple of row counts.
+    """
+    loaded = 0
+    rejected = 0
+    reject_file = None
+    reject_writer = None
+
+    # Take manual control of transactions for the length of the load
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("BEGIN;")
+
+        for chunk in _chunks(rows, chunk_size):
+            cursor.execute("SAVEPOINT chunk;")
+            try:
+                cursor.executemany(sql, chunk)
+                loaded += len(chunk)
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK TO SAVEPOINT chunk;")
+                for row in chunk:
+                    try:
+                        cursor.execute(sql, row)
+                        loaded += 1
+                    except (sqlite3.Error, ValueError, TypeError) as e:
+                        rejected += 1
+                        if reject_path is None:
+                            continue
+                        if reject_writer is None:
+                            reject_file = open(reject_path, reject_mode)
+                            reject_writer = csv.writer(reject_file)
+                        reject_writer.writerow([_encode(v) for v in row] + [str(e)])
+            cursor.execute("RELEASE SAVEPOINT chunk;")
+
+        cursor.execute("COMMIT;")
+    except:
+        try:
+            cursor.execute("ROLLBACK;")
+        except sqlite3.Error:
+            pass
+        raise
+    finally:
+        conn.isolation_level = isolation_level
+        if reject_file is not None:
+            reject_file.close()
+
+    return loaded, rejected
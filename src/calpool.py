@@ -0,0 +1,104 @@
+import contextlib
+import threading
+import time
+
+import gapi
+
+
+# How many ready CalendarAPI objects are kept altogether, and how long, in
+# seconds, one can sit unused before it's dropped
+MAX_IDLE = 64
+IDLE_TIMEOUT = 10 * 60
+
+
+class CalendarPool(object):
+    """ Ready-made CalendarAPI objects, kept per credentials so requests
+        don't each authorize an Http object and build the service again.
+
+        An object is used by one request at a time: borrow() checks one out,
+        building a new one if none is idle, and checks it back in when the
+        block finishes.  Objects that fail are dropped rather than reused.
+        'factory' makes a new object from credentials.
+    """
+    def __init__(self, max_idle=MAX_IDLE, idle_timeout=IDLE_TIMEOUT, factory=None):
+        if factory is None:
+            factory = lambda credentials: gapi.CalendarAPI(is_cli_app=False,
+                                                           credentials=credentials)
+        self.factory = factory
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        # key -> [(gcal, credentials, checked in), ...], most recent last
+        self.idle = {}
+        self.stats = {'reused': 0, 'built': 0, 'dropped': 0}
+
+    def _expire(self, now):
+        # Must be called with the lock held
+        for key in self.idle.keys():
+            fresh = [entry for entry in self.idle[key]
+                     if now - entry[2] <= self.idle_timeout]
+            self.stats['dropped'] += len(self.idle[key]) - len(fresh)
+            if fresh:
+                self.idle[key] = fresh
+            else:
+                del self.idle[key]
+
+    def checkout(self, key, credentials):
+        """ Returns an idle CalendarAPI made with 'credentials' for 'key', or
+            a new one
+        """
+        with self.lock:
+            self._expire(time.time())
+            entries = self.idle.get(key, [])
+            # Credentials that were replaced, e.g. by logging in again,
+            # take their objects with them
+            kept = [entry for entry in entries if entry[1] is credentials]
+            self.stats['dropped'] += len(entries) - len(kept)
+            gcal = None
+            if kept:
+                gcal = kept.pop()[0]
+                self.stats['reused'] += 1
+            if kept:
+                self.idle[key] = kept
+            else:
+                self.idle.pop(key, None)
+
+        if gcal is None:
+            gcal = self.factory(credentials)
+            with self.lock:
+                self.stats['built'] += 1
+        return gcal
+
+    def checkin(self, key, credentials, gcal):
+        """ Makes 'gcal' available to the next request for 'key' """
+        gcal.reset()
+        now = time.time()
+        with self.lock:
+            self.idle.setdefault(key, []).append((gcal, credentials, now))
+
+            # Past the limit, drop whatever has been idle longest
+            count = sum(len(entries) for entries in self.idle.values())
+            while count > self.max_idle:
+                oldest = min(self.idle, key=lambda k: self.idle[k][0][2])
+                self.idle[oldest].pop(0)
+                if not self.idle[oldest]:
+                    del self.idle[oldest]
+                self.stats['dropped'] += 1
+                count -= 1
+
+    @contextlib.contextmanager
+    def borrow(self, key, credentials):
+        gcal = self.checkout(key, credentials)
+        yield gcal
+        self.checkin(key, credentials, gcal)
+
+    def discard(self, key):
+        """ Drops the idle objects of 'key', e.g. when its credentials are
+            revoked
+        """
+        with self.lock:
+            self.stats['dropped'] += len(self.idle.pop(key, []))
+
+    def __len__(self):
+        with self.lock:
+            return sum(len(entries) for entries in self.idle.values())
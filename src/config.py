@@ -0,0 +1,8 @@
+import os
+
+
+# Directory holding the database, the scraper journal and the lookup caches.
+# Set CLOUDENDAR_DATA_DIR to point a run somewhere else, e.g. at a scratch
+# directory when benchmarking against a replayed corpus.
+basedir = os.path.abspath(os.path.dirname(__file__))
+DATA_DIR = os.environ.get('CLOUDENDAR_DATA_DIR', os.path.join(basedir, 'data'))
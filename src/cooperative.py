@@ -0,0 +1,87 @@
+# gevent support for the webapp.
+#
+# The webapp is served by gevent through Flask-SocketIO, so every client on a
+# worker shares one thread.  A Google API call that blocks the thread, rather
+# than yielding to the gevent hub while it waits, stalls every other client
+# until it returns.  httplib2 (used by CalendarAPI, PeopleAPI and /disconnect)
+# and requests (used by the ONID client) are only cooperative once the
+# standard library's socket, ssl, select, time and thread modules have been
+# replaced with gevent's.
+#
+# patch() does that, and has to run before anything else is imported, so no
+# module keeps a reference to a blocking original (a lock made by threading
+# before patching, say, blocks the whole thread when contended):
+#
+#   import cooperative
+#   cooperative.patch()
+#
+#   import diag
+#   ...
+#
+# verify() then reports anything the HTTP clients use that is still blocking.
+
+
+patched = False
+
+
+def patch():
+    """ Replaces the blocking parts of the standard library with gevent's.
+        Returns False if gevent isn't installed.
+    """
+    global patched
+    if patched:
+        return True
+
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+
+    monkey.patch_all()
+    patched = True
+    return True
+
+
+def verify():
+    """ Returns a list of the things the webapp's HTTP clients use that
+        would block the gevent hub; empty if everything is cooperative
+    """
+    try:
+        import gevent
+        import gevent.select
+        import gevent.socket
+        import gevent.ssl
+        import gevent.thread
+    except ImportError:
+        return ['gevent is not installed']
+
+    import select
+    import socket
+    import ssl
+    import thread
+    import time
+
+    checks = [
+        ('socket.socket', socket.socket, gevent.socket.socket),
+        ('socket.getaddrinfo', socket.getaddrinfo, gevent.socket.getaddrinfo),
+        ('ssl.wrap_socket', ssl.wrap_socket, gevent.ssl.wrap_socket),
+        ('select.select', select.select, gevent.select.select),
+        ('time.sleep', time.sleep, gevent.sleep),
+        ('thread.allocate_lock', thread.allocate_lock, gevent.thread.allocate_lock),
+    ]
+
+    # The HTTP clients reach the socket and ssl functions through their own
+    # references to the modules, so those have to be the patched modules too
+    import httplib2
+    checks.append(('httplib2 sockets', httplib2.socket.socket, gevent.socket.socket))
+    checks.append(('httplib2 ssl', httplib2.ssl.wrap_socket, gevent.ssl.wrap_socket))
+
+    try:
+        from requests.packages.urllib3 import connectionpool
+    except ImportError:
+        pass
+    else:
+        checks.append(('requests sockets', connectionpool.socket.socket,
+                       gevent.socket.socket))
+
+    return [name for name, used, cooperative in checks if used is not cooperative]
@@ -1,13 +1,13 @@
 import os
 
+from config import DATA_DIR
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
 
 # Set up path to database file
-basedir = os.path.abspath(os.path.dirname(__file__))
-db_uri = 'sqlite:///' + os.path.join(basedir, 'data/data.db')
+db_uri = 'sqlite:///' + os.path.join(DATA_DIR, 'data.db')
 
 
 # Set up scoped session
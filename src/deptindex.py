@@ -0,0 +1,128 @@
+import os
+import re
+import sqlite3
+
+from config import DATA_DIR
+
+
+DEPT_INDEX_PATH = os.path.join(DATA_DIR, 'data.db')
+
+# The department key in a directory search URL saved in oniduser
+URL_DEPT_RE = re.compile(r'[?&]osudepartment=([^&]*)')
+
+
+class DeptIndex(object):
+    """ Which directory department keys have actually found instructors for
+        each course code.
+
+        For every (course code, department key) pair the index counts how
+        many directory searches were made with that key for instructors of
+        that course code, and how many of them found an ONID.  Candidates
+        are ranked by hit rate, so the key most likely to work is tried
+        first.  The counts live in the 'deptindex' table and are read once,
+        when the index is opened; save() writes them back.
+    """
+    def __init__(self, path=DEPT_INDEX_PATH):
+        self.path = path
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS deptindex ("
+                          "coursecode VARCHAR(10) NOT NULL, "
+                          "deptkey VARCHAR(60) NOT NULL, "
+                          "hits INTEGER NOT NULL, "
+                          "tries INTEGER NOT NULL, "
+                          "PRIMARY KEY (coursecode, deptkey));")
+        self.conn.commit()
+
+        # coursecode -> {deptkey: [hits, tries]}
+        self.counts = {}
+        for coursecode, deptkey, hits, tries in self.conn.execute(
+                "SELECT coursecode, deptkey, hits, tries FROM deptindex;"):
+            self.counts.setdefault(coursecode, {})[deptkey] = [hits, tries]
+        self.changed = set()
+
+    def __len__(self):
+        return sum(len(keys) for keys in self.counts.values())
+
+    def learn(self):
+        """ Seeds the index from matches made before it existed: the
+            department keys in the search URLs of oniduser rows, joined to
+            the course codes their instructors teach in OSUcatalog.  Each
+            match counts as one successful try.  Returns the number of
+            matches read.
+
+            Only keys that were actually searched with are learned.  The user
+            table's departments are full names from the directory, not
+            search keys, so they aren't used.
+        """
+        try:
+            rows = self.conn.execute(
+                "SELECT DISTINCT c.coursecode, u.url, u.onid_id FROM oniduser u "
+                "JOIN OSUcatalog c ON c.instructor = u.instructor "
+                "AND c.college = u.college;").fetchall()
+        except sqlite3.OperationalError:
+            # The tables this needs don't exist (yet)
+            return 0
+
+        learned = 0
+        for coursecode, url, onid in rows:
+            deptkey = self._url_dept(url)
+            if not coursecode or not deptkey:
+                continue
+            self._add(coursecode, deptkey, 1, 1)
+            learned += 1
+        return learned
+
+    @staticmethod
+    def _url_dept(url):
+        match = URL_DEPT_RE.search(url or '')
+        return match.group(1) if match else None
+
+    def _add(self, coursecode, deptkey, hits, tries):
+        counts = self.counts.setdefault(coursecode, {}).setdefault(deptkey, [0, 0])
+        counts[0] += hits
+        counts[1] += tries
+        self.changed.add((coursecode, deptkey))
+
+    def record(self, coursecode, deptkey, hit):
+        """ Counts one directory search for an instructor of 'coursecode'
+            made with 'deptkey', and whether it found an ONID
+        """
+        self._add(coursecode, deptkey, 1 if hit else 0, 1)
+
+    def candidates(self, coursecode, fallback=None, limit=None):
+        """ Returns the department keys to try for an instructor of
+            'coursecode', best first.  'fallback', if given, is always
+            tried: it goes after the keys that have found someone, and takes
+            the last place if 'limit' would otherwise leave it out.
+        """
+        def rank(item):
+            deptkey, (hits, tries) = item
+            # Hit rate, smoothed so one lucky try doesn't beat a long record
+            return (-(hits + 1.0) / (tries + 2.0), -hits, deptkey != fallback, deptkey)
+
+        ranked = sorted(self.counts.get(coursecode, {}).items(), key=rank)
+        keys = [deptkey for deptkey, (hits, tries) in ranked if hits > 0]
+        if limit is not None:
+            keys = keys[:limit]
+        if fallback is not None and fallback not in keys:
+            if limit is not None and len(keys) >= limit:
+                keys = keys[:limit - 1]
+            keys.append(fallback)
+        return keys
+
+    def save(self):
+        """ Writes the counts changed since the index was opened """
+        self.conn.executemany("INSERT OR REPLACE INTO deptindex "
+                              "(coursecode, deptkey, hits, tries) VALUES (?, ?, ?, ?);",
+                              [(coursecode, deptkey) + tuple(self.counts[coursecode][deptkey])
+                               for coursecode, deptkey in self.changed])
+        self.conn.commit()
+        self.changed = set()
+
+    def close(self):
+        self.conn.close()
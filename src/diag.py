@@ -0,0 +1,198 @@
+import os
+import sys
+import threading
+import time
+
+
+# Diagnostics and timing for code that has to stay cheap when nobody is
+# looking.  Each subsystem gets a Tracer:
+#
+#   tracer = diag.get_tracer('gapi')
+#   tracer.debug("querying {0} calendars", len(users))
+#   with tracer.span('freebusy'):
+#       ...
+#
+# A message below its subsystem's level costs one comparison: it isn't
+# formatted and the caller's frame isn't looked at.  Caller information comes
+# from sys._getframe() rather than inspect.stack(), which builds a record and
+# reads the source of every frame on the stack.
+#
+# Levels are set per subsystem with configure(), or with the CLOUDENDAR_TRACE
+# environment variable, e.g. CLOUDENDAR_TRACE="gapi=debug,scraper=info".  The
+# subsystem '*' sets the level of every subsystem not named.
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {
+    'debug': DEBUG,
+    'info': INFO,
+    'warning': WARNING,
+    'error': ERROR,
+    'off': OFF,
+}
+
+DEFAULT_LEVEL = WARNING
+
+_lock = threading.Lock()
+_tracers = {}
+_levels = {}
+_output = sys.stderr
+
+
+class _NullSpan(object):
+    """ What span() hands out when timing is off: does nothing, and one
+        instance does for every caller
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    """ Times a block and reports how long it took at DEBUG level """
+    def __init__(self, tracer, name, frame):
+        self.tracer = tracer
+        self.name = name
+        self.frame = frame
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.elapsed = time.time() - self.start
+        outcome = 'failed' if exc_type is not None else 'done'
+        self.tracer.write_from(self.frame, "span {0} {1} in {2:.1f}ms".format(
+            self.name, outcome, self.elapsed * 1000))
+        self.frame = None
+        return False
+
+
+class Tracer(object):
+    def __init__(self, subsystem, level=DEFAULT_LEVEL):
+        self.subsystem = subsystem
+        self.level = level
+
+    def enabled(self, level=DEBUG):
+        return level >= self.level
+
+    def write_from(self, frame, msg):
+        """ Writes 'msg' as coming from 'frame', whatever the level """
+        code = frame.f_code
+        line = "{0} :: {1} :: {2} :: {3}: {4}\n".format(
+            self.subsystem, code.co_filename, code.co_name, frame.f_lineno, msg)
+        _output.write(line)
+
+    def log(self, level, msg, *args, **kwargs):
+        """ Writes 'msg', formatted with 'args' and 'kwargs' only if 'level'
+            is enabled for this subsystem
+        """
+        if level < self.level:
+            return
+        self._log(level, msg, args, kwargs, 2)
+
+    def _log(self, level, msg, args, kwargs, depth):
+        if args or kwargs:
+            msg = msg.format(*args, **kwargs)
+        self.write_from(sys._getframe(depth), msg)
+
+    def debug(self, msg, *args, **kwargs):
+        if DEBUG >= self.level:
+            self._log(DEBUG, msg, args, kwargs, 2)
+
+    def info(self, msg, *args, **kwargs):
+        if INFO >= self.level:
+            self._log(INFO, msg, args, kwargs, 2)
+
+    def warning(self, msg, *args, **kwargs):
+        if WARNING >= self.level:
+            self._log(WARNING, msg, args, kwargs, 2)
+
+    def error(self, msg, *args, **kwargs):
+        if ERROR >= self.level:
+            self._log(ERROR, msg, args, kwargs, 2)
+
+    def exception(self, msg, *args, **kwargs):
+        """ Writes 'msg' at ERROR level with the exception being handled and
+            where it was raised
+        """
+        if ERROR < self.level:
+            return
+        if args or kwargs:
+            msg = msg.format(*args, **kwargs)
+        exc_type, exc_obj, tb = sys.exc_info()
+        if tb is not None:
+            # Report the innermost frame, where the exception was raised
+            while tb.tb_next is not None:
+                tb = tb.tb_next
+            frame = tb.tb_frame
+            code = frame.f_code
+            _output.write("{0} :: {1} :: {2} :: {3}: {4}: {5}\n".format(
+                self.subsystem, code.co_filename, code.co_name, tb.tb_lineno,
+                msg, exc_obj))
+        else:
+            self.write_from(sys._getframe(1), msg)
+
+    def span(self, name):
+        """ Returns a context manager that times its block, if DEBUG is
+            enabled for this subsystem
+        """
+        if DEBUG < self.level:
+            return _NULL_SPAN
+        return Span(self, name, sys._getframe(1))
+
+
+def get_tracer(subsystem):
+    """ Returns the Tracer for 'subsystem', creating it if needed """
+    tracer = _tracers.get(subsystem)
+    if tracer is None:
+        with _lock:
+            tracer = _tracers.get(subsystem)
+            if tracer is None:
+                level = _levels.get(subsystem, _levels.get('*', DEFAULT_LEVEL))
+                tracer = _tracers[subsystem] = Tracer(subsystem, level)
+    return tracer
+
+
+def configure(subsystem, level):
+    """ Sets the level of 'subsystem' ('*' for every subsystem not set on its
+        own).  'level' may be a number or a name from LEVELS.
+    """
+    if not isinstance(level, int):
+        level = LEVELS[level.lower()]
+    with _lock:
+        _levels[subsystem] = level
+        for name, tracer in _tracers.items():
+            if name == subsystem or (subsystem == '*' and name not in _levels):
+                tracer.level = level
+
+
+def configure_from_string(spec):
+    """ Applies a "subsystem=level,..." specification """
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        subsystem, sep, level = item.partition('=')
+        if not sep:
+            subsystem, level = '*', subsystem
+        configure(subsystem.strip(), level.strip())
+
+
+def set_output(stream):
+    global _output
+    _output = stream
+
+
+configure_from_string(os.environ.get('CLOUDENDAR_TRACE', ''))
@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import time
+
+import simplejson as json
+
+from config import DATA_DIR
+
+
+DIRECTORY_CACHE_PATH = os.path.join(DATA_DIR, 'directory_cache.db')
+
+# How long, in seconds, a failed or ambiguous directory lookup is remembered
+# before it's worth asking the directory again.  Successful lookups never
+# expire; a changed ONID is caught by the User table check in the scraper.
+NEGATIVE_TTL = 7 * 24 * 60 * 60
+AMBIGUOUS_TTL = 30 * 24 * 60 * 60
+
+FOUND = 'found'
+MISSING = 'missing'
+AMBIGUOUS = 'ambiguous'
+
+
+class DirectoryCache(object):
+    """ Persistent cache of directory.oregonstate.edu instructor lookups,
+        keyed by (first name, last name, normalized department).
+
+        Each entry has a status of FOUND (with the instructor's directory
+        record), MISSING or AMBIGUOUS.
+    """
+    def __init__(self, path=DIRECTORY_CACHE_PATH, negative_ttl=NEGATIVE_TTL,
+                 ambiguous_ttl=AMBIGUOUS_TTL):
+        self.path = path
+        self.ttls = {
+            FOUND: None,
+            MISSING: negative_ttl,
+            AMBIGUOUS: ambiguous_ttl,
+        }
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS lookup ("
+                          "fname VARCHAR(40) NOT NULL, "
+                          "lname VARCHAR(40) NOT NULL, "
+                          "dept VARCHAR(60) NOT NULL, "
+                          "status VARCHAR(10) NOT NULL, "
+                          "record TEXT, "
+                          "stored REAL NOT NULL, "
+                          "PRIMARY KEY (fname, lname, dept));")
+        self.conn.commit()
+
+    def _key(self, fname, lname, dept):
+        return ((fname or '').lower(), (lname or '').lower(), (dept or '').lower())
+
+    def get(self, fname, lname, dept):
+        """ Returns a (status, record) tuple for a remembered lookup, or None
+            if the lookup has never been made or its entry has expired
+        """
+        cursor = self.conn.execute("SELECT status, record, stored FROM lookup "
+                                   "WHERE fname = ? AND lname = ? AND dept = ?;",
+                                   self._key(fname, lname, dept))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        status, record, stored = row
+        ttl = self.ttls.get(status)
+        if ttl is not None and time.time() - stored > ttl:
+            return None
+
+        if record is not None:
+            record = json.loads(record)
+        return status, record
+
+    def put(self, fname, lname, dept, status, record=None):
+        if status not in self.ttls:
+            raise ValueError("Unknown lookup status '{0}'".format(status))
+        if record is not None:
+            record = json.dumps(record)
+        self.conn.execute("INSERT OR REPLACE INTO lookup (fname, lname, dept, "
+                          "status, record, stored) VALUES (?, ?, ?, ?, ?, ?);",
+                          self._key(fname, lname, dept) + (status, record, time.time()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,66 @@
+import re
+import time as _time
+
+from datetime import date, datetime, time, timedelta
+from dateutil import parser
+
+
+# Patterns used on every section the scraper handles, compiled once here
+# instead of on every re.match() call.
+DAY_TIME_RE = re.compile(r'^(\w+)\s+(\d{4})-(\d{4}).*$')
+INSTRUCTOR_RE = re.compile(r'^(\w+),\s+(\w+).*$')
+FULL_NAME_RE = re.compile(r'^(\w+),\s+(\w+)\s*(\w*).*$')
+DEPT_RE = re.compile(r'^(?:college|school)\s+of\s+(\w+).*$')
+
+# The catalog's dates look like 9/29/14 and its times like 0800.
+SHORT_DATE_RE = re.compile(r'^\s*(\d{1,2})/(\d{1,2})/(\d{2}|\d{4})\s*$')
+HHMM_RE = re.compile(r'^(\d{2})(\d{2})$')
+
+
+def _convert_year(year):
+    # Same two-digit year rule as dateutil's parser: pick the century that
+    # puts the year within 50 years of the current one.
+    if year < 100:
+        this_year = _time.localtime().tm_year
+        year += this_year // 100 * 100
+        if abs(year - this_year) >= 50:
+            if year < this_year:
+                year += 100
+            else:
+                year -= 100
+    return year
+
+
+def parse_date(text):
+    """ Returns a date from a catalog M/D/YY date string, falling back on
+        dateutil for anything not in that format
+    """
+    match = SHORT_DATE_RE.match(text) if text is not None else None
+    if match:
+        month, day, year = match.groups()
+        try:
+            return date(_convert_year(int(year)), int(month), int(day))
+        except ValueError:
+            pass
+    return parser.parse(text).date()
+
+
+def parse_hhmm(text):
+    """ Returns a time from a catalog HHMM time string, falling back on
+        strptime for anything not in that format
+    """
+    match = HHMM_RE.match(text) if text is not None else None
+    if match:
+        hour, minute = match.groups()
+        try:
+            return time(int(hour), int(minute))
+        except ValueError:
+            pass
+    return datetime.strptime(text, '%H%M').time()
+
+
+def time_difference(start, end):
+    """ Returns end - start for two times on the same day, as a timedelta """
+    return timedelta(hours=end.hour - start.hour,
+                     minutes=end.minute - start.minute,
+                     seconds=end.second - start.second)
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import threading
+import time
+import urllib2
+import urlparse
+
+
+# Every page the scrapers download goes through fetch().  In 'live' mode that
+# is just a network request.  In 'record' mode each page fetched is also saved
+# to a corpus directory, and in 'replay' mode pages are served from the corpus
+# instead of the network, optionally after an injected delay to stand in for
+# network latency.  Replay lets the scrapers be run and profiled repeatably
+# without touching OSU's servers.
+MODES = ('live', 'record', 'replay')
+
+# Name of the file in a corpus directory listing the URL behind each page
+CORPUS_INDEX = 'index.txt'
+
+_settings = {
+    'mode': 'live',
+    'corpus_dir': None,
+    'latency': 0.0,
+    'rate_limiter': None,
+}
+
+# Running totals, readable by benchmarks
+stats = {
+    'pages': 0,
+    'bytes': 0,
+}
+
+_lock = threading.Lock()
+
+
+def configure(mode='live', corpus_dir=None, latency=0.0):
+    if mode not in MODES:
+        raise ValueError("Unknown fetch mode '{0}'".format(mode))
+    if mode != 'live' and corpus_dir is None:
+        raise ValueError("Fetch mode '{0}' needs a corpus directory".format(mode))
+    if mode == 'record' and not os.path.exists(corpus_dir):
+        os.makedirs(corpus_dir)
+
+    _settings['mode'] = mode
+    _settings['corpus_dir'] = corpus_dir
+    _settings['latency'] = latency
+
+
+class RateLimiter(object):
+    """ Spaces out requests so that no host sees more than 'rate' requests
+        per second, no matter how many threads are fetching
+    """
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError("Rate limit must be positive")
+        self.interval = 1.0 / rate
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def set_rate_limit(rate):
+    """ Limits live requests to 'rate' per second per host; None removes
+        the limit
+    """
+    _settings['rate_limiter'] = RateLimiter(rate) if rate else None
+
+
+def add_arguments(argparser):
+    """ Adds the --record, --replay and --latency options to a script's
+        argparse.ArgumentParser
+    """
+    group = argparser.add_mutually_exclusive_group()
+    group.add_argument('--record', metavar='DIR',
+                       help='save every page fetched to the corpus in DIR')
+    group.add_argument('--replay', metavar='DIR',
+                       help='serve pages from the corpus in DIR instead of the network')
+    argparser.add_argument('--latency', type=float, default=0.0, metavar='SECONDS',
+                           help='delay added to every replayed page')
+
+
+def configure_from_args(args):
+    if args.record:
+        configure('record', args.record)
+    elif args.replay:
+        configure('replay', args.replay, args.latency)
+
+
+def _url_bytes(url):
+    # Links pulled out of BeautifulSoup trees are unicode
+    if isinstance(url, unicode):
+        return url.encode('utf-8')
+    return url
+
+
+def corpus_name(url):
+    return hashlib.sha1(_url_bytes(url)).hexdigest() + '.html'
+
+
+def fetch(url, opener=None):
+    """ Returns the body of the page at 'url'.  'opener' is an optional
+        urllib.URLopener used for live requests in place of urllib2.urlopen.
+    """
+    mode = _settings.get('mode')
+
+    if mode == 'replay':
+        text = _replay(url)
+    else:
+        limiter = _settings.get('rate_limiter')
+        if limiter is not None:
+            limiter.wait(urlparse.urlsplit(url).netloc)
+
+        if opener is not None:
+            page = opener.open(url)
+        else:
+            page = urllib2.urlopen(url)
+        text = page.read()
+        page.close()
+
+        if mode == 'record':
+            _record(url, text)
+
+    with _lock:
+        stats['pages'] += 1
+        stats['bytes'] += len(text)
+
+    return text
+
+
+def _record(url, text):
+    corpus_dir = _settings.get('corpus_dir')
+    name = corpus_name(url)
+
+    with open(os.path.join(corpus_dir, name), 'wb') as f:
+        f.write(text)
+
+    with _lock:
+        with open(os.path.join(corpus_dir, CORPUS_INDEX), 'a') as f:
+            f.write("{0}\t{1}\n".format(name, _url_bytes(url)))
+
+
+def _replay(url):
+    latency = _settings.get('latency')
+    if latency:
+        time.sleep(latency)
+
+    path = os.path.join(_settings.get('corpus_dir'), corpus_name(url))
+    if not os.path.exists(path):
+        raise IOError("No page recorded for URL {0}".format(url))
+
+    with open(path, 'rb') as f:
+        return f.read()
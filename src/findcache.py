@@ -0,0 +1,112 @@
+import collections
+import threading
+import time
+
+from dateutil.tz import tzlocal, tzutc
+from gapi import FREEBUSY_TTL
+
+
+# How many attendee sets are remembered at once
+MAX_ENTRIES = 256
+
+
+def to_utc(dt, tz=tzlocal):
+    """ Returns 'dt' in UTC, reading it as in 'tz' if it has no timezone, the
+        way CalendarAPI.to_tz() does
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=tz())
+    return dt.astimezone(tzutc())
+
+
+def clip_segments(segments, start_time, end_time):
+    """ Returns the parts of 'segments' that fall between 'start_time' and
+        'end_time'
+    """
+    ret = []
+    for start, end, accounts in segments:
+        start = max(start, start_time)
+        end = min(end, end_time)
+        if start < end:
+            ret.append((start, end, accounts))
+    return ret
+
+
+class FindCache(object):
+    """ The overlap segments behind /find results, kept for as long as the
+        freebusy answers they came from.
+
+        Entries are keyed by who is asking, the sorted ONIDs asked about and
+        the timezone naive times are read in, and each remembers the window
+        it was computed for.  Since segments are stored rather than rendered
+        results, every search type ('whole', 'duration' or neither) is
+        answered from one entry, and so is any window inside its own.
+    """
+    def __init__(self, ttl=FREEBUSY_TTL, max_entries=MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # key -> [(start, end, segments, expires), ...]
+        self.entries = collections.OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def key(viewer, onids, tz=tzlocal):
+        return (viewer, tuple(sorted(set(onids))), repr(tz()))
+
+    def _find(self, key, start_time, end_time):
+        # Must be called with the lock held
+        now = time.time()
+        windows = self.entries.pop(key, None)
+        if windows is not None:
+            windows = [w for w in windows if w[3] > now]
+        if not windows:
+            return None
+        self.entries[key] = windows
+
+        for window in windows:
+            if window[0] <= start_time and end_time <= window[1]:
+                return window
+        return None
+
+    def covers(self, key, start_time, end_time):
+        """ Whether get() would find a current entry for 'key' covering the
+            window between 'start_time' and 'end_time'
+        """
+        with self.lock:
+            return self._find(key, start_time, end_time) is not None
+
+    def get(self, key, start_time, end_time):
+        """ Returns the segments between 'start_time' and 'end_time' (in UTC)
+            for 'key', or None if no current entry covers that window
+        """
+        with self.lock:
+            window = self._find(key, start_time, end_time)
+            self.stats['hits' if window is not None else 'misses'] += 1
+        if window is None:
+            return None
+
+        start, end, segments, expires = window
+        if (start, end) == (start_time, end_time):
+            return segments
+        return clip_segments(segments, start_time, end_time)
+
+    def put(self, key, start_time, end_time, segments):
+        """ Remembers the segments computed for 'key' between 'start_time' and
+            'end_time' (in UTC)
+        """
+        expires = time.time() + self.ttl
+        with self.lock:
+            windows = self.entries.pop(key, [])
+            # Windows inside the new one aren't needed any more
+            windows = [w for w in windows
+                       if w[3] > time.time() and
+                       not (start_time <= w[0] and w[1] <= end_time)]
+            windows.append((start_time, end_time, segments, expires))
+            self.entries[key] = windows
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
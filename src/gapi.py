@@ -1,6 +1,7 @@
 import argparse
 import functools
 import httplib2
+import itertools
 import os
 import pprint
 import re
@@ -8,6 +9,9 @@ import sys
 
 import simplejson as json
 
+import diag
+import metrics
+
 from apiclient import discovery
 from dateutil.relativedelta import relativedelta
 from dateutil.tz import tzutc, tzlocal
@@ -18,11 +22,34 @@ from pyicl import Interval, IntervalMap, IntervalSet, Set
 from pyrfc3339 import generate, parse
 from utility import log_diag, log_err, get_username
 
+try:
+    from gevent.pool import Pool
+except ImportError:
+    Pool = None
+
+
+tracer = diag.get_tracer('gapi')
+
 
 # For appending to usernames when constructing a freebusy query
 EMAIL_POSTFIX = '@onid.oregonstate.edu'
 
 
+# Number of users asked about in each freebusy query made by
+# CalendarAPI.iter_calendars_free()
+FREEBUSY_CHUNK_SIZE = 5
+
+# How many of those queries are in flight at once.  Without gevent they're
+# made one after another.
+FREEBUSY_CONCURRENCY = 8
+
+
+# How long, in seconds, an answer to a freebusy query is taken to still hold.
+# Anything computed from one, like the webapp's cached /find results, expires
+# with it.
+FREEBUSY_TTL = 5 * 60
+
+
 # For restricting logins to oregonstate.edu accounts
 # HD = "onid.oregonstate.edu"
 HD = "oregonstate.edu"
@@ -170,6 +197,44 @@ def activate(attrs=[], **o_kwargs):
     return _activate
 
 
+def ranges_from_segments(segments, onids, convert_func=None, whole=False,
+                         duration=False):
+    """ Turns overlap segments into the dictionaries get_ranges_overlaps()
+        returns
+
+        @param segments: a list of (start, end, set of email addresses) tuples,
+            as returned by CalendarAPI.get_overlap_segments()
+        @param onids: the email addresses of everyone asked about, for 'whole'
+        @param convert_func: applied to the start and end of each range
+        @param whole: if True, only ranges when everyone is free are returned
+        @param duration: if True, nothing is returned unless a single range
+            covers the interval
+    """
+    if convert_func is None:
+        convert_func = lambda dt: dt
+
+    ranges_overlaps = [
+        {'onids': sorted(accounts),
+         'start': convert_func(start),
+         'end': convert_func(end)}
+        for start, end, accounts in segments
+    ]
+
+    # Return only those intervals when all users are free
+    if whole:
+        onid_set = set(onids)
+        return [r for r in ranges_overlaps if set(r.get('onids')) ==
+                onid_set]
+
+    # If the set of free time ranges is larger than one, we know that
+    # nobody is free for the whole interval.
+    if duration:
+        if len(ranges_overlaps) > 1:
+            return []
+
+    return ranges_overlaps
+
+
 def nearest_hour(dt):
     hour = dt.hour
     if dt.minute > 30:
@@ -277,6 +342,7 @@ class GAPI(object):
         # Create an httplib2.Http object to handle our HTTP requests and
         # authorize it with our good credentials.
         http = httplib2.Http()
+        self.credentials = credentials
         self.http = credentials.authorize(http)
 
         # Construct the service object for the interacting with the APIs.
@@ -294,6 +360,17 @@ class CalendarAPI(GAPI):
         self.request = None
         self.onids = None
 
+    def reset(self):
+        """ Forgets the last query's results, so the object can be used for
+            someone else's query with the same credentials
+        """
+        self.active = False
+        self.calendars = None
+        self.freebusy = None
+        self.request = None
+        self.onids = None
+        self.api = None
+
     # TODO: work on exception handling
     def build_freebusy_query(self, ids, timeMin, timeMax, timeZone=None,
                             groupExpansionMax=None, calendarExpansionMax=None):
@@ -356,6 +433,27 @@ class CalendarAPI(GAPI):
         self.onids = [user + postfix for user in users]
         ids = [{'id': onid} for onid in self.onids]
 
+        # Create the freebusy API and store in the object
+        self.api = self.service.freebusy()
+
+        # Create the request and store the result in the object
+        self.request = self.build_freebusy_request(ids, start_time, end_time,
+                                                   **kwargs)
+
+        # Return the executed request
+        tracer.debug("freebusy query for {0} calendars", len(ids))
+        with tracer.span('freebusy'), metrics.stage('freebusy'):
+            calendars = self.request.execute()
+
+        # TODO: handle non-existent users, and other errors.
+
+        return calendars
+
+    def build_freebusy_request(self, ids, start_time=None, end_time=None,
+                               **kwargs):
+        """ Returns an unexecuted freebusy request for the calendars 'ids',
+            leaving the object's state alone
+        """
         start_time, end_time = self._format_start_end(start_time, end_time)
 
         # Create strings from datetime objects so that we can pass them to the
@@ -363,22 +461,32 @@ class CalendarAPI(GAPI):
         start_time_str = generate(start_time)
         end_time_str = generate(end_time)
 
-        # Create the freebusy API and store in the object
-        self.api = self.service.freebusy()
-
         # Create the freebusy query body
         query = self.build_freebusy_query(ids, start_time_str, end_time_str,
                                           **kwargs)
 
-        # Create the request and store the result in the object
-        self.request = self.api.query(body=query)
-
-        # Return the executed request
-        calendars = self.request.execute()
-
-        # TODO: handle non-existent users, and other errors.
+        return self.service.freebusy().query(body=query)
 
-        return calendars
+    def _query_chunk(self, chunk, start_time, end_time):
+        """ Runs the freebusy query for the users 'chunk' through an HTTP
+            connection of its own, so several can be in flight at once.
+            Returns (chunk, onids, freebusy).
+        """
+        onids = [user + EMAIL_POSTFIX for user in chunk]
+        request = self.build_freebusy_request([{'id': onid} for onid in onids],
+                                              start_time, end_time)
+
+        # An httplib2.Http object can't be shared by queries in flight
+        http = None
+        if self.credentials is not None:
+            http = self.credentials.authorize(httplib2.Http())
+
+        tracer.debug("freebusy query for {0} calendars", len(onids))
+        with tracer.span('freebusy'), metrics.stage('freebusy'):
+            freebusy = request.execute(http=http)
+        if freebusy is None:
+            raise Exception("Could not query free/busy times")
+        return chunk, onids, freebusy
 
     def query_calendars_free(self, users, start_time=None, end_time=None):
         """ Returns a calendar of the form returned by a freebusy query,
@@ -406,9 +514,66 @@ class CalendarAPI(GAPI):
 
         # Add list of free times to calendars.  Store the calendars in the
         # object, then return them.
-        self.calendars = self._calendars_free(start_time, end_time, new_calendars)
+        with tracer.span('calendars_free'), metrics.stage('calendars_free'):
+            self.calendars = self._calendars_free(start_time, end_time, new_calendars)
         return self.calendars
 
+    def iter_calendars_free(self, users, start_time=None, end_time=None,
+                            chunk_size=FREEBUSY_CHUNK_SIZE):
+        """ Like query_calendars_free(), but queries the users 'chunk_size' at
+            a time, so callers can show progress as each answer arrives.  Up
+            to FREEBUSY_CONCURRENCY queries are made at once under gevent, and
+            chunks are yielded in the order their answers come back.
+
+            @param users: collection of strings representing ONID usernames
+            @param start_time: datetime object representing start of interval
+            @param end_time: datetime object representing end of interval
+            @param chunk_size: the number of users in each freebusy query
+
+            @returns: Yields (chunk, calendars) for each chunk of users, with
+                calendars as query_calendars_free() returns them.  Once the
+                last chunk is in, the object's 'calendars' and 'onids' hold
+                every chunk's, ready for get_ranges_overlaps().
+        """
+        start_time, end_time = self._format_start_end(start_time, end_time)
+        users = list(users)
+
+        chunks = [users[i:i + chunk_size] for i in range(0, len(users), chunk_size)]
+        query = functools.partial(self._query_chunk, start_time=start_time,
+                                  end_time=end_time)
+
+        pool = None
+        if Pool is not None and len(chunks) > 1:
+            pool = Pool(FREEBUSY_CONCURRENCY)
+            answers = pool.imap_unordered(query, chunks)
+        else:
+            answers = itertools.imap(query, chunks)
+
+        calendars = {}
+        onids = []
+        try:
+            for chunk, chunk_onids, freebusy in answers:
+                onids.extend(chunk_onids)
+
+                chunk_calendars = self.convert_calendars(
+                    self._extract_calendars(freebusy),
+                    self.get_ranges_datetime_obj,
+                    ['busy'])
+                with metrics.stage('calendars_free'):
+                    chunk_calendars = self._calendars_free(start_time, end_time,
+                                                           chunk_calendars)
+                calendars.update(chunk_calendars)
+
+                self.freebusy = freebusy
+                self.calendars = calendars
+                self.onids = onids
+
+                yield chunk, chunk_calendars
+        finally:
+            # Don't leave queries running for a caller that stopped early
+            if pool is not None:
+                pool.kill()
+
     def get_calendars(self, calendars=None, tz=None):
         """ Returns the CalendarAPI object's 'calendar' attribute, after
             optionally converting its timezone
@@ -467,36 +632,28 @@ class CalendarAPI(GAPI):
                 calendars = self.convert_calendars(calendars,
                                                    self._convert_tz(tz))
 
-        ranges_map = self._ranges_overlaps(calendars, status)
+        segments = self.get_overlap_segments(calendars=calendars, status=status)
+        return ranges_from_segments(segments, self.onids, convert_func=convert_func,
+                                    whole=whole, duration=duration)
 
-        if convert_func is None:
-            ranges_overlaps = [
-                {'onids': [u for u in segment.value],
-                'start': segment.interval.lower,
-                'end': segment.interval.upper}
-                for segment in ranges_map
-            ]
-        else:
-            ranges_overlaps = [
-                {'onids': [u for u in segment.value],
-                'start': convert_func(segment.interval.lower),
-                'end': convert_func(segment.interval.upper)}
-                for segment in ranges_map
-            ]
-
-        # Return only those intervals when all users are free
-        if whole:
-            onid_set = set(self.onids)
-            return [r for r in ranges_overlaps if set(r.get('onids')) ==
-                    onid_set]
-
-        # If the set of free time ranges is larger than one, we know that
-        # nobody is free for the whole interval.
-        if duration:
-            if len(ranges_overlaps) > 1:
-                return []
-
-        return ranges_overlaps
+    def get_overlap_segments(self, users=None, start_time=None, end_time=None,
+                             calendars=None, status='free'):
+        """ Returns the map of times to the accounts free (or busy) at them
+            that get_ranges_overlaps() is computed from, as a list of (start,
+            end, frozenset of email addresses) tuples in time order.  Unlike
+            the PyICL map, the list can be kept and shared between threads.
+        """
+        if calendars is None:
+            calendars = self.calendars
+            if calendars is None:
+                if users is None:
+                    raise Exception("Cannot query free/busy info for no users")
+                calendars = self.query_calendars_free(users, start_time, end_time)
+
+        with metrics.stage('ranges_overlaps'):
+            return [(segment.interval.lower, segment.interval.upper,
+                     frozenset(segment.value))
+                    for segment in self._ranges_overlaps(calendars, status)]
 
     def to_tz(self, tz, dt):
         """ Converts a datetime object to a different timezone
@@ -12,33 +12,67 @@
 #
 #########################################################################
 
+import argparse
+import csv
 import re
 import sys
 import os.path
 import os
 import sqlite3
 import itertools
+import threading
+import time
 import urllib
 import urlparse
+import bulkload
+import fetcher
 from bs4 import BeautifulSoup
+from config import DATA_DIR
+from deptindex import DeptIndex
+from journal import Journal
+from pipeline import Pipeline, Stage
+
+# lxml is optional.  When it is installed the course pages are read with a
+# handful of XPath lookups instead of a full BeautifulSoup tree.
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
 
 # Define the SQLLite3 DB to use
-masterDatabase = 'data/data.db'
+masterDatabase = os.path.join(DATA_DIR, 'data.db')
 
 # Array to hold stage one scraping of the OSU catalog (Holds URL's to follow to secondary pages.)
 s = [] 
 
-# list to hold the results of secondary parse
-d = []
-
 # Array to hold URL's that had issues so that we can identify the issue later and fix
 s_err = []
 
-# Last phase of processing we hold the final constructed URL's and get data to send to oniduser table
-t = []
-
 target_name = 'error_File.txt'
 
+# Number of threads looking up onid ids, and the most directory requests to make per second
+onidWorkers = 8
+directoryRate = 10
+
+# Most department keys tried for one instructor before giving up; findDeptKey's key is always one
+# of them. Every key past the first costs a search for each instructor the first key misses:
+# replaying the last run's results with bench_deptindex.py, findDeptKey alone took 1.19 searches
+# per instructor, two keys 1.39 and three 1.47, for 5% and 6% more matches.
+maxDeptTries = 3
+
+# Rows that could not be loaded into the OSUcatalog and oniduser tables
+catalogRejectFile = 'rejected_catalog_rows.txt'
+userRejectFile = 'rejected_onid_rows.txt'
+
+# Progress journal for the current run; see main() and the --resume option
+journal = None
+
+# Which parser get_course_info uses for course pages: 'lxml' or 'soup'
+parseMode = 'lxml' if lxml_html is not None else 'soup'
+
+# The course offerings table on each course page
+OFFERING_TABLE_ID = 'ctl00_ContentPlaceHolder1_SOCListUC1_gvOfferings'
+
 # Helper to open urls  
 class MyOpener(urllib.FancyURLopener):
     version = 'Mozilla/5.0 (Windows; U; Windows NT 6.1; en-US; rv:1.9.2.15) Gecko/20110303 Firefox/3.6.15'
@@ -66,28 +100,50 @@ def saveFiles(results):
 # def saveFiles(results)
 
 
-# Function that will take arrays and send results to file
-def saveArray(arr, b):
+# Function that passes rows through unchanged while writing each one to the results file, so the
+# file can be inspected for results and diagnostics without holding every row in memory.
+# b = 0 writes the onid results, anything else the catalog results.
+def saveRows(rows, b):
 
     if b == 0:
         filename = "onid_results_file.txt"
     else:
         filename = "results_file.txt"
 
-    # Differnt arrays will have differnt number of columns
-    numcols = len(arr[0])
-
     with open(filename, "w") as f:
-        for x in xrange(len(arr)):
-            for y in range(numcols):
-                if y < numcols-1	:
-                    f.write(arr[x][y] + ",")
-                elif y == numcols-1:
-                    f.write(arr[x][y])
-            f.write("\n")
+        for row in rows:
+            writeRow(f, row)
+            yield row
     print "\nThe " + filename + " file was saved to disk so that you may inspect for results and can be used for diagnostics.\n"
    
- # def saveArray(arr)
+ # def saveRows(rows, b)
+
+
+
+# Same as saveRows, for pages of rows: each page is passed through whole once its rows are written
+def savePages(pages, b):
+
+    if b == 0:
+        filename = "onid_results_file.txt"
+    else:
+        filename = "results_file.txt"
+
+    with open(filename, "w") as f:
+        for rows in pages:
+            for row in rows:
+                writeRow(f, row)
+            yield rows
+    print "\nThe " + filename + " file was saved to disk so that you may inspect for results and can be used for diagnostics.\n"
+
+# def savePages(pages, b)
+
+
+
+# Rows are written as CSV, so names and colleges with commas of their own are quoted
+def writeRow(f, row):
+    csv.writer(f, lineterminator="\n").writerow(["" if v is None else v.encode('utf-8') for v in row])
+
+# def writeRow(f, row)
 
 
 # Keep history of past files for inspection and diagnostics so 
@@ -104,165 +160,173 @@ def alternative_names(filename):
 
 
 
-# This function will check that we have not have any duplicates sneak past us and more than one onid id was added
-# to the oniduser table
-def cleanupFinal():
+# Columns that identify a single offering in the OSUcatalog table, and the onid id that identifies
+# a row of the oniduser table. Each gets a unique index so that loading a row that is already there
+# updates it instead of adding a duplicate.
+catalogKey = ['coursecode', 'coursenum', 'term', 'instructor', 'scheduleddays', 'starttime', 'endtime', 'startdate', 'enddate', 'location', 'type']
+userKey = ['onid_id']
 
-    print "\nFinal Cleanup in process please wait!\n"
+tableSchemas = {
+    'cat': ('OSUcatalog', "CREATE TABLE IF NOT EXISTS OSUcatalog (id INTEGER PRIMARY KEY AUTOINCREMENT, coursecode VARCHAR(10) NOT NULL, coursenum VARCHAR(10), instructor VARCHAR(60), college VARCHAR(60), scheduleddays VARCHAR(10), starttime VARCHAR(10), endtime VARCHAR(10), startdate VARCHAR(15), enddate VARCHAR(15), term VARCHAR(10), location VARCHAR(75), type VARCHAR(100), url varchar(255), seen INTEGER);", catalogKey),
+    'user': ('oniduser', "CREATE TABLE IF NOT EXISTS oniduser(onid_id varchar(10),instructor varchar(60), college varchar(60), url varchar(255), seen INTEGER);", userKey),
+}
 
-    try:
-        # Open our database
-        conn = sqlite3.connect(masterDatabase)
-        print "Opened database successfully";
 
-        # We will get all records that may be duplicate and delete them keeping only the max 1       
-        cmd = "delete from oniduser where rowid not in (select max(rowid) from oniduser group by onid_id);"
-       
-        # Exucute the drop command for teh table requested
-        conn.execute(cmd);
-
-        conn.commit()
-        print "Cleanup completed successfully!"
-        conn.close()
-    except:
-        print "An error occured while tring delete any duplicates form the oniduser table"
-        exit()
-
-
-
-# def cleanupFinal():
 
+# This function will create a table in the database depending on the value sent in
+# cat = OSUCatalog table, user = oniduser table
+# Tables are kept between runs and refreshed in place, so readers never see them empty. Tables left
+# by older versions of this script get the seen column and, after any duplicates are removed
+# (keeping the last one loaded), the unique index on their key.
+def createcattables(table):
 
+    if table not in tableSchemas:
+        print "\nYou must specify a table name to be created. No tables were created and the program will now halt\n"
+        exit()
 
-# Function that will drop the OSOCatalog table from our sqllite3 DB
-def dropCattables(table):
+    tt, cmd, key = tableSchemas[table]
 
     try:
         # Open our database
         conn = sqlite3.connect(masterDatabase)
-        print "Opened database successfully -- Attempting to drop table";
-
-        # Determin which table we will drop and assign sql syntax
-        if table == 'cat':
-            cmd = "DROP TABLE IF EXISTS OSUCatalog;"
-            tt = 'OSUCatalog'
-        elif table == 'user':
-            cmd = "DROP TABLE IF EXISTS oniduser;"
-            tt = 'oniduser'
-        else:
-            print "\nYou must specify a table name to be dropped. No tables were dropped and the program will now halt\n"
-            exit()
+        print "Opened database successfully -- Attempting to create table";
 
-        # Exucute the drop command for teh table requested
+        # Exucute the create command for the table requested
         conn.execute(cmd);
 
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(" + tt + ");")]
+        if 'seen' not in columns:
+            conn.execute("ALTER TABLE " + tt + " ADD COLUMN seen INTEGER;")
+
+        index = tt + "_key"
+        if conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = ?;", (index,)).fetchone() is None:
+            conn.execute("delete from " + tt + " where rowid not in (select max(rowid) from " + tt + " group by " + ", ".join(key) + ");")
+            conn.execute("CREATE UNIQUE INDEX " + index + " ON " + tt + " (" + ", ".join(key) + ");")
+
         conn.commit()
-        print tt + " dropped successfully";
+        print tt + " is ready";
         conn.close()
     except:
-        print "An error occured while tring to drop one or more tables from the database. System will now halt"
+        print "An error occured while tring one or more tables. System will now halt"
         exit()
 
-# def dropCattables(table)
+   
 
+# def createcattables(table)
 
 
-# This function will create a table in the database depending on the value sent in
-# cat = OSUCatalog table, user = oniduser table
-def createcattables(table):
 
+# Builds an INSERT for table that updates the existing row instead when one with the same key
+# is already there
+def upsertCommand(table, columns):
+    tt, cmd, key = tableSchemas[table]
+    updates = [c + " = excluded." + c for c in columns if c not in key]
+    return ("insert into " + tt + "(" + ",".join(columns) + ") values(" + ",".join("?" * len(columns)) + ") "
+            "on conflict(" + ", ".join(key) + ") do update set " + ", ".join(updates) + ";")
 
-    try:
-        # Open our database
-        conn = sqlite3.connect(masterDatabase)
-        print "Opened database successfully -- Attempting to create table";
+# def upsertCommand(table, columns)
 
-        # Determin which table we will create and assign sql syntax
-        if table == 'cat':
-            cmd = "CREATE TABLE OSUcatalog (id INTEGER PRIMARY KEY AUTOINCREMENT, coursecode VARCHAR(10) NOT NULL, coursenum VARCHAR(10), instructor VARCHAR(60), college VARCHAR(60), scheduleddays VARCHAR(10), starttime VARCHAR(10), endtime VARCHAR(10), startdate VARCHAR(15), enddate VARCHAR(15), term VARCHAR(10), location VARCHAR(75), type VARCHAR(100), url varchar(255));"
-            tt = 'OSUCatalog'
-        elif table == 'user':
-            cmd = "create table oniduser(onid_id varchar(10),instructor varchar(60), college varchar(60), url varchar(255));"
-            tt = 'oniduser'
-        else:
-            print "\nYou must specify a table name to be created. No tables were created and the program will now halt\n"
-            exit()
 
-        # Exucute the create command for the table requested
-        conn.execute(cmd);
 
+# After a complete load, remove the rows of table that the load did not touch. Those are offerings
+# or onid ids that are no longer found.
+def removeUnseen(table, seen):
+
+    tt = tableSchemas[table][0]
+
+    try:
+        conn = sqlite3.connect(masterDatabase)
+        cursor = conn.execute("delete from " + tt + " where seen is null or seen < ?;", (seen,))
         conn.commit()
-        print tt + " created successfully";
+        print str(cursor.rowcount) + " records no longer found were removed from the " + tt + " table"
         conn.close()
     except:
-        print "An error occured while tring one or more tables. System will now halt"
-        exit()
-
-   
+        print "An error occured while trying to remove old records from the " + tt + " table"
+        pass
 
-# def createcattables(table)
+# def removeUnseen(table, seen)
 
 
 
 # This function accepts the array holding catalog data in it and inserts into the OSUCatalog table
 # For refernce the array struct is [courseSub, courseNum, instructor, dept, cday, cstarttime, cendtime, cstartdate, cenddate, term, location, classtype, url]
-def populateOSUCatalog(arr):
+# pages is any iterable of lists of rows, one list per course page. Each page goes in through
+# executemany in its own short transaction, so the table is only locked while a page is written and
+# never while the next one is fetched. Rows that can not be inserted are written to the
+# catalogRejectFile instead of stopping the load. Every row loaded is stamped with seen.
+# Returns the number of rows loaded, or None if the database failed. Errors fetching or parsing the
+# pages are not caught, so that a failed crawl stops the run and can be resumed.
+def populateOSUCatalog(pages, seen):
 
     try:
         # Open our database
-        conn = sqlite3.connect(masterDatabase)
+        conn = bulkload.connect(masterDatabase)
         print "Opened database successfully -- Populating the OSUCatalog table please wait!";
+    except sqlite3.Error:
+        print "An error occured opening the database. No rows were inserted."
+        return None
 
-        # iterate over all the rows in our array and insert then into the database
+    cmd = upsertCommand('cat', ['coursecode','coursenum','instructor','college','scheduleddays','starttime','endtime','startdate','enddate','term','location','type','url','seen'])
 
-        for x in xrange(len(arr)):
-            #print arr[x][0], arr[x][1], arr[x][2], arr[x][3], arr[x][4], arr[x][5], arr[x][6], arr[x][7], arr[x][8], arr[x][9], arr[x][10], arr[x][11], arr[x][12]
-            cmd = "insert into OSUcatalog(coursecode,coursenum,instructor,college,scheduleddays,starttime,endtime,startdate,enddate,term,location,type,url) values(?,?,?,?,?,?,?,?,?,?,?,?,?);"
-       
-            # Exucute the create command for the table requested
-            conn.execute(cmd, (arr[x][0], arr[x][1], arr[x][2], arr[x][3], arr[x][4], arr[x][5], arr[x][6], arr[x][7], arr[x][8], arr[x][9], arr[x][10], arr[x][11], arr[x][12]));
-            conn.commit()
-    
-        print "Records were successfully interted into the OSUCatalog table";
+    # Each page's rejects are added to the file, so start it fresh
+    if os.path.exists(catalogRejectFile):
+        os.remove(catalogRejectFile)
+
+    loaded = 0
+    rejected = 0
+    try:
+        for rows in pages:
+            # Short rows are rejected by the loader
+            page = [tuple(row[:13]) + (seen,) for row in rows]
+            n, r = bulkload.load(conn, cmd, page, catalogRejectFile, reject_mode='ab')
+            loaded += n
+            rejected += r
+    except sqlite3.Error:
+        print "An error occured loading the OSUCatalog table after " + str(loaded) + " records were inserted."
+        return None
+    finally:
         conn.close()
-    except:
-        print "An error occured inserting a row into the database but efforts to finsh all other rows will continue."
-        pass
+
+    print str(loaded) + " records were successfully interted into the OSUCatalog table";
+    if rejected:
+        print str(rejected) + " records could not be inserted and were saved to " + catalogRejectFile
+
+    return loaded
 
     
-#def populateOSUCatalog(arr):
+#def populateOSUCatalog(pages, seen):
 
 
 
 # This function will take all the onid id's found and matched positivly to a Professor or staff and save to the oniduser table
-def populateOSUUsers(arr):
+# An onid id found more than once keeps the last row loaded for it. arr can be any iterable of rows.
+# Returns the number of rows loaded, or None if the load failed.
+def populateOSUUsers(arr, seen):
 
     
     try:
         # Open our database
-        conn = sqlite3.connect(masterDatabase)
+        conn = bulkload.connect(masterDatabase)
         print "Opened database successfully for oniduser record insertion -- Please wait!";
 
-        print "Inserting " + str(len(arr)) + " Records into the oniduser table. Please wait!";
+        cmd = upsertCommand('user', ['onid_id', 'instructor', 'college', 'url', 'seen'])
 
-        # iterate over all the rows in our array and insert then into the database
+        # Columns 0, 1, 2 and 4 of each row; short rows are rejected by the loader
+        rows = (tuple(row[i] for i in (0, 1, 2, 4) if i < len(row)) + (seen,) for row in arr)
+        loaded, rejected = bulkload.load(conn, cmd, rows, userRejectFile)
 
-        for x in xrange(len(arr)):
-            cmd = "insert into oniduser(onid_id, instructor, college, url) values(?,?,?,?);"
-       
-            # Exucute the create command for the table requested
-            conn.execute(cmd, (arr[x][0], arr[x][1], arr[x][2], arr[x][4]));
-            conn.commit()
-    
-        print "Records were successfully interted into the oniduser table";
+        print str(loaded) + " records were successfully interted into the oniduser table";
+        if rejected:
+            print str(rejected) + " records could not be inserted and were saved to " + userRejectFile
         conn.close()
-    except:
-        print "An error occured inserting a row into the database but efforts to finsh all other rows will continue."
-        pass
+    except sqlite3.Error:
+        print "An error occured loading the oniduser table. No rows were inserted."
+        return None
 
     print "Populate OSUUsers had Completed!"
+    return loaded
 
-# def populateOSUUsers(arr):
+# def populateOSUUsers(arr, seen):
 
 
 
@@ -270,154 +334,161 @@ def populateOSUUsers(arr):
 # the college or the course most of the time so I use this function to match a course with a key
 # that I was able to build based off hours of plugging in names in each dept and seeing what the 
 # on-line directory was actually searching by. There must be a better way but I was not able to find it. 
-# As a future enhancement this could be added to the DB with a set of accociations to each key. Them read 
-# into an array, hash table, or other method so the query only need to hit the DB once but a larger set
-# of associations over time wiht refinements could be made.
+# These keys are now only the starting point: the DeptIndex learns which keys actually find instructors
+# for each course code and getValidCourses tries those first.
+deptKeys = {
+    'ACTG': 'Business',
+    'AEC': 'Economics',
+    'AED': 'Agriculture',
+    'AG': 'Agriculture',
+    'AGRI': 'Agriculture',
+    'AHE': 'Education',
+    'ALS': '',
+    'ANS': 'Animal',
+    'ANTH': 'Anthropology',
+    'AREC': 'Economics',
+    'ART': 'Art',
+    'AS': 'Aerospace',
+    'ATS': 'Earth',
+    'ALS': 'Foreign',
+    'BA': 'Business',
+    'BB': 'Biochem',
+    'BEE': 'Engineering',
+    'BI': 'Biology',
+    'BIOE': 'Chem', 
+    'BOT': 'Botany',
+    'BRR': 'ag',
+    'CBEE': 'Chem',   
+    'CCE': 'civil',
+    'CE': 'civil',
+    'CEM': 'civil',
+    'CH': 'chemistry',
+    'CHE': 'chem',       
+    'CHN': 'foreign',
+    'COMM': 'comm',
+    'CROP': 'crop',
+    'CS': 'comp',
+    'CSS': 'ag',
+    'DHE': 'business',
+    'ECE': 'comp',
+    'ECON': 'economics',
+    'EECS': 'comp',
+    'ENG': 'lit',    
+    'ENGR': 'engr',  
+    'ENSC': 'earth',
+    'ENT': 'crop',
+    'ENVE': 'env',   
+    'ES': 'ethnic',
+    'EXSS': 'sport',
+    'FE': 'forest',
+    'FES': 'forest',
+    'FILM': 'film',
+    'FIN': 'business',
+    'FOR': 'forest',
+    'FR': 'foreign',
+    'FS': 'forest',
+    'FST': 'food',
+    'FW': 'fish',
+    'GD': 'business',
+    'GEO': 'sci',    
+    'GER': 'foreign',
+    'GPH': 'sci',
+    'GRAD': 'grad',  
+    'GS': 'sci',
+    'H': 'health',
+    'HC': 'honor',   
+    'HDFS': 'sci',
+    'HHS': 'sci',
+    'HORT': 'hort',    
+    'HST': 'hist',
+    'HSTS': 'hist',
+    'IE': 'engr',
+    'IEPA': 'OSU',
+    'IEPG': 'OSU',
+    'IEPH': 'OSU',
+    'INTL': 'int',
+    'IST': 'pol',
+    'IT': 'foreign',
+    'JCHS': '',
+    'JPN': 'foreign',
+    'LA': 'lit',
+    'LING': 'foreign',
+    'LS': '',
+    'MATS': 'engr',
+    'MB': 'Microbiology',
+    'MCB': '',
+    'ME': 'engr',
+    'MFGE': 'engr',
+    'MGMT': 'business',
+    'MIME': 'engr',
+    'MP': 'Nuclear',
+    'MPP': 'pol',
+    'MRKT': 'business',
+    'MRM': 'sea',
+    'MS': 'rotc',
+    'MTH': 'math',
+    'MUED': 'music',
+    'MUP': 'music',
+    'MUS': 'music',
+    'NE': 'Nuclear',
+    'NMC': 'comm',
+    'NR': 'forest',
+    'NS': 'rotc',
+    'NUTR': 'sci',
+    'OC': 'sci',
+    'OEAS': 'sci',
+    'PAC': 'sport',
+    'PAX': 'philo',
+    'PBG': 'hort',
+    'PH': 'physics',
+    'PHAR': 'pharm',
+    'PHL': 'philo',
+    'PPOL': 'pol',
+    'PS': 'pol',
+    'PSY': 'psycho',
+    'QS': '',
+    'RHP': 'rad',
+    'RNG': 'animal',
+    'RS': '',
+    'RUS': 'foreign',
+    'SED': 'edu',
+    'SOC': 'soc',
+    'SPAN': 'foreign',
+    'SOIL': 'sci',
+    'ST': 'stat',
+    'SUS': 'crop',
+    'TA': 'comm',
+    'TCE': 'education',
+    'TOX': 'toxic',
+    'VMB': 'vet',
+    'VMC': 'vet',
+    'WGSS': 'women',
+    'WLC': 'foreign',
+    'WR': 'lit',
+    'WRE': '',
+    'WRP': '',
+    'WRS': 'sci',
+    'WSE': 'sci',
+    'Z': 'zoo',
+}
+
+
+
+# Returns the hand-built directory search key for a course code, or '' if there is none
 def findDeptKey(question):
   
-    return {
-        'ACTG': 'Business',
-        'AEC': 'Economics',
-        'AED': 'Agriculture',
-        'AG': 'Agriculture',
-        'AGRI': 'Agriculture',
-        'AHE': 'Education',
-        'ALS': '',
-        'ANS': 'Animal',
-        'ANTH': 'Anthropology',
-        'AREC': 'Economics',
-        'ART': 'Art',
-        'AS': 'Aerospace',
-        'ATS': 'Earth',
-        'ALS': 'Foreign',
-        'BA': 'Business',
-        'BB': 'Biochem',
-        'BEE': 'Engineering',
-        'BI': 'Biology',
-        'BIOE': 'Chem', 
-        'BOT': 'Botany',
-        'BRR': 'ag',
-        'CBEE': 'Chem',   
-        'CCE': 'civil',
-        'CE': 'civil',
-        'CEM': 'civil',
-        'CH': 'chemistry',
-        'CHE': 'chem',       
-        'CHN': 'foreign',
-        'COMM': 'comm',
-        'CROP': 'crop',
-        'CS': 'comp',
-        'CSS': 'ag',
-        'DHE': 'business',
-        'ECE': 'comp',
-        'ECON': 'economics',
-        'EECS': 'comp',
-        'ENG': 'lit',    
-        'ENGR': 'engr',  
-        'ENSC': 'earth',
-        'ENT': 'crop',
-        'ENVE': 'env',   
-        'ES': 'ethnic',
-        'EXSS': 'sport',
-        'FE': 'forest',
-        'FES': 'forest',
-        'FILM': 'film',
-        'FIN': 'business',
-        'FOR': 'forest',
-        'FR': 'foreign',
-        'FS': 'forest',
-        'FST': 'food',
-        'FW': 'fish',
-        'GD': 'business',
-        'GEO': 'sci',    
-        'GER': 'foreign',
-        'GPH': 'sci',
-        'GRAD': 'grad',  
-        'GS': 'sci',
-        'H': 'health',
-        'HC': 'honor',   
-        'HDFS': 'sci',
-        'HHS': 'sci',
-        'HORT': 'hort',    
-        'HST': 'hist',
-        'HSTS': 'hist',
-        'IE': 'engr',
-        'IEPA': 'OSU',
-        'IEPG': 'OSU',
-        'IEPH': 'OSU',
-        'INTL': 'int',
-        'IST': 'pol',
-        'IT': 'foreign',
-        'JCHS': '',
-        'JPN': 'foreign',
-        'LA': 'lit',
-        'LING': 'foreign',
-        'LS': '',
-        'MATS': 'engr',
-        'MB': 'Microbiology',
-        'MCB': '',
-        'ME': 'engr',
-        'MFGE': 'engr',
-        'MGMT': 'business',
-        'MIME': 'engr',
-        'MP': 'Nuclear',
-        'MPP': 'pol',
-        'MRKT': 'business',
-        'MRM': 'sea',
-        'MS': 'rotc',
-        'MTH': 'math',
-        'MUED': 'music',
-        'MUP': 'music',
-        'MUS': 'music',
-        'NE': 'Nuclear',
-        'NMC': 'comm',
-        'NR': 'forest',
-        'NS': 'rotc',
-        'NUTR': 'sci',
-        'OC': 'sci',
-        'OEAS': 'sci',
-        'PAC': 'sport',
-        'PAX': 'philo',
-        'PBG': 'hort',
-        'PH': 'physics',
-        'PHAR': 'pharm',
-        'PHL': 'philo',
-        'PPOL': 'pol',
-        'PS': 'pol',
-        'PSY': 'psycho',
-        'QS': '',
-        'RHP': 'rad',
-        'RNG': 'animal',
-        'RS': '',
-        'RUS': 'foreign',
-        'SED': 'edu',
-        'SOC': 'soc',
-        'SPAN': 'foreign',
-        'SOIL': 'sci',
-        'ST': 'stat',
-        'SUS': 'crop',
-        'TA': 'comm',
-        'TCE': 'education',
-        'TOX': 'toxic',
-        'VMB': 'vet',
-        'VMC': 'vet',
-        'WGSS': 'women',
-        'WLC': 'foreign',
-        'WR': 'lit',
-        'WRE': '',
-        'WRP': '',
-        'WRS': 'sci',
-        'WSE': 'sci',
-        'Z': 'zoo',
-        }.get(question, '') 
+    return deptKeys.get(question, '')
 
 # def findDeptKey(question):
 
 
 
-# This function will clear array s, query distinct on instuctor and course section, lookup our search keys from findDeptKey function
-# construct a URL with all required search terms embedded and save this list to array s for processing of final scrape and save to DB 
-def getValidCourses(arr):
+# This function will query distinct on instuctor and course section, look up the directory search keys
+# to try for each from the DeptIndex (falling back on findDeptKey), construct a URL with all required
+# search terms embedded and look the instructor up in the directory. The keys that have found instructors
+# for a course code before are tried first, in order of their hit rate, and the first one to find an
+# onid id wins. Every search made updates the index. Returns an iterator over the matched rows.
+def getValidCourses():
 
      
     # Get records from database
@@ -428,15 +499,7 @@ def getValidCourses(arr):
 
         cmd = "SELECT DISTINCT instructor, coursecode, college FROM OSUCatalog;"
        
-        cursor = conn.execute(cmd)
-        for row in cursor:
-            url = 'http://directory.oregonstate.edu/?type=search&cn='+row[0]+'&osudepartment='+findDeptKey(row[1])+'&affiliation=employee'
-            onid_id = getonid(url)
-            print onid_id
-            if onid_id is None:
-                continue
-            else:
-                arr.append([onid_id, row[0], row[2], findDeptKey(row[1]), url ])
+        rows = conn.execute(cmd).fetchall()
         
         print "Retrieved DISTINCT records from OSUCatalog for further processing";
         conn.close()
@@ -444,28 +507,132 @@ def getValidCourses(arr):
         print "An error occued trying to open or read the records from the OSUCatalog. This application will now exit"
         exit()
 
+    index = DeptIndex(masterDatabase)
+    if len(index) == 0:
+        print "Learned department keys from " + str(index.learn()) + " earlier onid matches"
 
-    # Now we let the user know how many id's we cound and those will be committed to the Db
-    print "Results are: " + str(len(arr)) + " Instructors and Staff were matched."
-    
-    return arr
+    # Each instructor is looked up once per course code they teach, whatever college the rows name
+    pairs = sorted(set((row[0], row[1]) for row in rows))
+    tasks = [(instructor, coursecode, index.candidates(coursecode, findDeptKey(coursecode), maxDeptTries))
+             for instructor, coursecode in pairs]
+
+    # Directory lookups a previous run already finished, if we are resuming
+    known = journal.done('onid') if journal is not None else {}
+
+    found = {}
+    searches = 0
+    try:
+        for instructor, coursecode, attempts in resolveOnids(tasks, known):
+            for deptkey, url, onid_id, cached in attempts:
+                if not cached:
+                    searches += 1
+                    if journal is not None:
+                        journal.mark_done('onid', url, onid_id)
+                index.record(coursecode, deptkey, onid_id is not None)
+                if onid_id is not None:
+                    found[(instructor, coursecode)] = (onid_id, deptkey, url)
+                print onid_id
+    except:
+        index.close()
+        print "An error occued looking up onid ids in the directory. This application will now exit"
+        exit()
+
+    index.save()
+    index.close()
+
+    if pairs:
+        print str(searches) + " directory searches for " + str(len(pairs)) + " instructors and course codes, " + "%.2f" % (float(searches) / len(pairs)) + " per instructor"
+
+    return matchedUsers(rows, found)
 
 
 # def getValidCourses():
 
 
+
+# Yields an oniduser row for each DISTINCT catalog row whose instructor was found in the directory
+def matchedUsers(rows, found):
+
+    matched = 0
+    for row in rows:
+        match = found.get((row[0], row[1]))
+        if match is None:
+            continue
+        else:
+            onid_id, deptkey, url = match
+            matched += 1
+            yield (onid_id, row[0], row[2], deptkey, url)
+
+
+    # Now we let the user know how many id's we cound and those will be committed to the Db
+    print "Results are: " + str(matched) + " Instructors and Staff were matched."
+
+# def matchedUsers(rows, found):
+
+
+# Build the directory search URL for an instructor using the given department search key
+def getDirectoryUrl(instructor, deptkey):
+    return 'http://directory.oregonstate.edu/?type=search&cn='+instructor+'&osudepartment='+deptkey+'&affiliation=employee'
+
+# def getDirectoryUrl(instructor, deptkey):
+
+
+
+# Runs the directory searches for tasks of (instructor, coursecode, department keys) on a pool of onidWorkers
+# threads. Each task tries its keys in order until one finds an onid id, and is yielded back as
+# (instructor, coursecode, attempts) with a (deptkey, url, onid_id, cached) entry for each search tried.
+# Results in known, and searches another thread has made or is making, are reused rather than
+# fetched again. The fetcher's rate limit keeps the pool from hammering the directory server.
+def resolveOnids(tasks, known):
+
+    results = dict(known)
+    inflight = {}
+    lock = threading.Lock()
+
+    def search(url):
+        with lock:
+            if url in results:
+                return results[url], True
+            waiting = inflight.get(url)
+            if waiting is None:
+                inflight[url] = threading.Event()
+
+        if waiting is not None:
+            waiting.wait()
+            return results.get(url), True
+
+        try:
+            onid_id = getonid(url)
+            results[url] = onid_id
+        finally:
+            inflight[url].set()
+        return onid_id, False
+
+    def lookup(task):
+        instructor, coursecode, deptkeys = task
+        attempts = []
+        for deptkey in deptkeys:
+            url = getDirectoryUrl(instructor, deptkey)
+            onid_id, cached = search(url)
+            attempts.append((deptkey, url, onid_id, cached))
+            if onid_id is not None:
+                break
+        return [(instructor, coursecode, attempts)]
+
+    stage = Stage('onid', lookup, workers=onidWorkers, queue_size=onidWorkers * 2)
+    return Pipeline(iter(tasks), [stage], queue_size=onidWorkers * 2)
+
+# def resolveOnids(tasks, known):
+
+
+
 # Function takes url from getValidCourses() and sees if we can extract an onid id from the page
 # if so we will return the onid id else we return NOID and we will exclude this from our result
 def getonid(url):
     onid_id = None       # holds the value of the extracted onid id
 
-     # Call the custom opener
-    myopener = MyOpener()
-    page = myopener.open(url)
- 
-    # Read our page into variable
-    text = page.read()
-    page.close()
+    # Read our page into variable through the custom opener
+    text = fetcher.fetch(url, MyOpener())
    
     # Soup our object
     soup = BeautifulSoup(text)
@@ -492,18 +659,30 @@ def getonid(url):
 
 
 
-# Process the course page for each URL. 
+# Process the course page for each URL, returning an iterator over its catalog rows
 # NOTE: Code was left as small incremental steps so that changes can be made
 # easily for changes in forms without complicated nesting
 def get_course_info(url):
+    print "Starting parse of individual class links. Please wait!"
+
+
+    # Read our page into variable through the custom opener
+    text = fetcher.fetch(url, MyOpener())
+
+    return parse_course_page(text, url)
+
+# get_course_info(url)
+
+
+
+# Parse the text of a course page fetched from url and yield its rows one at a time. Each row is
+# a tuple of (courseSub, courseNum, instructor, dept, cday, cstarttime, cendtime, cstartdate, cenddate, term, location, classtype, url)
+def parse_course_page(text, url):
     courseSub = None     # Course Subject code obtained from URL
     courseNum = None     # Course number obtained from URL
-    coursedec = None     # Course Description
     instructor = None    # Instructor Nanme
     dept = None          # Department 
     cday = None          # Course Day(s) (temporary)
-    cstartday = None     # Course schedule Start Date
-    cendday = None       # Course schedule End Date
     ctime = None         # Course Timez(s) (temporary)
     cstarttime = None    # Course Scheduled Start Time 
     cendtime = None      # Course Scheduled End Time
@@ -513,25 +692,6 @@ def get_course_info(url):
     location = None      # campus
     classtype = None     # The type of class Lec, Studio, Lab, etc
 
-    print "Starting parse of individual class links. Please wait!"
-
-
-    # Call the custom opener
-    myopener = MyOpener()
-    page = myopener.open(url)
- 
-    # Read our page into variable
-    text = page.read()
-    page.close()
-
-   
-    # Soup our object
-    soup = BeautifulSoup(text)
-
-    # Strip all characters that we don't want to deal wiht or cause issues
-    for e in soup.findAll('br'):
-        e.replace_with("\t")
-
     # First let's process the URL and get the Course subject and course number from it 
     m = re.search('subjectcode=(.+?)&', url)  
     if m:
@@ -543,6 +703,18 @@ def get_course_info(url):
         courseNum = m.group(1)
         #print courseNum 
 
+    if parseMode == 'lxml':
+        for row in get_course_rows_lxml(text, courseSub, courseNum, url):
+            yield row
+        print "Completed parse of individual class links!"
+        return
+
+    # Soup our object
+    soup = BeautifulSoup(text)
+
+    # Strip all characters that we don't want to deal wiht or cause issues
+    for e in soup.findAll('br'):
+        e.replace_with("\t")
 
 
     # Move to first place of interest on page and get department
@@ -564,18 +736,19 @@ def get_course_info(url):
 
    
     # for each tr in this table get all data from td's and parse results. This is where we are actually 
-    # parsing most of the data from the course pages.
+    # parsing most of the data from the course pages. Each row's cells are looked up once and read in order.
     for alltr in tempmove.find_all("tr"):
-        if alltr.find("td") is None:
+        tds = alltr.find_all("td", recursive=False)
+        if not tds:
             continue   #do nothing        
         else:
             try:
                 # Get the term offered from the first td 
-                term = alltr.find("td").contents[0].strip()
+                term = tds[0].contents[0].strip()
                 #print term
     
                 # Get the instructor from the next td
-                instructor = alltr.find("td").next_sibling.contents[0].strip()
+                instructor = tds[1].contents[0].strip()
                 
                 # Eliminate entries and move to next if we find only staff or blank for instructor. We can not match with any onid_id
                 if instructor == 'Staff':
@@ -586,14 +759,11 @@ def get_course_info(url):
                 #print instructor 
    
                 # Get day/time/date from next td. This will need to be split into parts below
-                dt = alltr.find("td").next_sibling.next_sibling
+                dt = tds[2].contents
                   
-                daystemp = alltr.find("td").next_sibling.next_sibling.contents[0].strip()
-                cstartdatetemp = alltr.find("td").next_sibling.next_sibling.contents[2].strip()
+                daystemp = dt[0].strip()
+                cstartdatetemp = dt[2].strip()
             
-                #print daystemp
-                #print daystemp1 
-
                 # Split the daystemp into the parts: day(s) of week (cday), time frame of day (ctime), and class start and end dates (cstartdate, cenddate)
                 cday,ctime = daystemp.split();
                 #print cday
@@ -603,23 +773,107 @@ def get_course_info(url):
                 cstartdate, cenddate = cstartdatetemp.split('-') 
                 cstarttime, cendtime = ctime.split('-')
             
-                location = alltr.find("td").next_sibling.next_sibling.next_sibling.contents[0].strip()
+                location = tds[3].contents[0].strip()
                 #print location 
 
-                classtype = alltr.find("td").next_sibling.next_sibling.next_sibling.next_sibling.contents[0].strip()
+                classtype = tds[4].contents[0].strip()
                 #print classtype 
                      
-
-                # Assemble individual parts of course into a list to be inserted into out array
-                d.append([courseSub, courseNum, instructor, dept, cday, cstarttime, cendtime, cstartdate, cenddate, term, location, classtype, url])
-                #print d[0][4]
             except:
-                pass
-    #print d   
+                continue
+
+            # Hand the course back as one row
+            yield (courseSub, courseNum, instructor, dept, cday, cstarttime, cendtime, cstartdate, cenddate, term, location, classtype, url)
 
     print "Completed parse of individual class links!"
 
-# get_course_info(url)
+# parse_course_page(text, url)
+
+
+
+# Returns the pieces of a table cell the same way BeautifulSoup's 'contents' does
+# once every <br> has been replaced with a tab: text runs and child elements in order.
+def cell_contents(td):
+    contents = []
+    if td.text:
+        contents.append(td.text)
+    for child in td:
+        if child.tag == 'br':
+            contents.append("\t")
+        else:
+            contents.append(child)
+        if child.tail:
+            contents.append(child.tail)
+    return contents
+
+# def cell_contents(td)
+
+
+
+# lxml version of the row parsing in get_course_info. Only the college link and the
+# offerings table are looked up, and each row's cells are read once.  Rows are yielded
+# exactly as the BeautifulSoup version yields them.
+def get_course_rows_lxml(text, courseSub, courseNum, url):
+
+    doc = lxml_html.fromstring(text)
+
+    # Move to the first link in the form and get the college department from it
+    dept = doc.xpath("(//form[@id='aspnetForm']//a)[1]")[0].text_content()
+
+    tables = doc.xpath("//form[@id='aspnetForm']//table[@id=$id]", id=OFFERING_TABLE_ID)
+    if not tables:
+        s_err.append(url)
+        saveFiles(url)
+        return
+
+    for alltr in tables[0].iter("tr"):
+        tds = alltr.findall("td")
+        if not tds:
+            continue
+        try:
+            cells = [cell_contents(td) for td in tds[:5]]
+
+            term = cells[0][0].strip()
+            instructor = cells[1][0].strip()
+
+            # Eliminate entries that we can not match with any onid_id
+            if instructor == 'Staff' or instructor == '':
+                continue
+
+            cday, ctime = cells[2][0].strip().split()
+            cstartdate, cenddate = cells[2][2].strip().split('-')
+            cstarttime, cendtime = ctime.split('-')
+
+            location = cells[3][0].strip()
+            classtype = cells[4][0].strip()
+        except:
+            continue
+
+        yield (courseSub, courseNum, instructor, dept, cday, cstarttime, cendtime, cstartdate, cenddate, term, location, classtype, url)
+
+# def get_course_rows_lxml(text, courseSub, courseNum, url)
+
+
+
+# Yields the catalog rows of every course page in urls, as one list per page. Pages a previous run
+# parsed are taken from the journal, looked up one at a time; every other page is fetched, parsed
+# and recorded in the journal as done.
+def catalogPages(urls):
+
+    progressIndicator = (len(urls)-1)
+    i=0
+    for newurl in urls:
+        print newurl
+        # Pick up the rows a previous run parsed from this page
+        rows = journal.get('course', newurl)
+        if rows is None:
+            rows = list(get_course_info(newurl))
+            journal.mark_done('course', newurl, rows)
+        yield rows
+        i = i +1
+        print str(i) + ' of ' + str(progressIndicator) 
+
+# def catalogPages(urls)
 
 
 
@@ -631,11 +885,7 @@ def get_category_links(url):
 
     print "Parsing top OSU catalog page to get all links to course offerings...."
 
-    myopener = MyOpener()
-    page = myopener.open(url)
- 
-    text = page.read()
-    page.close()
+    text = fetcher.fetch(url, MyOpener())
  
     soup = BeautifulSoup(text)
 
@@ -653,12 +903,7 @@ def get_category_links(url):
 # get_category_links(url)
 
 def process(url):
-    myopener = MyOpener()
-    #page = urllib.urlopen(url)
-    page = myopener.open(url)
- 
-    text = page.read()
-    page.close()
+    text = fetcher.fetch(url, MyOpener())
  
     soup = BeautifulSoup(text)
  
@@ -669,7 +914,7 @@ def process(url):
 
 # process(url)
  
-def main():
+def main(resume=False):
 
 # Define the URL to the OSU Catalog
     url = 'http://catalog.oregonstate.edu/CourseSearcher.aspx?chr=abcdeg'
@@ -677,6 +922,18 @@ def main():
     #testurl = 'http://catalog.oregonstate.edu/CourseDetail.aspx?subjectcode=BA&coursenumber=370&campus=corvallis&Columns=ajkmn'
 
     global target_name
+    global journal
+
+    # Rows loaded by this run are stamped with its start time
+    seen = int(time.time())
+
+    # Every course page parsed and every directory lookup made is recorded in the journal
+    # along with its results, so that a run that dies partway can be restarted with --resume
+    journal = Journal('catalog')
+    if resume:
+        print "Resuming: " + str(journal.count('course')) + " course pages and " + str(journal.count('onid')) + " directory lookups already done"
+    else:
+        journal.reset()
  
     # See if previous error_File.txt file exist and if so create new file name leaving old for history 
     if os.path.exists(target_name):
@@ -695,45 +952,44 @@ def main():
     #get_course_info(testurl)
 
 
-    progressIndicator = (len(s)-1)
-    i=0
-    for newurl in s:
-        print newurl
-        get_course_info(newurl)
-        i = i +1
-        print str(i) + ' of ' + str(progressIndicator) 
-
-      
-    # For inspection we save our array each run so we can check results
-    saveArray(d, 1)
-
-    # Save the results so far to the database after we clear the table first
-    dropCattables("cat")
+    # Each course page is parsed as the load reaches it and its rows go straight through the
+    # results file into the database. Save the results to the database, updating the rows
+    # already there, then clear out the offerings this run did not find
     createcattables("cat")
-    populateOSUCatalog(d)
+    loaded = populateOSUCatalog(savePages(catalogPages(s), 1), seen)
+    if loaded is not None:
+        removeUnseen("cat", seen)
     
     # Now for every page we have collected that had valid instructor and course data on the page we 
     # will now match them against the OSU Online Directory and see if we can extract a onid ID for them.
-    getValidCourses(t)
+    users = getValidCourses()
 
-   
-    # Save the resuults from the final scrape to disk for inspection later
-    saveArray(t, 0)
-   
-    # Save the results of onid matching to database after we clear the table first
-    dropCattables("user")
+    # Save all results to the oniduser table in the database, and to disk for inspection later.
+    # The unique index on onid_id ensures only one onid ID per instructor.
     createcattables("user")
-
-    # Save all results to the oniduser table in the database. 
-    populateOSUUsers(t)
-
-    # Final scrub to ensure only one onid ID per instructor.
-    cleanupFinal()
+    if populateOSUUsers(saveRows(users, 0), seen) is not None:
+        removeUnseen("user", seen)
 
     print "\nAll records and processes have completed! You cam check the output files and the database tables for errors or to inspect results!\n"
     print "\nPROCESS COMPLETE -- GOODBYE!\n"
 
+    journal.close()
+
+    return loaded or 0
+
 # main()
  
 if __name__ == "__main__":
-    main()
+    argparser = argparse.ArgumentParser(description='Scrape the OSU course catalog and match instructors to ONIDs')
+    argparser.add_argument('--resume', action='store_true',
+                           help='skip course pages and directory lookups finished by a previous run')
+    argparser.add_argument('--workers', type=int, default=onidWorkers,
+                           help='number of threads looking up onid ids in the directory')
+    argparser.add_argument('--rate', type=float, default=directoryRate,
+                           help='most requests per second to make to any one server (0 for no limit)')
+    fetcher.add_arguments(argparser)
+    args = argparser.parse_args()
+    fetcher.configure_from_args(args)
+    fetcher.set_rate_limit(args.rate)
+    onidWorkers = args.workers
+    main(resume=args.resume)
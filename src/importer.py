@@ -0,0 +1,215 @@
+#!/usr/bin/env python2
+# Seeds the user and event tables from the results files getOSUCatalog.py
+# leaves on disk, without going back to the network:
+#
+#   results_file.txt       one catalog section per line
+#   onid_results_file.txt  one instructor matched to an ONID per line
+#
+#   python importer.py [--results FILE] [--onids FILE]
+#
+# Sections are joined to ONIDs on the instructor's name and college.
+
+import argparse
+import csv
+
+from database import db_init, engine
+from models import Event, User, user_event
+from scraper import courseinfo_to_fields, parse_courseinfo
+from sqlalchemy import func, select
+
+
+RESULTS_FILE = 'results_file.txt'
+ONID_RESULTS_FILE = 'onid_results_file.txt'
+
+
+def _fields(row, before, after):
+    """ Returns the columns of a results file row: 'before' columns, the
+        instructor's name, the college and 'after' more.  Returns None for
+        short rows.
+
+        getOSUCatalog.py quotes names ("Last, F.") and colleges with commas
+        of their own.  Files from before it did are unquoted, so there the
+        name is taken as its last name and what follows the first comma,
+        and the college as everything else up to the last 'after' columns.
+    """
+    fields = [field.decode('utf-8') for field in row]
+    width = before + after + 2
+    if len(fields) < width:
+        return None
+    if len(fields) > width:
+        name = fields[before] + u',' + fields[before + 1]
+        college = u','.join(fields[before + 2:len(fields) - after])
+        fields = fields[:before] + [name, college] + fields[len(fields) - after:]
+    return fields
+
+
+def _rows(path):
+    with open(path, 'rb') as f:
+        for row in csv.reader(f):
+            yield row
+
+
+def read_sections(path):
+    """ Yields the course dictionaries get_course_mappings() would have
+        produced for each row of a results file
+    """
+    for row in _rows(path):
+        fields = _fields(row, 2, 9)
+        if fields is None:
+            continue
+        (subject, number, instructor, dept, days, start, end, start_date,
+             end_date, term, location, classtype, url) = fields
+        yield {
+            'Term': term,
+            'StartDate': start_date,
+            'EndDate': end_date,
+            'Day/Time/Date': "{0} {1}-{2}{3}-{4}".format(days, start, end,
+                                                        start_date, end_date),
+            'Instructor': instructor,
+            # The results file has neither
+            'CRN': None,
+            'Sec': None,
+            'dept': dept,
+            'course': "{0} {1}".format(subject, number),
+        }
+
+
+def read_onids(path):
+    """ Yields (onid, instructor, college, department key) for each row of an
+        ONID results file
+    """
+    for row in _rows(path):
+        # The directory URL at the end of the row repeats the name, comma and
+        # all, so split it off first
+        url = [i for i, field in enumerate(row) if field.startswith('http')]
+        if url:
+            row = row[:url[0]]
+        fields = _fields(row, 1, 1)
+        if fields is None:
+            continue
+        onid, instructor, college, deptkey = fields
+        yield onid, instructor, college, deptkey
+
+
+def event_key(fields):
+    """ Returns what identifies an event across imports.  Several instructors
+        teaching the same section share one event.
+    """
+    days = fields.get('weekdays') or []
+    return (fields.get('description'), fields.get('term'),
+            fields.get('start_date'), fields.get('end_date'),
+            fields.get('start_time'), fields.get('end_time'),
+            ''.join(str(day) for day in days))
+
+
+def import_results(results_path=RESULTS_FILE, onid_path=ONID_RESULTS_FILE):
+    """ Loads both results files into the user, event and user_event tables
+        in a single transaction.  Users, events and links already in the
+        database are left alone, so importing twice adds nothing.
+
+        Returns a dictionary of counts.
+    """
+    counts = dict.fromkeys(['users', 'events', 'links', 'sections',
+                            'unmatched', 'ambiguous', 'invalid'], 0)
+
+    # (instructor, college) -> onid, or None when two ONIDs share the pair
+    onids = {}
+    users = {}
+    for onid, instructor, college, deptkey in read_onids(onid_path):
+        key = (instructor, college)
+        if key in onids and onids[key] != onid:
+            onids[key] = None
+        else:
+            onids[key] = onid
+        # Names are "Last, F.", where the last name may have spaces or
+        # hyphens of its own ("Abi Nader, P.", "Graham Jr, R.")
+        lname, sep, fname = instructor.partition(',')
+        users[onid] = {
+            'onid': onid,
+            'fname': fname.strip() if sep else instructor,
+            'lname': lname.strip() if sep else instructor,
+            'dept': deptkey,
+        }
+
+    with engine.begin() as conn:
+        existing_users = set(row[0] for row in conn.execute(select([User.onid])))
+
+        event_table = Event.__table__
+        existing_events = {}
+        for row in conn.execute(select([event_table])):
+            existing_events[event_key(dict(row))] = row['id']
+        next_id = (conn.execute(select([func.max(event_table.c.id)])).scalar() or 0) + 1
+
+        existing_links = set(
+            (row[0], row[1]) for row in conn.execute(
+                select([user_event.c.onid, user_event.c.eid])))
+
+        new_events = []
+        new_links = []
+        linked = set()
+        for course in read_sections(results_path):
+            counts['sections'] += 1
+            onid = onids.get((course['Instructor'], course['dept']), False)
+            if onid is False:
+                counts['unmatched'] += 1
+                continue
+            if onid is None:
+                counts['ambiguous'] += 1
+                continue
+
+            try:
+                fields = courseinfo_to_fields(parse_courseinfo(course))
+            except ValueError:
+                counts['invalid'] += 1
+                continue
+            key = event_key(fields)
+            eid = existing_events.get(key)
+            if eid is None:
+                eid = existing_events[key] = next_id
+                next_id += 1
+                fields['id'] = eid
+                new_events.append(fields)
+
+            link = (onid, eid)
+            if link not in existing_links and link not in linked:
+                linked.add(link)
+                new_links.append({'onid': onid, 'eid': eid})
+
+        new_users = [user for onid, user in sorted(users.items())
+                     if onid not in existing_users]
+
+        if new_users:
+            conn.execute(User.__table__.insert(), new_users)
+        if new_events:
+            conn.execute(event_table.insert(), new_events)
+        if new_links:
+            conn.execute(user_event.insert(), new_links)
+
+    counts['users'] = len(new_users)
+    counts['events'] = len(new_events)
+    counts['links'] = len(new_links)
+    return counts
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Import the results files left by getOSUCatalog.py into '
+                    'the user and event tables')
+    argparser.add_argument('--results', default=RESULTS_FILE,
+                           help='catalog sections file (default: %(default)s)')
+    argparser.add_argument('--onids', default=ONID_RESULTS_FILE,
+                           help='ONID matches file (default: %(default)s)')
+    args = argparser.parse_args()
+
+    db_init()
+    counts = import_results(args.results, args.onids)
+
+    print("Read {0} sections: {1} matched no ONID, {2} matched more than one, "
+          "{3} could not be read".format(counts['sections'], counts['unmatched'],
+                                         counts['ambiguous'], counts['invalid']))
+    print("Added {0} users, {1} events and {2} user/event links".format(
+        counts['users'], counts['events'], counts['links']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+
+import simplejson as json
+
+from config import DATA_DIR
+
+
+# The journal lives next to the main database, but in its own file so that
+# dropping and recreating the catalog tables never touches it.
+JOURNAL_PATH = os.path.join(DATA_DIR, 'journal.db')
+
+
+class Journal(object):
+    """ Persistent record of the work a long scraper run has finished.
+
+        Entries are grouped by job (e.g. 'scraper' or 'catalog') and kind
+        (e.g. 'link' or 'course'), and are keyed by whatever uniquely names
+        the unit of work, usually its URL.  Each entry may carry a JSON
+        payload holding the results of that unit, so a resumed run can pick
+        them back up without repeating the work.
+    """
+    def __init__(self, job, path=JOURNAL_PATH):
+        self.job = job
+        self.path = path
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS progress ("
+                          "job VARCHAR(20) NOT NULL, "
+                          "kind VARCHAR(20) NOT NULL, "
+                          "key TEXT NOT NULL, "
+                          "payload TEXT, "
+                          "finished TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+                          "PRIMARY KEY (job, kind, key));")
+        self.conn.commit()
+
+    def reset(self):
+        """ Forget everything recorded for this job """
+        self.conn.execute("DELETE FROM progress WHERE job = ?;", (self.job,))
+        self.conn.commit()
+
+    def mark_done(self, kind, key, payload=None):
+        """ Record that the unit of work 'key' of type 'kind' has finished """
+        if payload is not None:
+            payload = json.dumps(payload)
+        self.conn.execute("INSERT OR REPLACE INTO progress (job, kind, key, payload) "
+                          "VALUES (?, ?, ?, ?);", (self.job, kind, key, payload))
+        self.conn.commit()
+
+    def mark_all_done(self, kind, keys):
+        """ Record a group of finished units of work, without payloads, in a
+            single transaction
+        """
+        self.conn.executemany("INSERT OR REPLACE INTO progress (job, kind, key, payload) "
+                              "VALUES (?, ?, ?, NULL);",
+                              [(self.job, kind, key) for key in keys])
+        self.conn.commit()
+
+    def is_done(self, kind, key):
+        cursor = self.conn.execute("SELECT 1 FROM progress WHERE job = ? AND "
+                                   "kind = ? AND key = ?;", (self.job, kind, key))
+        return cursor.fetchone() is not None
+
+    def get(self, kind, key, default=None):
+        """ Returns the payload recorded for the unit of work 'key' of type
+            'kind', or 'default' if it hasn't finished
+        """
+        cursor = self.conn.execute("SELECT payload FROM progress WHERE job = ? AND "
+                                   "kind = ? AND key = ?;", (self.job, kind, key))
+        row = cursor.fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0]) if row[0] is not None else None
+
+    def done(self, kind):
+        """ Returns a dictionary of finished keys of type 'kind' mapped to
+            their payloads
+        """
+        cursor = self.conn.execute("SELECT key, payload FROM progress WHERE "
+                                   "job = ? AND kind = ?;", (self.job, kind))
+        ret = {}
+        for key, payload in cursor:
+            if payload is not None:
+                payload = json.loads(payload)
+            ret[key] = payload
+        return ret
+
+    def count(self, kind):
+        cursor = self.conn.execute("SELECT COUNT(*) FROM progress WHERE "
+                                   "job = ? AND kind = ?;", (self.job, kind))
+        return cursor.fetchone()[0]
+
+    def close(self):
+        self.conn.close()
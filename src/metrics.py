@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+
+import diag
+
+
+# In-process request and stage timings, exposed in the Prometheus text format
+# by the webapp's /metrics route:
+#
+#   with metrics.stage('freebusy'):
+#       ...
+#
+# Each stage's duration goes into the cloudendar_stage_seconds histogram, and
+# into the timings of the request being handled, if any.  A request slower
+# than CLOUDENDAR_SLOW_REQUEST seconds is logged with its stage timings.
+
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Requests that take longer than this many seconds are logged with the time
+# each stage took.  Unset to log none.
+SLOW_REQUEST_SECONDS = os.environ.get('CLOUDENDAR_SLOW_REQUEST')
+if SLOW_REQUEST_SECONDS is not None:
+    SLOW_REQUEST_SECONDS = float(SLOW_REQUEST_SECONDS)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+tracer = diag.get_tracer('metrics')
+
+_lock = threading.Lock()
+_metrics = []
+_watched = []
+# The request being handled by this thread (or greenlet, under gevent)
+_current = threading.local()
+
+
+def _escape(value):
+    return unicode(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = zip(names, values)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, _escape(value))
+                          for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help),
+                 "# TYPE {0} counter".format(self.name)]
+        with _lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append("{0}{1} {2}".format(
+                    self.name, _labels(self.labelnames, labels), _number(value)))
+        return lines
+
+
+class Histogram(object):
+    def __init__(self, name, help, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # labels -> [count in each bucket, sum, count]
+        self.values = {}
+
+    def observe(self, value, labels=()):
+        with _lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help),
+                 "# TYPE {0} histogram".format(self.name)]
+        with _lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append("{0}_bucket{1} {2}".format(
+                        self.name,
+                        _labels(self.labelnames, labels, ('le', _number(bound))),
+                        cumulative))
+                label_str = _labels(self.labelnames, labels)
+                lines.append("{0}_sum{1} {2}".format(self.name, label_str, _number(total)))
+                lines.append("{0}_count{1} {2}".format(self.name, label_str, count))
+        return lines
+
+
+def counter(name, help, labelnames=()):
+    """ Creates a Counter and adds it to what render() reports """
+    metric = Counter(name, help, labelnames)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name, help, labelnames=(), buckets=BUCKETS):
+    """ Creates a Histogram and adds it to what render() reports """
+    metric = Histogram(name, help, labelnames, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+requests_total = counter('cloudendar_requests_total',
+                         'HTTP requests handled',
+                         ('route', 'method', 'status'))
+request_seconds = histogram('cloudendar_request_seconds',
+                            'Time taken to handle HTTP requests',
+                            ('route', 'method'))
+stage_seconds = histogram('cloudendar_stage_seconds',
+                          'Time taken by each stage of answering a search',
+                          ('stage',))
+
+
+class _Stage(object):
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.time() - self.start
+        stage_seconds.observe(elapsed, (self.name,))
+        stages = getattr(_current, 'stages', None)
+        if stages is not None:
+            stages.append((self.name, elapsed))
+        return False
+
+
+def stage(name):
+    """ Returns a context manager that times its block as stage 'name' """
+    return _Stage(name)
+
+
+def begin_request():
+    _current.start = time.time()
+    _current.stages = []
+
+
+def end_request(route, method, status):
+    """ Records the request begun with begin_request(), if it hasn't been
+        recorded already
+    """
+    start = getattr(_current, 'start', None)
+    if start is None:
+        return
+    elapsed = time.time() - start
+    stages = _current.stages
+    _current.start = None
+    _current.stages = None
+
+    requests_total.inc((route, method, str(status)))
+    request_seconds.observe(elapsed, (route, method))
+
+    if SLOW_REQUEST_SECONDS is not None and elapsed > SLOW_REQUEST_SECONDS:
+        tracer.warning("slow request {0} {1} ({2}) took {3:.1f}ms: {4}",
+                       method, route, status, elapsed * 1000,
+                       ', '.join("{0}={1:.1f}ms".format(name, seconds * 1000)
+                                 for name, seconds in stages) or 'no stages')
+
+
+def watch(cache, stats):
+    """ Reports the counts in the dictionary 'stats' returns, e.g. a cache's
+        hits and misses, as cloudendar_cache_events_total{cache=...}
+    """
+    _watched.append((cache, stats))
+
+
+def render():
+    """ Returns every metric in the Prometheus text format """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+
+    lines.append("# HELP cloudendar_cache_events_total Cache hits, misses and other events")
+    lines.append("# TYPE cloudendar_cache_events_total counter")
+    for cache, stats in _watched:
+        for event, count in sorted((stats() or {}).items()):
+            lines.append("cloudendar_cache_events_total{0} {1}".format(
+                _labels(('cache', 'event'), (cache, event)), _number(count)))
+
+    return '\n'.join(lines) + '\n'
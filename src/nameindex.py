@@ -0,0 +1,222 @@
+import re
+import threading
+import time
+
+from database import engine
+from models import User
+from sqlalchemy import event, inspect
+
+
+# How often, in seconds, the index checks the user table for changes made by
+# other processes, like the scraper or the importer, including names changed
+# in place.  Changes made through this process's sessions are picked up right
+# away.
+REFRESH_INTERVAL = 30
+
+# How many results a search returns unless asked for another number
+DEFAULT_LIMIT = 8
+
+# Trigram similarity below which a word isn't considered a match at all
+MIN_SIMILARITY = 0.3
+
+# Longest word prefix indexed; longer query words match on trigrams
+MAX_PREFIX = 12
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+FIELDS = ('onid', 'fname', 'mname', 'lname', 'dept')
+
+
+def words(text):
+    return WORD_RE.findall((text or '').lower())
+
+
+def trigrams(word):
+    padded = '  {0} '.format(word)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class NameIndex(object):
+    """ In-memory search of users by name or ONID, for the typeahead.
+
+        Every word of a user's first, middle and last names and ONID is
+        indexed by its prefixes and by its trigrams.  A query word that
+        starts a user's word matches it outright; one that doesn't can
+        still match on shared trigrams, so misspellings find people too.
+        Users are ranked by how well all the query's words match.
+    """
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.users = {}
+        self.prefixes = {}
+        self.grams = {}
+        self.signature = None
+        self.checked = None
+
+    @staticmethod
+    def _read():
+        return engine.execute("SELECT onid, fname, mname, lname, dept FROM user;").fetchall()
+
+    @staticmethod
+    def _signature(rows):
+        # Changes with any indexed field of any row, not just with rows
+        # being added or removed
+        return hash(tuple(tuple(row) for row in rows))
+
+    def _add(self, user):
+        # Must be called with the lock held
+        onid = user['onid']
+        self._remove(onid)
+        self.users[onid] = user
+        for word in self._words(user):
+            for i in range(1, min(len(word), MAX_PREFIX) + 1):
+                self.prefixes.setdefault(word[:i], set()).add(onid)
+            for gram in trigrams(word):
+                self.grams.setdefault(gram, set()).add(onid)
+
+    def _remove(self, onid):
+        # Must be called with the lock held
+        user = self.users.pop(onid, None)
+        if user is None:
+            return
+        for word in self._words(user):
+            for i in range(1, min(len(word), MAX_PREFIX) + 1):
+                self._discard(self.prefixes, word[:i], onid)
+            for gram in trigrams(word):
+                self._discard(self.grams, gram, onid)
+
+    @staticmethod
+    def _discard(table, key, onid):
+        onids = table.get(key)
+        if onids is not None:
+            onids.discard(onid)
+            if not onids:
+                del table[key]
+
+    @staticmethod
+    def _words(user):
+        ret = set()
+        for field in ('onid', 'fname', 'mname', 'lname'):
+            ret.update(words(user.get(field)))
+        return ret
+
+    def rebuild(self, rows=None):
+        """ Reads every user from the database, or indexes 'rows' read from
+            it with _read()
+        """
+        if rows is None:
+            rows = self._read()
+        signature = self._signature(rows)
+        with self.lock:
+            self.users = {}
+            self.prefixes = {}
+            self.grams = {}
+            for row in rows:
+                if row[0] is not None:
+                    self._add(dict(zip(FIELDS, row)))
+            self.signature = signature
+            self.checked = time.time()
+
+    def refresh(self):
+        """ Rebuilds the index if it has never been built, or if the user
+            table has changed since it was last checked
+        """
+        if self.checked is not None and time.time() - self.checked < self.refresh_interval:
+            return
+        rows = self._read()
+        if self.checked is None or self._signature(rows) != self.signature:
+            self.rebuild(rows)
+        else:
+            self.checked = time.time()
+
+    def update(self, user, old_onids=()):
+        """ Adds or replaces one User.  'old_onids' are ONIDs the user had
+            before, whose entries go too.
+        """
+        with self.lock:
+            for onid in old_onids:
+                self._remove(onid)
+            self._add(dict((field, getattr(user, field)) for field in FIELDS))
+
+    def remove(self, user):
+        with self.lock:
+            self._remove(user.onid)
+
+    def attach(self):
+        """ Keeps the index up to date with the Users this process writes """
+        def inserted(mapper, connection, target):
+            self.update(target)
+
+        def updated(mapper, connection, target):
+            # Until the flush is over, the history still has an ONID the
+            # user has been changed from
+            old_onids = [onid for onid in inspect(target).attrs.onid.history.deleted
+                         if onid is not None]
+            self.update(target, old_onids)
+
+        def deleted(mapper, connection, target):
+            self.remove(target)
+
+        event.listen(User, 'after_insert', inserted)
+        event.listen(User, 'after_update', updated)
+        event.listen(User, 'after_delete', deleted)
+
+    def _match(self, word):
+        """ Returns {onid: score} for the users with a word matching 'word' """
+        scores = {}
+
+        if len(word) <= MAX_PREFIX:
+            for onid in self.prefixes.get(word, ()):
+                scores[onid] = 1.0
+
+        grams = trigrams(word)
+        counts = {}
+        for gram in grams:
+            for onid in self.grams.get(gram, ()):
+                counts[onid] = counts.get(onid, 0) + 1
+        for onid, count in counts.iteritems():
+            if onid in scores:
+                continue
+            # Best case similarity: the share of the query word's trigrams
+            # the user has somewhere in their words
+            similarity = float(count) / len(grams)
+            if similarity >= MIN_SIMILARITY:
+                scores[onid] = 0.5 * similarity
+
+        return scores
+
+    def search(self, query, limit=DEFAULT_LIMIT):
+        """ Returns up to 'limit' users matching 'query', best first, as
+            dictionaries of their ONID, names, department and score
+        """
+        self.refresh()
+
+        query_words = words(query)
+        if not query_words:
+            return []
+
+        with self.lock:
+            totals = None
+            for word in query_words:
+                scores = self._match(word)
+                if totals is None:
+                    totals = scores
+                else:
+                    # Every word of the query has to match something
+                    totals = dict((onid, total + scores[onid])
+                                  for onid, total in totals.iteritems()
+                                  if onid in scores)
+                if not totals:
+                    return []
+
+            ranked = sorted(totals.iteritems(),
+                            key=lambda item: (-item[1],
+                                              self.users[item[0]].get('lname') or '',
+                                              self.users[item[0]].get('fname') or ''))
+            ret = []
+            for onid, score in ranked[:limit]:
+                user = dict(self.users[onid])
+                user['score'] = round(score / len(query_words), 3)
+                ret.append(user)
+        return ret
@@ -0,0 +1,83 @@
+#!/usr/bin/env python2
+# A local stand-in for get_onid.php, for development and testing without
+# access to the engineering web server.  It answers the same POSTed JSON list
+# of {'fname', 'lname'} dictionaries with the same list, each given an 'onid'
+# ("None" when there isn't one), looked up in this machine's passwd database
+# or in a JSON file of names.
+#
+#   python onid_server.py [--port 8081] [--names names.json]
+#   CLOUDENDAR_ONID_URL=http://localhost:8081/get_onid.php python webapp.py
+#
+# A names file maps "first last" to an ONID, e.g. {"Jane Doe": "doej"}.
+
+import argparse
+import BaseHTTPServer
+import SocketServer
+import time
+
+import simplejson as json
+
+import utility
+
+
+class OnidHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # Filled in by main()
+    names = None
+    delay = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        try:
+            users = json.loads(self.rfile.read(length))
+        except ValueError:
+            self.send_error(400, "Expected a JSON list of names")
+            return
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        for user in users:
+            onid = self.lookup(user.get('fname') or '', user.get('lname') or '')
+            user['onid'] = onid if onid is not None else 'None'
+
+        body = json.dumps(users)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def lookup(self, fname, lname):
+        if self.names is not None:
+            return self.names.get("{0} {1}".format(fname, lname).lower())
+        return utility.get_onid(fname, lname)
+
+
+class OnidServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description='Serve a local stand-in for get_onid.php')
+    argparser.add_argument('--port', type=int, default=8081)
+    argparser.add_argument('--names', metavar='FILE',
+                           help='JSON file mapping "first last" to ONIDs '
+                                '(default: use the passwd database)')
+    argparser.add_argument('--delay', type=float, default=0.0, metavar='SECONDS',
+                           help='time to wait before answering each request')
+    args = argparser.parse_args()
+
+    if args.names:
+        with open(args.names) as f:
+            OnidHandler.names = dict((name.lower(), onid)
+                                     for name, onid in json.load(f).items())
+    OnidHandler.delay = args.delay
+
+    server = OnidServer(('', args.port), OnidHandler)
+    print("Answering ONID lookups on port {0}".format(args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import collections
+import threading
+import time
+
+import requests
+import simplejson as json
+
+
+# Seconds to wait on get_onid.php before giving up on a request
+TIMEOUT = 10.0
+
+# How many names are remembered, and for how long, in seconds.  Names that
+# didn't resolve to an ONID are asked about again sooner.
+CACHE_SIZE = 4096
+CACHE_TTL = 24 * 60 * 60
+NEGATIVE_TTL = 10 * 60
+
+
+class OnidClient(object):
+    """ Looks up the ONIDs of {'fname', 'lname'} dictionaries with the
+        get_onid.php script.
+
+        Answers are kept in a least-recently-used cache, failures included,
+        and only names missing from it go out, together in one request over
+        a persistent session.  When another thread is already asking about
+        a name, callers wait for its answer instead of asking again.
+    """
+    def __init__(self, url, timeout=TIMEOUT, cache_size=CACHE_SIZE,
+                 ttl=CACHE_TTL, negative_ttl=NEGATIVE_TTL):
+        self.url = url
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self.session = requests.session()
+        self.cache = collections.OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'requests': 0, 'shared': 0}
+
+    @staticmethod
+    def _key(user):
+        return ((user.get('fname') or '').strip().lower(),
+                (user.get('lname') or '').strip().lower())
+
+    def _cached(self, key):
+        # Must be called with the lock held
+        entry = self.cache.pop(key, None)
+        if entry is None:
+            return None
+        onid, expires = entry
+        if time.time() > expires:
+            return None
+        self.cache[key] = entry
+        return entry
+
+    def _store(self, key, onid):
+        # Must be called with the lock held
+        ttl = self.ttl if onid is not None else self.negative_ttl
+        self.cache.pop(key, None)
+        self.cache[key] = (onid, time.time() + ttl)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _post(self, users):
+        """ Asks get_onid.php about 'users', returning their ONIDs in order """
+        headers = {'content-type': 'application/json'}
+        response = self.session.post(self.url, data=json.dumps(users),
+                                     headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        answers = json.loads(response.content)
+
+        onids = []
+        for answer in answers:
+            onid = answer.get('onid')
+            onids.append(None if onid in (None, 'None', '') else onid)
+        if len(onids) != len(users):
+            raise ValueError("Asked about {0} names but got {1} answers".format(
+                len(users), len(onids)))
+        return onids
+
+    def _ask(self, keys, users):
+        """ Looks up the names in 'keys' (with 'users' their request bodies)
+            and stores the answers
+        """
+        onids = self._post(users)
+        with self.lock:
+            self.stats['requests'] += 1
+            for key, onid in zip(keys, onids):
+                self._store(key, onid)
+
+    def _fetch(self, keys, users):
+        """ Like _ask(), for names this thread has claimed in 'inflight',
+            waking anyone waiting on them once the answers are in
+        """
+        try:
+            self._ask(keys, users)
+        finally:
+            with self.lock:
+                for key in keys:
+                    event = self.inflight.pop(key, None)
+                    if event is not None:
+                        event.set()
+
+    def lookup(self, users):
+        """ Returns a copy of each of 'users' with its 'onid' filled in, or
+            set to None if the name has no ONID
+        """
+        keys = [self._key(user) for user in users]
+        mine = collections.OrderedDict()
+        waiting = {}
+
+        with self.lock:
+            for key, user in zip(keys, users):
+                if key in mine or key in waiting:
+                    continue
+                if self._cached(key) is not None:
+                    self.stats['hits'] += 1
+                elif key in self.inflight:
+                    self.stats['shared'] += 1
+                    waiting[key] = self.inflight[key]
+                else:
+                    self.stats['misses'] += 1
+                    self.inflight[key] = threading.Event()
+                    mine[key] = {'fname': user.get('fname'), 'lname': user.get('lname')}
+
+        if mine:
+            self._fetch(mine.keys(), mine.values())
+
+        # Names another thread was asking about.  If that request failed,
+        # ask again ourselves.  If it's still going after our own timeout,
+        # ask alongside it rather than take no answer for "no ONID".
+        retry = collections.OrderedDict()
+        overdue = collections.OrderedDict()
+        for key, event in waiting.items():
+            event.wait(self.timeout)
+            with self.lock:
+                if self._cached(key) is not None:
+                    continue
+                if key in self.inflight:
+                    overdue[key] = dict(zip(('fname', 'lname'), key))
+                else:
+                    self.inflight[key] = threading.Event()
+                    retry[key] = dict(zip(('fname', 'lname'), key))
+        if retry:
+            self._fetch(retry.keys(), retry.values())
+        if overdue:
+            self._ask(overdue.keys(), overdue.values())
+
+        ret = []
+        with self.lock:
+            for key, user in zip(keys, users):
+                entry = self._cached(key)
+                result = dict(user)
+                result['onid'] = entry[0] if entry is not None else None
+                ret.append(result)
+        return ret
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
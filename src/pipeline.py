@@ -0,0 +1,164 @@
+import sys
+import threading
+import Queue
+
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Stage(object):
+    """ One step of a Pipeline: a pool of worker threads that take items off
+        the stage's inbox, run them through 'func', and put every item 'func'
+        yields (or returns, as a list) onto the next stage's inbox.
+
+        Inboxes are bounded, so a slow stage makes the stages before it block
+        rather than pile up work in memory.
+    """
+    def __init__(self, name, func, workers=1, queue_size=100, setup=None,
+                 teardown=None):
+        if workers < 1:
+            raise ValueError("Stage '{0}' needs at least one worker".format(name))
+
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.setup = setup
+        self.teardown = teardown
+        self.inbox = Queue.Queue(maxsize=queue_size)
+        self.outbox = None
+        self.pipeline = None
+        self.threads = []
+        self._running = workers
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in xrange(self.workers):
+            thread = threading.Thread(target=self._work,
+                                      name="{0}-{1}".format(self.name, i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        context = None
+        try:
+            if self.setup is not None:
+                context = self.setup()
+
+            while True:
+                item = self.inbox.get()
+                if item is _DONE:
+                    break
+
+                # After a failure anywhere in the pipeline, keep draining the
+                # inbox so that upstream stages never block, but do no work.
+                if self.pipeline.failed():
+                    continue
+
+                try:
+                    if self.setup is None:
+                        results = self.func(item)
+                    else:
+                        results = self.func(item, context)
+                    for result in results or []:
+                        self.outbox.put(result)
+                except BaseException:
+                    self.pipeline.fail(sys.exc_info())
+        finally:
+            if self.teardown is not None:
+                try:
+                    self.teardown(context)
+                except BaseException:
+                    self.pipeline.fail(sys.exc_info())
+            self._finish()
+
+    def _finish(self):
+        # The last worker out tells the next stage there's nothing more coming
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last:
+            self.pipeline._close(self.outbox)
+
+
+class Pipeline(object):
+    """ A chain of Stages fed by a producer, whose output is consumed on the
+        calling thread.
+
+        'producer' is an iterable of the first stage's input.  Iterating over
+        the Pipeline yields the last stage's output.  If any stage raises, the
+        rest of the pipeline drains without doing further work, and the
+        exception is re-raised on the consuming thread.
+    """
+    def __init__(self, producer, stages, queue_size=100):
+        self.producer = producer
+        self.stages = stages
+        self.output = Queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._lock = threading.Lock()
+
+        for stage, next_stage in zip(stages, stages[1:] + [None]):
+            stage.pipeline = self
+            stage.outbox = next_stage.inbox if next_stage is not None else self.output
+
+        # Remember how many workers read each queue so _close knows how many
+        # end markers to send.
+        self._readers = {id(self.output): 1}
+        for stage in stages:
+            self._readers[id(stage.inbox)] = stage.workers
+
+    def fail(self, exc_info):
+        with self._lock:
+            if self._error is None:
+                self._error = exc_info
+
+    def failed(self):
+        return self._error is not None
+
+    def _close(self, queue):
+        for i in xrange(self._readers[id(queue)]):
+            queue.put(_DONE)
+
+    def _produce(self):
+        try:
+            for item in self.producer:
+                if self.failed():
+                    break
+                self.stages[0].inbox.put(item)
+        except BaseException:
+            self.fail(sys.exc_info())
+        finally:
+            self._close(self.stages[0].inbox)
+
+    def __iter__(self):
+        for stage in self.stages:
+            stage.start()
+
+        producer = threading.Thread(target=self._produce, name='producer')
+        producer.daemon = True
+        producer.start()
+
+        done = False
+        try:
+            while True:
+                item = self.output.get()
+                if item is _DONE:
+                    done = True
+                    break
+                if not self.failed():
+                    yield item
+        except BaseException:
+            # The consumer raised, or stopped iterating early.  Tell the stages
+            # and the producer to stop working.
+            self.fail(sys.exc_info())
+            raise
+        finally:
+            # Keep the output moving until the last stage is done, so that no
+            # thread is left blocked on a full queue.
+            while not done:
+                done = self.output.get() is _DONE
+
+        if self._error is not None:
+            exc_type, exc_value, tb = self._error
+            raise exc_type, exc_value, tb
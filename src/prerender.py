@@ -0,0 +1,98 @@
+import hashlib
+import os
+import threading
+
+import diag
+
+from config import DATA_DIR
+from flask import make_response, render_template, request, url_for
+from jinja2 import FileSystemBytecodeCache, TemplateError
+
+
+# Where compiled templates are kept between runs
+BYTECODE_CACHE_DIR = os.path.join(DATA_DIR, 'jinja_cache')
+
+# The templates under templates/interpreted_js that are served as scripts
+SCRIPTS = ('gplus.js', 'search.js')
+
+# How long, in seconds, browsers may keep a script without asking again.
+# Script URLs carry their ETag, so a changed script gets a new URL.
+SCRIPT_MAX_AGE = 365 * 24 * 60 * 60
+
+tracer = diag.get_tracer('prerender')
+
+
+def bytecode_cache(directory=BYTECODE_CACHE_DIR):
+    """ Returns a Jinja2 bytecode cache in 'directory', for the app's
+        jinja_options
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    return FileSystemBytecodeCache(directory)
+
+
+def precompile_templates(app):
+    """ Compiles every template the app can find, filling the bytecode cache
+        and the environment's template cache.  Returns how many compiled.
+    """
+    env = app.jinja_env
+    compiled = 0
+    for name in env.list_templates():
+        try:
+            env.get_template(name)
+            compiled += 1
+        except TemplateError as e:
+            tracer.warning("not precompiling {0}: {1}", name, e)
+        except UnicodeDecodeError as e:
+            tracer.warning("not precompiling {0}: {1}", name, e)
+    return compiled
+
+
+class ScriptCache(object):
+    """ The templates in templates/interpreted_js, rendered once and served
+        as scripts.
+
+        They only go through Jinja2 for url_for(), so a rendering holds until
+        the app's URLs change: one is kept for each script root the app is
+        mounted under.  Each is served with a strong ETag and a long cache
+        lifetime, and script_url() puts the ETag in the script's URL, so a
+        browser asks again only when the script has changed.
+    """
+    def __init__(self, names=SCRIPTS):
+        self.names = set(names)
+        self.lock = threading.Lock()
+        # (name, script root) -> (body, etag)
+        self.rendered = {}
+
+    def get(self, name):
+        """ Returns the (body, ETag) of script 'name' for the current request """
+        key = (name, request.script_root)
+        entry = self.rendered.get(key)
+        if entry is None:
+            body = render_template('interpreted_js/' + name)
+            if isinstance(body, unicode):
+                body = body.encode('utf-8')
+            entry = (body, hashlib.sha1(body).hexdigest())
+            with self.lock:
+                self.rendered[key] = entry
+        return entry
+
+    def script_url(self, name):
+        """ Returns the URL of script 'name', versioned by its ETag """
+        return url_for('interpreted_js', name=name, v=self.get(name)[1][:12])
+
+    def response(self, name):
+        """ Returns the response serving script 'name', a 304 if the browser
+            already has it
+        """
+        body, etag = self.get(name)
+        response = make_response(body)
+        response.headers['Content-Type'] = 'application/javascript; charset=utf-8'
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = SCRIPT_MAX_AGE
+        return response.make_conditional(request)
+
+    def clear(self):
+        with self.lock:
+            self.rendered.clear()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python2
 
+import argparse
 import re
 import sys
 import os.path
@@ -7,17 +8,47 @@ import os
 import pprint
 import sqlite3
 import itertools
+import threading
 import urllib
 import urllib2
 import urlparse
 
-from blessings import terminal
+import diag
+import fetcher
+
+from blessings import Terminal
 from bs4 import BeautifulSoup
-from database import db_session, db_init
+from database import db_session, db_init, engine
 from datetime import datetime
 from dateutil import parser
 from dateutil.relativedelta import *
+from dircache import DirectoryCache, FOUND, MISSING, AMBIGUOUS
+from fastparse import (
+    DAY_TIME_RE,
+    DEPT_RE,
+    FULL_NAME_RE,
+    INSTRUCTOR_RE,
+    parse_date,
+    parse_hhmm,
+    time_difference,
+)
+from journal import Journal
 from models import Event, User
+from pipeline import Pipeline, Stage
+from snapshot import (
+    UNCHANGED,
+    UPDATE,
+    SectionSnapshot,
+    fingerprint,
+    parse_section_id,
+    section_id,
+)
+from sqlalchemy import and_
+
+try:
+    from lxml import html as lxml_html
+except ImportError:
+    lxml_html = None
 
 
 # Adapted from user Wilfred Hughes' answer at:
@@ -82,6 +113,14 @@ COURSE_QUERY = {
 
 COURSE_OFFERING_TABLE_ID = "ctl00_ContentPlaceHolder1_SOCListUC1_gvOfferings"
 
+# Which parser get_course_mappings() hands course pages to.  'lxml' pulls just
+# the offerings table, college link and course header out of the page with
+# XPath; 'soup' builds a full BeautifulSoup tree.  Both yield the same dicts.
+PARSE_MODES = ('soup', 'lxml')
+PARSE_MODE = 'lxml' if lxml_html is not None else 'soup'
+
+STRIP_WS = re.compile(r'\s+')
+
 
 DAY_MAP = {
     'M': MO,
@@ -96,6 +135,8 @@ DAY_MAP = {
 
 TERM = Terminal()
 
+tracer = diag.get_tracer('scraper')
+
 
 # Helper to open urls
 class MyOpener(urllib.FancyURLopener):
@@ -106,11 +147,7 @@ class MyOpener(urllib.FancyURLopener):
 
 
 def get_all(url, name=None, attrs={}, recursive=True, text=None, limit=None, **kwargs):
-    #page = OPENER.open(url)
-    page = urllib2.urlopen(url)
-
-    page_text = page.read()
-    page.close()
+    page_text = fetcher.fetch(url)
 
     soup = BeautifulSoup(page_text)
 
@@ -125,15 +162,33 @@ def get_category_links():
         yield tag['href']
 
 
-def get_course_mappings(path):
+def get_course_mappings(path, parse_mode=None):
+    return parse_course_page(fetch_course_page(path), parse_mode)
+
+
+def fetch_course_page(path):
     url = set_query_params(CATALOG_URL + path, COURSE_QUERY)
 
-    #page = OPENER.open(url)
-    page = urllib2.urlopen(url)
+    with tracer.span('fetch'):
+        page_text = fetcher.fetch(url)
 
-    page_text = page.read()
-    page.close()
+    return page_text
 
+
+def parse_course_page(page_text, parse_mode=None):
+    parse_mode = parse_mode or PARSE_MODE
+    if parse_mode not in PARSE_MODES:
+        raise ValueError("Unknown parse mode '{0}'".format(parse_mode))
+
+    if parse_mode == 'lxml':
+        if lxml_html is None:
+            raise ValueError("Parse mode 'lxml' requires the lxml package")
+        return _parse_course_page_lxml(page_text)
+
+    return _parse_course_page_soup(page_text)
+
+
+def _parse_course_page_soup(page_text):
     soup = BeautifulSoup(page_text)
 
     table = soup.find('table', id=COURSE_OFFERING_TABLE_ID)
@@ -141,8 +196,7 @@ def get_course_mappings(path):
 
     dept = soup.find('a', href=re.compile('CollegeOverview')).text.strip()
     course = soup.find('img', alt='Course').parent.text
-    strip_ws = re.compile(r'\s+')
-    course = strip_ws.sub(' ', course).strip()
+    course = STRIP_WS.sub(' ', course).strip()
 
     for row in table.find_all('tr'):
         data = map(lambda td: td.text.strip(), row.find_all('td'))
@@ -154,6 +208,28 @@ def get_course_mappings(path):
             yield course_dict
 
 
+def _parse_course_page_lxml(page_text):
+    doc = lxml_html.fromstring(page_text)
+
+    # Only three elements on the page matter, so go straight to them rather
+    # than walking the whole document tree.
+    table = doc.xpath('//table[@id=$id]', id=COURSE_OFFERING_TABLE_ID)[0]
+    table_headers = [th.text_content() for th in table.iter('th')]
+
+    dept = doc.xpath("(//a[contains(@href, 'CollegeOverview')])[1]")[0]
+    dept = dept.text_content().strip()
+    course = doc.xpath("(//img[@alt='Course'])[1]/..")[0].text_content()
+    course = STRIP_WS.sub(' ', course).strip()
+
+    for row in table.iter('tr'):
+        data = [td.text_content().strip() for td in row.iter('td')]
+        if data:
+            course_dict = dict(zip(table_headers, data))
+            course_dict['dept'] = dept
+            course_dict['course'] = course
+            yield course_dict
+
+
 def parse_courseinfo(course):
     StartDate = course.get('StartDate')
     EndDate = course.get('EndDate')
@@ -167,7 +243,7 @@ def parse_courseinfo(course):
     #end_date = parser.parse(EndDate).date()
 
     # Figure out what days of the week the class occurs
-    day_re = re.match('^(\w+)\s+(\d{4})-(\d{4}).*$', DayTimeDate)
+    day_re = DAY_TIME_RE.match(DayTimeDate)
     if day_re:
         days = list(day_re.group(1))
         days = map(lambda day: DAY_MAP.get(day), days)
@@ -178,7 +254,7 @@ def parse_courseinfo(course):
         start_time = None
         end_time = None
 
-    names = re.match('^(\w+),\s+(\w+).*$', Instructor)
+    names = INSTRUCTOR_RE.match(Instructor)
     if names:
         instructor = {
             'fname': names.group(2),
@@ -204,8 +280,13 @@ def parse_courseinfo(course):
 
 
 def courseinfo_to_model(info):
-    course_start_date = parser.parse(info.get('start_date')).date()
-    course_end_date = parser.parse(info.get('end_date')).date()
+    return Event(**courseinfo_to_fields(info))
+
+
+# Converts parsed course info into the keyword arguments of an Event
+def courseinfo_to_fields(info):
+    course_start_date = parse_date(info.get('start_date'))
+    course_end_date = parse_date(info.get('end_date'))
 
     start_time = info.get('start_time')
     end_time = info.get('end_time')
@@ -223,14 +304,11 @@ def courseinfo_to_model(info):
         start_date = course_start_date + relativedelta(weekday=start_weekday(+1))
         end_date = course_end_date + relativedelta(weekday=end_weekday(-1))
 
-        # We don't worry about extracting JUST the start time, since
-        start_time_dt = datetime.strptime(start_time, '%H%M')
-        end_time_dt = datetime.strptime(end_time, '%H%M')
-        duration = end_time_dt - start_time_dt
-        start_time = start_time_dt.time()
-        end_time = end_time_dt.time()
+        start_time = parse_hhmm(start_time)
+        end_time = parse_hhmm(end_time)
+        duration = time_difference(start_time, end_time)
 
-    return Event(
+    return dict(
         start_date=start_date,
         end_date=end_date,
         start_time=start_time,
@@ -244,6 +322,15 @@ def courseinfo_to_model(info):
     )
 
 
+# Reduces a college name to the department key the directory search expects
+def normalize_dept(dept_raw):
+    dept = dept_raw = dept_raw.lower()
+    dept_match = DEPT_RE.match(dept_raw)
+    if dept_match:
+        dept = dept_match.group(1)[:3]
+    return dept
+
+
 def build_directory_query(info, by_surname=False):
     iname = info.get('instructor')
     if by_surname:
@@ -252,11 +339,8 @@ def build_directory_query(info, by_surname=False):
             surname=iname.get('lname')
         )
     else:
-        dept = dept_raw = info.get('dept').lower()
-        print("DEPARTMENT RAW: {0}".format(dept_raw))
-        dept_match = re.match(r'^(?:college|school)\s+of\s+(\w+).*$', dept_raw)
-        if dept_match:
-            dept = dept_match.group(1)[:3]
+        print("DEPARTMENT RAW: {0}".format(info.get('dept').lower()))
+        dept = normalize_dept(info.get('dept'))
         print("DEPARTMENT: {0}".format(dept))
         ret = set_query_params(
             DIRECTORY_URL_QS,
@@ -277,7 +361,7 @@ def instructor_dict_to_model(idict):
     full_name = idict.get('Full Name')
     names = None
     if full_name is not None:
-        names = re.match('^(\w+),\s+(\w+)\s*(\w*).*$', idict.get('Full Name'))
+        names = FULL_NAME_RE.match(idict.get('Full Name'))
 
     if names:
         fname = names.group(2)
@@ -304,12 +388,32 @@ def instructor_dict_to_model(idict):
     )
 
 
-def get_instructor_info(courseinfo):
+def get_instructor_info(courseinfo, cache=None):
+    if cache is None:
+        return query_directory(courseinfo)[1]
+
+    iname = courseinfo.get('instructor')
+    fname = iname.get('fname')
+    lname = iname.get('lname')
+    dept = normalize_dept(courseinfo.get('dept'))
+
+    cached = cache.get(fname, lname, dept)
+    if cached is not None:
+        status, idict = cached
+        print("CACHED DIRECTORY LOOKUP FOR {0} {1}: {2}".format(fname, lname, status))
+        return idict
+
+    status, idict = query_directory(courseinfo)
+    cache.put(fname, lname, dept, status, idict)
+    return idict
+
+
+# Looks the course's instructor up in the OSU directory.  Returns a (status,
+# idict) tuple, where status is one of dircache.FOUND, MISSING or AMBIGUOUS and
+# idict is the instructor's directory record, if found.
+def query_directory(courseinfo):
     url = build_directory_query(courseinfo)
-    #page = OPENER.open(url)
-    page = urllib2.urlopen(url)
-    page_text = page.read()
-    page.close()
+    page_text = fetcher.fetch(url)
 
     soup = BeautifulSoup(page_text)
     record = soup.find('div', {'class': 'record'})
@@ -321,9 +425,7 @@ def get_instructor_info(courseinfo):
 
         url = build_directory_query(courseinfo, by_surname=True)
 
-        page = urllib2.urlopen(url)
-        page_text = page.read()
-        page.close()
+        page_text = fetcher.fetch(url)
 
         soup = BeautifulSoup(page_text)
         record = soup.find('div', {'class': 'record'})
@@ -333,21 +435,22 @@ def get_instructor_info(courseinfo):
 
             if records is None:
                 print("NO INSTRUCTOR BY THE NAME {0} {1}".format(fname, lname))
-                return None
+                return MISSING, None
 
             iname_re = re.compile("^{0},\s+{1}.*$".format(lname, fname[0]))
 
             ilinks = records.find_all('a', dept=True, text=iname_re)
             for ilink in ilinks:
                 print("POSSIBLE MATCH: {0}".format(ilink.text))
+            if len(ilinks) == 0:
+                print("NO MATCHING RESULTS; SKIPPING")
+                return MISSING, None
             if len(ilinks) != 1:
                 print("AMBIGUOUS RESULTS; SKIPPING")
-                return None
+                return AMBIGUOUS, None
 
             url = DIRECTORY_URL + ilinks[0]['href']
-            page = urllib2.urlopen(url)
-            page_text = page.read()
-            page.close()
+            page_text = fetcher.fetch(url)
             soup = BeautifulSoup(page_text)
             record = soup.find('div', {'class': 'record'})
 
@@ -366,80 +469,326 @@ def get_instructor_info(courseinfo):
 
     if not idict:
         print(record)
+        return MISSING, None
 
-    return idict
+    return FOUND, idict
 
 
-def main():
-    db_init()
+# Figures out who teaches a section without touching the database session of
+# the writer.  Returns {'onid': <onid>} for an instructor who's already in the
+# User table, {'idict': <directory record>} for one found in the directory, or
+# None if the section has no instructor or the instructor couldn't be found.
+def resolve_instructor(courseinfo, cache=None):
+    inames = courseinfo.get('instructor')
 
-    link_counter = 0
-    course_counter = 0
-    links = get_category_links()
-    for link in links:
-        link_counter += 1
-        print("########## PROCESSING COURSE CATALOG ENTRY {0} ##########".format(link_counter))
+    # Skip courses without instructors
+    if inames is None:
+        return None
 
-        courses = get_course_mappings(link)
+    instructor_query = User.query.filter(
+        User.lname == inames.get('lname')).filter(
+        User.fname.startswith(inames.get('fname')[0]))
 
-        for course in courses:
-            course_counter += 1
-            print("########## PROCESSING COURSE {0} ##########".format(course_counter))
-
-            courseinfo = parse_courseinfo(course)
-            #print("COURSE INFO: {0}".format(courseinfo))
-
-            # Skip courses without instructors
-            if(courseinfo.get('instructor')) is None:
-                continue
-
-            inames = courseinfo.get('instructor')
-            #print("INSTRUCTOR: {0}".format(inames))
-            #print("DEPARTMENT: {0}".format(courseinfo.get('dept')))
-            instructor_query = User.query.filter(
-                User.lname == inames.get('lname')).filter(
-                User.fname.startswith(inames.get('fname')[0]))
-
-            if len(instructor_query.all()) == 1:
-                instructor = instructor_query.first()
-            else:
-                instructor = instructor_query.filter(User.dept.like(courseinfo.get('dept'))).first()
-
-            #print("INSTRUCTOR QUERY BY NAME/DEPT: {0}".format(instructor))
+    if len(instructor_query.all()) == 1:
+        instructor = instructor_query.first()
+    else:
+        instructor = instructor_query.filter(User.dept.like(courseinfo.get('dept'))).first()
+
+    if instructor is not None:
+        return {'onid': instructor.onid}
+
+    with tracer.span('directory'):
+        idict = get_instructor_info(courseinfo, cache)
+    print("COURSE INFO: {0}".format(courseinfo))
+    print("INSTRUCTOR INFO: {0}".format(idict))
+    if not idict or idict.get('ONID Username') is None:
+        return None
+
+    return {'idict': idict}
+
+
+# Key identifying a single section, as taught by one of its instructors, on a
+# catalog page in the progress journal
+def section_key(link, course):
+    return u"{0}#{1}/{2}/{3}/{4}".format(link, course.get('Term'), course.get('CRN'),
+                                         course.get('Sec'), course.get('Instructor'))
+
+
+class SectionWriter(object):
+    """ Writes resolved sections to the database in batches, and records them
+        (and the catalog entries they came from, once every section of an
+        entry is in) in the progress journal and the section snapshot after
+        each commit.
+
+        Only inserted and updated sections are written; unchanged ones are
+        just stamped as seen in the snapshot.  All database work for a scraper
+        run happens here, on one thread.
+    """
+    def __init__(self, journal, snapshot, batch_size=50):
+        self.journal = journal
+        self.snapshot = snapshot
+        self.batch_size = batch_size
+        self.batch = []
+        # Instructors loaded or added since the last commit, keyed by ONID
+        self.instructors = {}
+        # Number of sections expected and written for each catalog entry
+        self.expected = {}
+        self.written = {}
+        # Total number of sections handled
+        self.sections = 0
+
+    def add_section(self, link, key, courseinfo, change, match):
+        fp = fingerprint(courseinfo)
+
+        if change == UPDATE:
+            self._remove_events(*parse_section_id(section_id(courseinfo)))
+
+        if change != UNCHANGED:
+            if match is not None:
+                self._write_section(courseinfo, match)
+            elif courseinfo.get('instructor') is not None:
+                # The instructor couldn't be resolved this time; leave the
+                # section looking changed so the next run tries again.
+                fp = None
+
+        self.batch.append((link, key, section_id(courseinfo), fp))
+        self.sections += 1
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def end_link(self, link, count):
+        self.expected[link] = count
+        self._check_link(link)
+
+    def _write_section(self, courseinfo, match):
+        if 'onid' in match:
+            onid = match.get('onid')
+        else:
+            onid = match.get('idict').get('ONID Username')
 
+        instructor = self.instructors.get(onid)
+        if instructor is None:
+            instructor = User.query.filter(User.onid == onid).first()
             if instructor is None:
-                idict = get_instructor_info(courseinfo)
-                print("COURSE INFO: {0}".format(courseinfo))
-                print("INSTRUCTOR INFO: {0}".format(idict))
-                if not idict:
-                    continue
-                #print("ONID: {0}".format(idict.get('ONID Username')))
-                instructor = User.query.filter(User.onid == idict.get('ONID Username')).first()
-
-                #print("INSTRUCTOR QUERY BY ONID: {0}".format(instructor))
-
-                if instructor is None:
-                    instructor = instructor_dict_to_model(idict)
-                    db_session.add(instructor)
-
-            event = Event.query.filter(
-                Event.user.any(onid=instructor.onid)) .filter(
-                    Event.crn == courseinfo.get('crn')).filter(
-                        Event.term == courseinfo.get('term')).filter(
-                            Event.sec == courseinfo.get('sec')).first()
-
-            if event is None:
-                #print("COURSEINFO: {0}".format(courseinfo))
-                event = courseinfo_to_model(courseinfo)
-                instructor.events.append(event)
+                instructor = instructor_dict_to_model(match.get('idict'))
+                db_session.add(instructor)
+            self.instructors[onid] = instructor
+
+        event = Event.query.filter(
+            Event.user.any(onid=instructor.onid)) .filter(
+                Event.crn == courseinfo.get('crn')).filter(
+                    Event.term == courseinfo.get('term')).filter(
+                        Event.sec == courseinfo.get('sec')).first()
+
+        if event is None:
+            event = courseinfo_to_model(courseinfo)
+            instructor.events.append(event)
+
+    def _remove_events(self, term, crn, sec, lname, fname):
+        """ Deletes the Events of one instructor's listing of a section,
+            leaving any co-instructors' alone.  Instructors are matched by
+            name the way resolve_instructor() matches them.
+        """
+        if lname is None:
+            # Sections without an instructor never get Events
+            return 0
+
+        events = Event.query.filter(
+            Event.crn == crn).filter(
+                Event.term == term).filter(
+                    Event.sec == sec).filter(
+                        Event.user.any(and_(User.lname == lname,
+                                            User.fname.startswith(fname[:1])))).all()
+        for event in events:
+            db_session.delete(event)
+        # Flush now so that the queries in _write_section don't find them
+        db_session.flush()
+        return len(events)
+
+    def remove_sections(self, sids):
+        """ Deletes the Events of sections that have left the catalog """
+        removed = 0
+        for sid in sids:
+            removed += self._remove_events(*parse_section_id(sid))
+        db_session.commit()
+        self.snapshot.remove(sids)
+        return removed
+
+    def flush(self):
+        db_session.commit()
+        self.instructors = {}
+
+        self.journal.mark_all_done('section', [key for link, key, sid, fp in self.batch])
+        self.snapshot.record([(sid, fp) for link, key, sid, fp in self.batch])
+        links = set()
+        for link, key, sid, fp in self.batch:
+            self.written[link] = self.written.get(link, 0) + 1
+            links.add(link)
+        self.batch = []
+
+        for link in links:
+            self._check_link(link)
+
+    def _check_link(self, link):
+        if link in self.expected and self.written.get(link, 0) >= self.expected[link]:
+            self.journal.mark_done('link', link)
+            del self.expected[link]
+            self.written.pop(link, None)
+
+
+def data_generation():
+    """ Returns the number of the last snapshot run started against
+        data.db, kept in data.db's user_version, or 0 if there's been none
+    """
+    return engine.execute("PRAGMA user_version;").scalar() or 0
+
+
+def set_data_generation(run):
+    engine.execute("PRAGMA user_version = {0:d};".format(run))
+
+
+def main(resume=False, fetch_workers=4, parse_workers=2, resolve_workers=4,
+         queue_size=100, batch_size=50):
+    db_init()
 
-            db_session.commit()
+    # Fingerprints of the sections written by earlier runs.  Sections whose
+    # fingerprints haven't changed skip instructor resolution and the database
+    # entirely, and sections that stop showing up are deleted at the end.
+    snapshot = SectionSnapshot()
+
+    # The snapshot and the journal only describe data.db if the snapshot's
+    # latest run was started against it.  If data.db has been reset or restored
+    # from a backup since, forget both and write every section again.
+    if snapshot.run != data_generation():
+        if snapshot.run != 0:
+            print("########## DATA.DB DOESN'T MATCH THE SECTION SNAPSHOT, REWRITING EVERY SECTION ##########")
+        snapshot.clear()
+        resume = False
+
+    # Every finished catalog entry and section is recorded in the journal, so
+    # that a run that dies partway can be picked up again with --resume.
+    journal = Journal('scraper')
+    if resume:
+        print("########## RESUMING: {0} COURSE CATALOG ENTRIES ALREADY DONE ##########".format(
+            journal.count('link')))
+        done_links = set(journal.done('link'))
+        done_sections = set(journal.done('section'))
+    else:
+        journal.reset()
+        done_links = set()
+        done_sections = set()
+
+    if not resume or snapshot.run == 0:
+        snapshot.start_run()
+        set_data_generation(snapshot.run)
+    previous = snapshot.fingerprints()
+
+    counters = {'link': 0, 'course': 0}
+    counter_lock = threading.Lock()
+
+    def produce_links():
+        for link in get_category_links():
+            if link not in done_links:
+                yield link
+
+    def fetch(link):
+        with counter_lock:
+            counters['link'] += 1
+            print("########## PROCESSING COURSE CATALOG ENTRY {0} ##########".format(counters['link']))
+        return [(link, fetch_course_page(link))]
+
+    def parse(item):
+        link, page_text = item
+        count = 0
+        for course in parse_course_page(page_text):
+            key = section_key(link, course)
+            if key in done_sections:
+                continue
+            count += 1
+            yield ('section', link, key, parse_courseinfo(course))
+        yield ('link', link, count)
+
+    # Each resolver thread gets its own connection to the directory cache,
+    # and its own scoped database session for instructor lookups.
+    def open_cache():
+        return DirectoryCache()
+
+    def close_cache(cache):
+        if cache is not None:
+            cache.close()
+        db_session.remove()
+
+    def diff(item):
+        if item[0] == 'link':
+            return [item]
+        return [item + (snapshot.classify(previous, item[3]),)]
+
+    def resolve(item, cache):
+        if item[0] == 'link':
+            return [item]
+        kind, link, key, courseinfo, change = item
+        if change == UNCHANGED:
+            return [item + (None,)]
+        with counter_lock:
+            counters['course'] += 1
+            print("########## PROCESSING COURSE {0} ({1}) ##########".format(
+                counters['course'], change.upper()))
+        return [item + (resolve_instructor(courseinfo, cache),)]
+
+    stages = [
+        Stage('fetch', fetch, workers=fetch_workers, queue_size=queue_size),
+        Stage('parse', parse, workers=parse_workers, queue_size=queue_size),
+        Stage('diff', diff, workers=1, queue_size=queue_size),
+        Stage('resolve', resolve, workers=resolve_workers, queue_size=queue_size,
+              setup=open_cache, teardown=close_cache),
+    ]
+
+    writer = SectionWriter(journal, snapshot, batch_size)
+    for item in Pipeline(produce_links(), stages, queue_size=queue_size):
+        if item[0] == 'link':
+            writer.end_link(item[1], item[2])
+        else:
+            writer.add_section(*item[1:])
 
+    writer.flush()
 
+    # Only now that every catalog entry has been seen is it safe to decide
+    # which sections are gone.
+    stale = snapshot.stale()
+    if stale:
+        removed = writer.remove_sections(stale)
+        print("########## REMOVED {0} SECTIONS ({1} EVENTS) NO LONGER IN THE CATALOG ##########".format(
+            len(stale), removed))
 
-    db_session.commit()
     db_session.remove()
+    journal.close()
+    snapshot.close()
+
+    return writer.sections
 
 
 if __name__ == '__main__':
-    main()
+    argparser = argparse.ArgumentParser(
+        description='Scrape the OSU course catalog into the database')
+    argparser.add_argument('--resume', action='store_true',
+                           help='skip catalog entries and sections finished '
+                                'by a previous run')
+    argparser.add_argument('--fetch-workers', type=int, default=4,
+                           help='number of threads fetching course pages')
+    argparser.add_argument('--parse-workers', type=int, default=2,
+                           help='number of threads parsing course pages')
+    argparser.add_argument('--resolve-workers', type=int, default=4,
+                           help='number of threads looking up instructors')
+    argparser.add_argument('--queue-size', type=int, default=100,
+                           help='number of items each stage may have waiting')
+    argparser.add_argument('--batch-size', type=int, default=50,
+                           help='number of sections written per commit')
+    fetcher.add_arguments(argparser)
+    args = argparser.parse_args()
+    fetcher.configure_from_args(args)
+    main(resume=args.resume,
+         fetch_workers=args.fetch_workers,
+         parse_workers=args.parse_workers,
+         resolve_workers=args.resolve_workers,
+         queue_size=args.queue_size,
+         batch_size=args.batch_size)
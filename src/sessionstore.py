@@ -0,0 +1,214 @@
+import collections
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from StringIO import StringIO
+
+from config import DATA_DIR
+from database import engine
+from models import User
+from simplekv import KeyValueStore
+
+
+SESSION_STORE_PATH = os.path.join(DATA_DIR, 'sessions.db')
+
+# How many sessions are kept, and for how long, in seconds, a session nobody
+# has used is kept
+MAX_SESSIONS = 10000
+SESSION_TTL = 7 * 24 * 60 * 60
+
+# How many sets of credentials each process keeps in memory, and for how long
+CREDENTIALS_CACHE_SIZE = 1024
+CREDENTIALS_TTL = 60 * 60
+
+# The file-backed store clears out expired sessions every this many writes
+CLEANUP_EVERY = 100
+
+# Reading a session from the file-backed store only pushes back its expiry
+# once this fraction of the TTL has passed since it was last pushed back, so
+# most reads don't write
+REFRESH_FRACTION = 0.1
+
+
+class SessionStore(KeyValueStore):
+    """ A simplekv store for KVSessionExtension that doesn't grow without
+        bound: sessions unused for 'ttl' seconds expire, and past
+        'max_entries' the least recently used go first.
+
+        With a 'path', sessions live in an SQLite file, so they survive
+        restarts and every worker process sees the same ones.  Without one
+        they're kept in this process's memory.
+    """
+    def __init__(self, path=None, max_entries=MAX_SESSIONS, ttl=SESSION_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.writes = 0
+
+        self.entries = collections.OrderedDict()
+        self.conn = None
+        if path is not None:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS session ("
+                              "key VARCHAR(250) PRIMARY KEY, "
+                              "data BLOB NOT NULL, "
+                              "expires REAL NOT NULL);")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS session_expires "
+                              "ON session (expires);")
+            self.conn.commit()
+
+    def _get(self, key):
+        now = time.time()
+        with self.lock:
+            if self.conn is None:
+                entry = self.entries.pop(key, None)
+                if entry is None or entry[1] < now:
+                    raise KeyError(key)
+                # Reading a session counts as using it
+                self.entries[key] = (entry[0], now + self.ttl)
+                return entry[0]
+
+            row = self.conn.execute("SELECT data, expires FROM session "
+                                    "WHERE key = ? AND expires >= ?;",
+                                    (key, now)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            data, expires = row
+            if now + self.ttl - expires > self.ttl * REFRESH_FRACTION:
+                self.conn.execute("UPDATE session SET expires = ? WHERE key = ?;",
+                                  (now + self.ttl, key))
+                self.conn.commit()
+            return str(data)
+
+    def _put(self, key, data):
+        expires = time.time() + self.ttl
+        with self.lock:
+            if self.conn is None:
+                self.entries.pop(key, None)
+                self.entries[key] = (data, expires)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                return key
+
+            self.conn.execute("INSERT OR REPLACE INTO session (key, data, expires) "
+                              "VALUES (?, ?, ?);", (key, buffer(data), expires))
+            self.writes += 1
+            if self.writes % CLEANUP_EVERY == 0:
+                self._cleanup()
+            self.conn.commit()
+            return key
+
+    def _cleanup(self):
+        # Must be called with the lock held
+        self.conn.execute("DELETE FROM session WHERE expires < ?;", (time.time(),))
+        self.conn.execute("DELETE FROM session WHERE key IN ("
+                          "SELECT key FROM session ORDER BY expires DESC "
+                          "LIMIT -1 OFFSET ?);", (self.max_entries,))
+
+    def _delete(self, key):
+        with self.lock:
+            if self.conn is None:
+                self.entries.pop(key, None)
+            else:
+                self.conn.execute("DELETE FROM session WHERE key = ?;", (key,))
+                self.conn.commit()
+
+    def _has_key(self, key):
+        try:
+            self._get(key)
+        except KeyError:
+            return False
+        return True
+
+    def _open(self, key):
+        return StringIO(self._get(key))
+
+    def _put_file(self, key, file):
+        return self._put(key, file.read())
+
+    def iter_keys(self):
+        now = time.time()
+        with self.lock:
+            if self.conn is None:
+                keys = [key for key, (data, expires) in self.entries.items()
+                        if expires >= now]
+            else:
+                keys = [row[0] for row in self.conn.execute(
+                    "SELECT key FROM session WHERE expires >= ?;", (now,))]
+        return iter(keys)
+
+
+class CredentialCache(object):
+    """ OAuth credentials kept on the server, so a session only has to carry
+        the ONID they belong to.
+
+        Credentials are saved in the user table, where every worker process
+        can load them.  The row is read on every get(), so credentials
+        replaced or revoked through another process are never served, but
+        the most recently used are kept unpickled in memory along with the
+        bytes they came from: while the row still holds those bytes, the
+        same credentials object comes back each time, as the CalendarPool
+        expects.
+    """
+    def __init__(self, max_entries=CREDENTIALS_CACHE_SIZE, ttl=CREDENTIALS_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # onid -> (pickled credentials, credentials, expires)
+        self.entries = collections.OrderedDict()
+
+    def _remember(self, onid, pickled, credentials):
+        with self.lock:
+            self.entries.pop(onid, None)
+            self.entries[onid] = (pickled, credentials, time.time() + self.ttl)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _forget(self, onid):
+        with self.lock:
+            self.entries.pop(onid, None)
+
+    def get(self, onid):
+        """ Returns the credentials saved for 'onid', or None """
+        if onid is None:
+            return None
+
+        # The raw column, so that unchanged credentials needn't be unpickled
+        row = engine.execute("SELECT credentials FROM user WHERE onid = ?;", onid).fetchone()
+        if row is None or row[0] is None:
+            self._forget(onid)
+            return None
+        pickled = str(row[0])
+
+        with self.lock:
+            entry = self.entries.pop(onid, None)
+            if entry is not None and entry[0] == pickled and entry[2] >= time.time():
+                self.entries[onid] = entry
+                return entry[1]
+
+        credentials = pickle.loads(pickled)
+        self._remember(onid, pickled, credentials)
+        return credentials
+
+    def _write(self, onid, credentials):
+        # A core UPDATE, so the User mapper's listeners (the NameIndex's)
+        # don't take a change of credentials for a change of name
+        users = User.__table__
+        engine.execute(users.update().where(users.c.onid == onid).values(
+            credentials=credentials))
+        self._forget(onid)
+
+    def put(self, onid, credentials):
+        """ Saves 'credentials' as those of 'onid' """
+        self._write(onid, credentials)
+
+    def discard(self, onid):
+        """ Forgets the credentials of 'onid', here and in the user table """
+        self._write(onid, None)
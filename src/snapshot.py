@@ -0,0 +1,140 @@
+import hashlib
+import os
+import sqlite3
+
+from config import DATA_DIR
+
+
+SNAPSHOT_PATH = os.path.join(DATA_DIR, 'snapshot.db')
+
+# What happened to a section since the last run
+INSERT = 'insert'
+UPDATE = 'update'
+UNCHANGED = 'unchanged'
+
+
+def section_id(courseinfo):
+    """ Returns the key identifying a section across runs.  A section taught
+        by several instructors is listed once for each, so the instructor's
+        name ("Last, First", empty if there's none) is part of the key.
+    """
+    instructor = courseinfo.get('instructor')
+    name = u''
+    if instructor is not None:
+        name = u"{0}, {1}".format(instructor.get('lname'), instructor.get('fname'))
+    return u"{0}/{1}/{2}/{3}".format(courseinfo.get('term'), courseinfo.get('crn'),
+                                     courseinfo.get('sec'), name)
+
+
+def parse_section_id(sid):
+    """ Returns the (term, crn, sec, lname, fname) a section ID was made
+        from, with None for the names of a section without an instructor
+    """
+    term, crn, sec, name = sid.split('/', 3)
+    lname, sep, fname = name.partition(', ')
+    if not sep:
+        return term, crn, sec, None, None
+    return term, crn, sec, lname, fname
+
+
+def fingerprint(courseinfo):
+    """ Returns a digest of everything about a parsed section that ends up in
+        its Event: CRN, term, section, dates, times, days and instructor
+    """
+    instructor = courseinfo.get('instructor') or {}
+    days = courseinfo.get('days') or []
+    fields = [
+        courseinfo.get('crn'),
+        courseinfo.get('term'),
+        courseinfo.get('sec'),
+        courseinfo.get('start_date'),
+        courseinfo.get('end_date'),
+        courseinfo.get('start_time'),
+        courseinfo.get('end_time'),
+        ''.join(str(day) for day in days),
+        instructor.get('fname'),
+        instructor.get('lname'),
+        courseinfo.get('course'),
+    ]
+    text = u'\x1f'.join(u'' if field is None else unicode(field) for field in fields)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class SectionSnapshot(object):
+    """ Fingerprints of the sections written by previous scraper runs.
+
+        Each run gets a number.  A section is stamped with the number of the
+        last run that saw it, so once a run has finished, every section still
+        carrying an older number has disappeared from the catalog.
+    """
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS section ("
+                          "id VARCHAR(40) PRIMARY KEY, "
+                          "fingerprint VARCHAR(40), "
+                          "run INTEGER NOT NULL);")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS run (id INTEGER PRIMARY KEY);")
+        # Section IDs used to leave out the instructor, so co-instructors of a
+        # section overwrote each other's fingerprints.  Forget those: the next
+        # run treats every section as new, which rewrites nothing that's there.
+        self.conn.execute("DELETE FROM section WHERE id NOT LIKE '%/%/%/%';")
+        self.conn.commit()
+
+        row = self.conn.execute("SELECT MAX(id) FROM run;").fetchone()
+        self.run = row[0] or 0
+
+    def start_run(self):
+        """ Begin a new run.  Resumed runs keep the current run number. """
+        self.run += 1
+        self.conn.execute("INSERT INTO run (id) VALUES (?);", (self.run,))
+        self.conn.commit()
+        return self.run
+
+    def fingerprints(self):
+        """ Returns a dictionary of section IDs mapped to their fingerprints """
+        cursor = self.conn.execute("SELECT id, fingerprint FROM section;")
+        return dict(cursor.fetchall())
+
+    def classify(self, previous, courseinfo):
+        """ Compares a parsed section against the fingerprints loaded with
+            fingerprints(), returning INSERT, UPDATE or UNCHANGED
+        """
+        old = previous.get(section_id(courseinfo), False)
+        if old is False:
+            return INSERT
+        if old is None or old != fingerprint(courseinfo):
+            return UPDATE
+        return UNCHANGED
+
+    def record(self, sections):
+        """ Stamps (section ID, fingerprint) pairs as seen by this run.  A
+            fingerprint of None means the section was seen but not written, so
+            the next run will treat it as changed.
+        """
+        self.conn.executemany("INSERT OR REPLACE INTO section (id, fingerprint, run) "
+                              "VALUES (?, ?, ?);",
+                              [(sid, fp, self.run) for sid, fp in sections])
+        self.conn.commit()
+
+    def stale(self):
+        """ Returns the IDs of sections no run since the last one has seen """
+        cursor = self.conn.execute("SELECT id FROM section WHERE run < ?;", (self.run,))
+        return [row[0] for row in cursor]
+
+    def clear(self):
+        """ Forgets every section, so the next run treats them all as new """
+        self.conn.execute("DELETE FROM section;")
+        self.conn.commit()
+
+    def remove(self, ids):
+        self.conn.executemany("DELETE FROM section WHERE id = ?;", [(i,) for i in ids])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
@@ -99,10 +99,10 @@ var helper = (function() {
         */
         connectServer: function() {
             console.log(this.authResult.code);
-            console.log("STATE: {{ STATE }}");
+            console.log("STATE: " + STATE);
             $.ajax({
                 type: 'POST',
-                url: '{{ url_for("connect") }}?state={{ STATE }}',
+                url: '{{ url_for("connect") }}?state=' + STATE,
                 contentType: 'application/octet-stream; charset=utf-8',
                 success: function(result) {
                     console.log('authentication result: ' + JSON.stringify(result));
@@ -136,20 +136,20 @@
         };
 
 
-        // Query the server for free times for the given users
-        $("#findtimes").click(function(event) {
-            if($.isEmptyObject(attendees)) {
-                event.preventDefault();
-                return;
+        // Show the results panel once there's something to put in it
+        var showResults = function(found) {
+            if(found) {
+                $('#noresults').hide();
+            } else {
+                $('#noresults').show();
             }
+            $('#placeholder').hide();
+            $('#results').show();
+        };
 
-            // Clear out the previous results list
-            $('#freetimesBody').empty();
-
-            // Grab the form data and add the users
-            form_arr = $(this).parent().serializeObject();
-            form_arr['users'] = attendees;
-
+        // Ask for free times with a single POST to /find; used when
+        // SocketIO isn't available
+        var findTimesAjax = function(form_arr) {
             $.ajax({
                 type: 'POST',
                 url: '{{ url_for("find_times") }}',
@@ -157,28 +157,163 @@
                 data: JSON.stringify(form_arr),
                 success: function(result) {
                     console.log('search result: ' + JSON.stringify(result));
-                    var free_ranges = result['free_ranges'];
-                    if (free_ranges.length > 0) {
-                        $('#noresults').hide();
-                        $.each(free_ranges, function(index, value) {
-                            console.log(index + ' ' + JSON.stringify(value));
-                            $('#freetimesBody').append(trFreeTimes(value));
-                        });
-                    } else {
-                        $('#noresults').show();
-                    }
-                    $('#placeholder').hide();
-                    $('#results').show();
+                    var free_ranges = result['free_ranges'] || [];
+                    $.each(free_ranges, function(index, value) {
+                        $('#freetimesBody').append(trFreeTimes(value));
+                    });
+                    showResults(free_ranges.length > 0);
                 },
                 error: function(e) {
                     console.log(e);
                 }
             });
+        };
+
+        /*
+         * Free times streamed over SocketIO: the server reports which
+         * attendees it found, then each chunk of calendars as Google answers,
+         * then each free range in time order.  Rows are added as they come.
+         */
+        var socket = null;
+
+        if(typeof io !== 'undefined') {
+            socket = io.connect(location.protocol + '//' + location.host + '/search');
+
+            socket.on('attendees', function(msg) {
+                if(msg['missing'].length > 0) {
+                    $('#findstatus').text('No ONID for ' + msg['missing'].join(', '));
+                }
+            });
+
+            socket.on('freebusy', function(msg) {
+                $('#findstatus').text('Calendars received: ' + msg['received']
+                                      + ' of ' + msg['total']);
+            });
+
+            socket.on('range', function(msg) {
+                $('#freetimesBody').append(trFreeTimes(msg));
+                showResults(true);
+            });
+
+            socket.on('done', function(msg) {
+                $('#findstatus').text('');
+                showResults(msg['count'] > 0);
+            });
+
+            socket.on('failed', function(msg) {
+                console.log(msg);
+                $('#findstatus').text(msg['msg']);
+            });
+        }
+
+        // Query the server for free times for the given users
+        $("#findtimes").click(function(event) {
+            if($.isEmptyObject(attendees)) {
+                event.preventDefault();
+                return;
+            }
+
+            // Clear out the previous results list
+            $('#freetimesBody').empty();
+            $('#findstatus').text('');
+
+            // Grab the form data and add the users
+            form_arr = $(this).parent().serializeObject();
+            form_arr['users'] = attendees;
+
+            if(socket !== null && socket.socket.connected) {
+                $('#findstatus').text('Searching...');
+                socket.emit('find', form_arr);
+            } else {
+                findTimesAjax(form_arr);
+            }
 
             // Prevent form submission
             event.preventDefault();
         });
 
+        // Add a person to the attendees, unless they're already there
+        var addAttendee = function(key, data) {
+            if(! attendees[key] && key != "") {
+                attendees[key] = data;
+            }
+
+            // Rebuild attendees object
+            buildAttendeesList();
+
+            // Reset text field
+            $("#onid").val("");
+        };
+
+        /*
+         * Suggestions from the server's name index, shown under the search
+         * box as the user types.  Clicking one adds that person directly,
+         * without the exact name lookup the 'Add' button does.
+         */
+        var suggestTimer = null;
+
+        var hideSuggestions = function() {
+            $('#suggestions').empty().hide();
+        };
+
+        var showSuggestions = function(candidates) {
+            $('#suggestions').empty();
+            if(candidates.length === 0) {
+                $('#suggestions').hide();
+                return;
+            }
+
+            $.each(candidates, function(index, value) {
+                var name = value['fname'] + ' ' + value['lname'];
+                var link = $('<a/>', {
+                    href: '#',
+                    click: function(event) {
+                        addAttendee(name, value);
+                        hideSuggestions();
+                        event.preventDefault();
+                    }
+                }).text(name + ' ').append($('<small/>', {
+                    class: 'text-muted',
+                }).text(value['onid']));
+                $('#suggestions').append($('<li/>').append(link));
+            });
+            $('#suggestions').show();
+        };
+
+        $('#onid').on('input', function() {
+            var query = $(this).val();
+
+            clearTimeout(suggestTimer);
+            if($.trim(query).length < 2) {
+                hideSuggestions();
+                return;
+            }
+
+            // Wait for a pause in typing before asking
+            suggestTimer = setTimeout(function() {
+                $.ajax({
+                    type: 'POST',
+                    url: '{{ url_for("run_query") }}',
+                    contentType: 'application/json',
+                    data: JSON.stringify({'mode': 'search', 'q': query, 'limit': 8}),
+                    success: function(result) {
+                        // Drop answers to queries the user has typed past
+                        if($('#onid').val() === query) {
+                            showSuggestions(result['candidates'] || []);
+                        }
+                    },
+                    error: function(e) {
+                        console.log(e);
+                    }
+                });
+            }, 100);
+        });
+
+        // Give clicks on a suggestion time to land before hiding them
+        $('#onid').blur(function(event) {
+            setTimeout(hideSuggestions, 200);
+        });
+
         // Reset error class and popover
         $(":text").focus(function(event) {
             $("#finduser").removeClass('has-error');
@@ -186,6 +321,8 @@
         });
 
         $('#adduser').click(function (event) {
+            hideSuggestions();
+
             // Grab entered text
             attendee = $("#onid").val();
 
@@ -223,15 +360,7 @@
                         if(fname.toLowerCase() === query_fname.toLowerCase()
                            && lname.toLowerCase() === query_lname.toLowerCase()) {
                             // Add to the dictionary, if it's not already there
-                            if(! attendees[attendee] && attendee != "") {
-                                attendees[attendee] = result_data;
-                            }
-
-                            // Rebuild attendees object
-                            buildAttendeesList();
-
-                            // Reset text field
-                            $("#onid").val("");
+                            addAttendee(attendee, result_data);
                         // The following two else clauses deal with incorrect
                         // from the username query
                         } else {
@@ -1,24 +1,30 @@
 #!/usr/bin/env python2
-from __future__ import print_function   # For handy log_diaging to stderr
+from __future__ import print_function
 
-import inspect
+import diag
 import itertools
-import linecache
+import metrics
 import os
 import pwd
 import re
-import requests
-import simplejson as json
 import sys
+import threading
+import time
 
 
 ONID_LNAME_MINLEN = 6
 ONID_LNAME_MAXLEN = 7
 ONID_DUP_MAX = 3
-ONID_QUERY_URL = "http://web.engr.oregonstate.edu/~schreibm/get_onid.php"
+# Set CLOUDENDAR_ONID_URL to use another get_onid.php, such as the local
+# stand-in in onid_server.py
+ONID_QUERY_URL = os.environ.get('CLOUDENDAR_ONID_URL',
+                                "http://web.engr.oregonstate.edu/~schreibm/get_onid.php")
 
 EMAIL_POSTFIX = '@onid.oregonstate.edu'
 
+# How long, in seconds, the passwd name index is used before it's rebuilt
+PASSWD_INDEX_TTL = 60 * 60
+
 
 def get_username():
     return pwd.getpwuid(os.getuid()).pw_name
@@ -28,74 +34,146 @@ def get_email(postfix=EMAIL_POSTFIX):
     return "{0}{1}".format(get_username(), postfix)
 
 
-def get_onid(fname, lname):
-    def _generate_onids(fname, lname):
-        # Grab list consisting of first letter and first two letters of first
-        # name
-        ftrunc = [fname[0], fname[0:2]]
-
-        # Figure out how long the section of last name should be
-        if(len(lname) < ONID_LNAME_MAXLEN):
-            maxlen = len(lname) + 1
-        else:
-            maxlen = ONID_LNAME_MAXLEN + 1
-
-        # Construct a list of permutations of last name segments, from
-        # 'ONID_LNAME_MINLEN' to 'maxlen' characters long.
-        ltrunc = [lname[0:r] for r in range(ONID_LNAME_MINLEN, maxlen)]
-
-        # These lists will get mixed together
-        combo = [ftrunc, ltrunc]
-
-        mutations = list(itertools.product(*combo))
-        mutations = list(itertools.chain.from_iterable(
-            map(lambda e: [e[0] + e[1], e[1] + e[0]], mutations)))
-        mutations += list(itertools.chain.from_iterable(
-            map(lambda e: [e + str(x) for x in range(2, ONID_DUP_MAX + 1)],
-                mutations)))
-
-        for onid in mutations:
-            yield onid
-
-    fname = fname.lower()
-    lname = lname.lower()
-
-    for onid in _generate_onids(fname, lname):
-        try:
-            passwd = pwd.getpwnam(onid)
-            pw_fname, pw_lname = passwd.pw_gecos.lower().split()
-            if len(pw_lname) > 2:
-                pw_lname = ''.join(pw_lname)
-            if pw_fname.find(fname[:3]) == -1 or pw_lname.find(lname) == -1:
+def _generate_onids(fname, lname):
+    """ Yields the usernames the ONID naming scheme could have given someone
+        named 'fname lname', most likely first
+    """
+    # Grab list consisting of first letter and first two letters of first
+    # name
+    ftrunc = [fname[0], fname[0:2]]
+
+    # Figure out how long the section of last name should be
+    if(len(lname) < ONID_LNAME_MAXLEN):
+        maxlen = len(lname) + 1
+    else:
+        maxlen = ONID_LNAME_MAXLEN + 1
+
+    # Construct a list of permutations of last name segments, from
+    # 'ONID_LNAME_MINLEN' to 'maxlen' characters long.
+    ltrunc = [lname[0:r] for r in range(ONID_LNAME_MINLEN, maxlen)]
+
+    # These lists will get mixed together
+    combo = [ftrunc, ltrunc]
+
+    mutations = list(itertools.product(*combo))
+    mutations = list(itertools.chain.from_iterable(
+        map(lambda e: [e[0] + e[1], e[1] + e[0]], mutations)))
+    mutations += list(itertools.chain.from_iterable(
+        map(lambda e: [e + str(x) for x in range(2, ONID_DUP_MAX + 1)],
+            mutations)))
+
+    for onid in mutations:
+        yield onid
+
+
+class PasswdIndex(object):
+    """ Usernames of the local accounts, keyed by the first and last names
+        in their GECOS fields, and by the first three letters of the first
+        name with the last name.
+
+        The index is built from a single pwd.getpwall() scan, instead of a
+        pwd.getpwnam() call (and possibly an NSS/LDAP round trip) for every
+        username a name might have, and is rebuilt by the first lookup made
+        once it is more than 'ttl' seconds old.
+    """
+    def __init__(self, ttl=PASSWD_INDEX_TTL):
+        self.ttl = ttl
+        self.built = None
+        self.names = {}
+        self.prefixes = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _split_gecos(gecos):
+        # The full name is the first comma-separated GECOS field
+        words = gecos.split(',')[0].lower().split()
+        if len(words) < 2:
+            return None
+        return words[0], words[-1]
+
+    def build(self):
+        names = {}
+        prefixes = {}
+        for passwd in pwd.getpwall():
+            name = self._split_gecos(passwd.pw_gecos)
+            if name is None:
                 continue
-            return onid
-        except:
-            continue
+            fname, lname = name
+            names.setdefault((fname, lname), []).append(passwd.pw_name)
+            # Also findable by the first three letters of the first name, as
+            # get_onid used to match: "Chris" finds "Christopher".  Names
+            # that only share a nickname ("Mike" and "Michael") don't match.
+            prefixes.setdefault((fname[:3], lname), []).append(passwd.pw_name)
+
+        with self.lock:
+            self.names = names
+            self.prefixes = prefixes
+            self.built = time.time()
+
+    def refresh(self):
+        """ Rebuilds the index if it has never been built or has expired """
+        if self.built is None or time.time() - self.built > self.ttl:
+            self.build()
+
+    def lookup(self, fname, lname):
+        """ Returns the username of the account named 'fname lname', or None.
+            When several accounts share a name, a username the ONID naming
+            scheme would give that name wins.
+        """
+        if not fname or not lname:
+            return None
+        self.refresh()
+
+        fname = fname.lower()
+        lname = lname.lower()
+        onids = (self.names.get((fname, lname)) or
+                 self.prefixes.get((fname[:3], lname)))
+        if not onids:
+            return None
+        if len(onids) > 1:
+            for onid in _generate_onids(fname, lname):
+                if onid in onids:
+                    return onid
+        return onids[0]
+
+
+passwd_index = PasswdIndex()
+
+
+def get_onid(fname, lname):
+    return passwd_index.lookup(fname, lname)
 
 
 def get_onids(users):
+    """ Fills in the 'onid' of each of a list of {'fname', 'lname'}
+        dictionaries, from one passwd scan at most
+    """
+    passwd_index.refresh()
     ret = []
     for user in users:
-        fname = users[0].get('fname')
-        lname = users[0].get('lname')
-        user['onid'] = get_onid(fname, lname)
+        user['onid'] = passwd_index.lookup(user.get('fname'), user.get('lname'))
         ret.append(user)
     return ret
 
 
-def request_onids(users):
-    url = ONID_QUERY_URL
-    payload = users
-    headers = {'content-type': 'application/json'}
+_onid_client = None
+_onid_client_lock = threading.Lock()
 
-    response = requests.post(url, data=json.dumps(payload), headers=headers)
-    ret = json.loads(response.content)
 
-    for user in ret:
-        if user.get('onid') == 'None':
-            user['onid'] = None
+def get_onid_client():
+    """ Returns the shared OnidClient for ONID_QUERY_URL """
+    global _onid_client
+    with _onid_client_lock:
+        if _onid_client is None:
+            # Imported here so that only callers of request_onids need requests
+            from onidclient import OnidClient
+            _onid_client = OnidClient(ONID_QUERY_URL)
+        return _onid_client
 
-    return ret
+
+def request_onids(users):
+    with metrics.stage('onid_lookup'):
+        return get_onid_client().lookup(users)
 
 
 def request_onid(fname, lname):
@@ -111,29 +189,22 @@ def moment_format_date(dt):
 def strip_postfix(email):
     return re.match('^(.*?)@.*$', email).group(1)
 
-# Thanks to user Apogentus at
-# http://stackoverflow.com/questions/14519177/python-exception-handling-line-number
-# for info about prettily printing exceptions
+_tracer = diag.get_tracer('utility')
+
+
+# Reports the exception being handled, with the file, function and line it
+# was raised on, at ERROR level.  Unlike the old linecache version, the
+# source line isn't read back.
 def log_err(msg):
-    exc_type, exc_obj, tb = sys.exc_info()
-    frame = tb.tb_frame
-    lineno = tb.tb_lineno
-    filename = frame.f_code.co_filename
-    linecache.checkcache(filename)
-    line = linecache.getline(filename, lineno, frame.f_globals)
-    print("{0} :: {1} :: {2}: {3}: {4} ".format(filename, lineno, line.strip(), msg,
-                                           exc_obj), file=sys.stderr)
-
-
-# Thanks to user junjanes at
-# http://stackoverflow.com/questions/6810999/how-to-determine-file-function-and-line-number
-# for info re: the 'inspect' module
+    _tracer.exception(msg)
+
+
+# Reports the caller's file, function and line with 'msg' when DEBUG is on
+# for the 'utility' subsystem (see diag.py).  New code should use its own
+# subsystem's diag.Tracer instead.
 def log_diag(msg):
-    caller_fr = inspect.stack()[1]
-    frame = caller_fr[0]
-    info = inspect.getframeinfo(frame)
-    print("{0} :: {1} :: {2}: {3}".format(info.filename, info.function,
-                                      info.lineno, msg), file=sys.stderr)
+    if _tracer.enabled(diag.DEBUG):
+        _tracer.write_from(sys._getframe(1), msg)
 
 
 if __name__ == "__main__":
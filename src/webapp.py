@@ -1,16 +1,27 @@
+# Must come before every other import: see cooperative.py
+import cooperative
+cooperative.patch()
+
+import diag
 import gapi
 import httplib2
+import metrics
 import os
 import random
 import string
 import utility
 
+from calpool import CalendarPool
 from database import db_session, db_init
+from datetime import datetime, timedelta
 from dateutil import parser
+from findcache import FindCache, clip_segments, to_utc
 from flask import (
     Flask,
+    abort,
     flash,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
@@ -27,18 +38,29 @@ from flask.ext.login import (
 )
 from flaskext.kvsession import KVSessionExtension
 from flask.ext.moment import Moment
-from flask.ext.socketio import SocketIO
+from flask.ext.socketio import SocketIO, emit
 from forms import SearchForm
 from models import User
+from nameindex import NameIndex
 from oauth2client.client import (
     FlowExchangeError,
     flow_from_clientsecrets,
 )
-from simplekv.memory import DictStore
+from prerender import ScriptCache, bytecode_cache, precompile_templates
+from sessionstore import CredentialCache, SessionStore, SESSION_STORE_PATH
 
 
 APPLICATION_NAME = 'cloudendar'
 
+tracer = diag.get_tracer('webapp')
+
+# Number of attendees whose calendars are asked for at a time when /find
+# results are streamed over SocketIO
+FREEBUSY_CHUNK = 5
+
+# Most windows one /find_batch request may ask about
+MAX_BATCH_WINDOWS = 100
+
 
 if not os.path.exists('data'):
     os.mkdir('data')
@@ -49,6 +71,10 @@ def create_app():
         SECRET_KEY='secret',
     )
 
+    # Keep compiled templates between runs.  Must be set before anything
+    # creates the Jinja2 environment.
+    app.jinja_options = dict(app.jinja_options, bytecode_cache=bytecode_cache())
+
     cdns = {
         "jquery": WebCDN("//ajax.googleapis.com/ajax/libs/jquery/1.11.0/"),
         "jquery-ui": WebCDN("//ajax.googleapis.com/ajax/libs/jqueryui/1.10.4/"),
@@ -61,8 +87,9 @@ def create_app():
     Bootstrap(app)
     app.extensions['bootstrap']['cdns'].update(cdns)
 
-    # See the simplekv documentation for details
-    store = DictStore()
+    # Sessions expire, are bounded in number and live in an SQLite file that
+    # every worker shares.  See sessionstore.py.
+    store = SessionStore(SESSION_STORE_PATH)
     # This will replace the app's session handling
     KVSessionExtension(store, app)
 
@@ -75,6 +102,13 @@ app = create_app()
 # Initialize nice formatting of dates and times in Jinja2 templates
 moment = Moment(app)
 
+# Compile every template now rather than on each one's first request
+precompile_templates(app)
+
+# The scripts in templates/interpreted_js, rendered once and served by
+# interpreted_js() below
+script_cache = ScriptCache()
+
 # Initialize SocketIO environment
 socketio = SocketIO(app)
 
@@ -92,6 +126,31 @@ lm.init_app(app)
 # Start scoped database session
 db_init()
 
+# In-memory index of users' names for the attendee search box
+name_index = NameIndex()
+name_index.attach()
+
+# Overlap segments behind recent /find results
+find_cache = FindCache()
+
+# OAuth credentials of logged in users.  Sessions only hold the ONID they're
+# kept under, in 'credentials_id'.
+credential_cache = CredentialCache()
+
+
+# Ready CalendarAPI objects for each user's credentials
+calendar_pool = CalendarPool()
+
+
+def get_credentials():
+    """ Returns the credentials of the session's user, or None """
+    return credential_cache.get(session.get('credentials_id'))
+
+
+def borrow_calendar():
+    """ Checks out a CalendarAPI for the session's user for a 'with' block """
+    return calendar_pool.borrow(session.get('credentials_id'), get_credentials())
+
 
 # Inject template variables and functions into ALL templates
 @app.context_processor
@@ -102,7 +161,52 @@ def inject_variables():
     scope = ' '.join(gapi.APP_SCOPE)
     return dict(CLIENT_ID=gapi.WEB_CLIENT_ID,
                 SCOPE=scope,
-                APPLICATION_NAME=APPLICATION_NAME)
+                APPLICATION_NAME=APPLICATION_NAME,
+                script_url=script_cache.script_url)
+
+
+@app.route('/js/<name>')
+def interpreted_js(name):
+    if name not in script_cache.names:
+        abort(404)
+    return script_cache.response(name)
+
+
+# Report what the caches are doing on /metrics
+metrics.watch('find', lambda: find_cache.stats)
+metrics.watch('calendar_pool', lambda: calendar_pool.stats)
+metrics.watch('onid', lambda: utility.get_onid_client().stats)
+
+
+def request_route():
+    if request.url_rule is not None:
+        return request.url_rule.rule
+    return 'unmatched'
+
+
+# Time every request for /metrics
+@app.before_request
+def begin_request_metrics():
+    metrics.begin_request()
+
+
+@app.after_request
+def end_request_metrics(response):
+    metrics.end_request(request_route(), request.method, response.status_code)
+    return response
+
+
+# Requests that failed with an unhandled exception skip after_request
+@app.teardown_request
+def end_failed_request_metrics(exception=None):
+    metrics.end_request(request_route(), request.method, 500)
+
+
+@app.route('/metrics')
+def show_metrics():
+    response = make_response(metrics.render())
+    response.headers['Content-Type'] = metrics.CONTENT_TYPE
+    return response
 
 
 # Teardown hook -- closed on exit
@@ -119,7 +223,7 @@ def load_user(onid):
 @app.route('/login')
 def login():
     # If the user is already authenticated, redirect to home page
-    if 'credentials' in session:
+    if get_credentials() is not None:
         return redirect(url_for('index'))
 
     # Otherwise, create CSRF token and initiate authorization flow
@@ -131,7 +235,7 @@ def login():
 @app.route('/')
 #@login_required
 def index():
-    if session.get('credentials') is None:
+    if get_credentials() is None:
         return redirect(url_for('login'))
 
     form = SearchForm()
@@ -148,6 +252,13 @@ def run_query():
         # Grab the JSON data from the client
         payload = request.get_json()
 
+        # Typeahead searches go to the local name index: {'mode': 'search',
+        # 'q': <partial name or ONID>, 'limit': <number of candidates>}
+        if payload.get('mode') == 'search':
+            limit = min(int(payload.get('limit') or 8), 50)
+            candidates = name_index.search(payload.get('q') or '', limit)
+            return jsonify(candidates=candidates)
+
         # Create a list of dictionaries containing the users' names
         names = []
         for key, value in payload.iteritems():
@@ -161,75 +272,298 @@ def run_query():
         return jsonify(exception=str(e), status=400)
 
 
+def check_find_access(payload):
+    """ Returns None if 'payload' comes from the logged in client the search
+        form was rendered for, or an error message
+    """
+    csrf_token = payload.get('csrf_token')
+    if csrf_token is None or csrf_token != session.get('csrf_token'):
+        return 'Access unauthorized'
+    if get_credentials() is None:
+        return 'You must be logged in to access this page'
+    return None
+
+
+def read_attendees(payload):
+    """ Reads who a search is about and what kind of search it is out of the
+        JSON the search form sends
+
+        @returns: a dictionary with the attendees' ONIDs ('usernames'), the
+            names they were entered by ('users'), a map from ONID to name
+            ('usermap'), the names no ONID was found for ('missing'), and the
+            'whole' and 'duration' arguments of
+            CalendarAPI.get_ranges_overlaps()
+    """
+    # Ugh.  Clearly I need to have thought harder about the details of
+    # transferring data between the server and client...
+    usernames = []
+    users = []
+    usermap = {}
+    missing = []
+    for user, info in payload.get('users').iteritems():
+        onid = info.get('onid')
+        if onid is None:
+            missing.append(user)
+            continue
+        usernames.append(onid)
+        users.append(user)
+        usermap[onid] = user
+
+    # Check what kind of search we're doing.  If the value of 'search_type'
+    # is 'duration', we set the argument 'whole' to 'True'.
+    search_type = payload.get('search_type')
+
+    return {
+        'usernames': usernames,
+        'users': users,
+        'usermap': usermap,
+        'missing': missing,
+        'whole': search_type == 'whole',
+        'duration': search_type == 'duration',
+    }
+
+
+def read_find_payload(payload):
+    """ Reads a search out of the JSON the search form sends: what
+        read_attendees() returns, plus the 'start_time' and 'end_time' of
+        the window searched
+    """
+    search = read_attendees(payload)
+    search['start_time'] = parser.parse(payload.get('start'))
+    search['end_time'] = parser.parse(payload.get('end'))
+    return search
+
+
+def read_batch_windows(payload):
+    """ Reads the windows of a /find_batch search, either listed:
+
+            {'windows': [{'start': ..., 'end': ...}, ...]}
+
+        or as one window and the time of day to search within each of its
+        days:
+
+            {'start': ..., 'end': ..., 'daily': {'start': '9:00', 'end': '17:00'}}
+
+        @returns: a list of (start, end) datetime pairs
+    """
+    windows = payload.get('windows')
+    if windows is not None:
+        ret = [(parser.parse(window.get('start')), parser.parse(window.get('end')))
+               for window in windows]
+    else:
+        start_time = parser.parse(payload.get('start'))
+        end_time = parser.parse(payload.get('end'))
+        daily = payload.get('daily') or {}
+        day_start = parser.parse(daily.get('start')).time()
+        day_end = parser.parse(daily.get('end')).time()
+
+        ret = []
+        day = start_time.date()
+        while day <= end_time.date():
+            window_start = datetime.combine(day, day_start).replace(tzinfo=start_time.tzinfo)
+            window_end = datetime.combine(day, day_end).replace(tzinfo=start_time.tzinfo)
+            window_start = max(window_start, start_time)
+            window_end = min(window_end, end_time)
+            if window_start < window_end:
+                ret.append((window_start, window_end))
+            day += timedelta(days=1)
+
+    if len(ret) > MAX_BATCH_WINDOWS:
+        raise ValueError("At most {0} windows can be searched at once".format(MAX_BATCH_WINDOWS))
+    return ret
+
+
+def label_free_ranges(free_ranges, users, usermap):
+    """ Adds the names of the attendees free and busy during each range """
+    # Google's Calendar API returns calendars keyed to emails rather than
+    # usernames, and that propagates through many of the functions defined
+    # on the CalendarAPI class.  Therefore, in order to work with the
+    # JavaScript in search.js, we've got to strip off the email postfix.
+    for item in free_ranges:
+        free_users = map(lambda onid: usermap.get(utility.strip_postfix(onid)), item.get('onids'))
+        item['free_users'] = free_users
+        item['busy_users'] = [user for user in users if user not in free_users]
+    return free_ranges
+
+
+def overlap_segments(usernames, start_time, end_time, gcal=None):
+    """ Returns the overlap segments of the attendees 'usernames' between
+        'start_time' and 'end_time' (in UTC), from the cached segments of an
+        earlier search for the same attendees when there are some
+
+        @param gcal: a CalendarAPI whose calendars were already queried for
+            the search, if any.  Otherwise one is borrowed when needed.
+    """
+    key = find_cache.key(session.get('username'), usernames)
+
+    segments = find_cache.get(key, start_time, end_time)
+    if segments is None:
+        if gcal is not None:
+            segments = gcal.get_overlap_segments(users=usernames,
+                                                 start_time=start_time,
+                                                 end_time=end_time)
+        else:
+            with borrow_calendar() as gcal:
+                segments = gcal.get_overlap_segments(users=usernames,
+                                                     start_time=start_time,
+                                                     end_time=end_time)
+        find_cache.put(key, start_time, end_time, segments)
+    return segments
+
+
+def segments_to_free_ranges(search, segments):
+    """ Returns 'segments' as the labelled free ranges /find returns """
+    free_ranges = gapi.ranges_from_segments(
+        segments, [onid + gapi.EMAIL_POSTFIX for onid in search['usernames']],
+        convert_func=utility.moment_format_date,
+        whole=search['whole'],
+        duration=search['duration'])
+    return label_free_ranges(free_ranges, search['users'], search['usermap'])
+
+
+def find_free_ranges(search, gcal=None):
+    """ Returns the labelled free ranges for a search read by
+        read_find_payload()
+
+        @param gcal: a CalendarAPI whose calendars were already queried for
+            the search, if any.  Otherwise one is borrowed when needed.
+    """
+    segments = overlap_segments(search['usernames'],
+                                to_utc(search['start_time']),
+                                to_utc(search['end_time']),
+                                gcal)
+    return segments_to_free_ranges(search, segments)
+
+
 @app.route('/find', methods=['POST'])
 @login_required
 def find_times():
-    stored_csrf_token = session.get('csrf_token')
-
     try:
         # Grab the JSON data from the client
         payload = request.get_json()
 
         # Confirm that the request is coming from the right client
-        csrf_token = payload.get('csrf_token')
-        if csrf_token is None or csrf_token != stored_csrf_token:
-            return jsonify(msg='Access unauthorized', status=401)
-
-        person = session.get('person')
-        credentials = session.get('credentials')
-        if person is None or credentials is None:
-            return jsonify(msg='You must be logged in to access this page', status=401)
-
-        # Ugh.  Clearly I need to have thought harder about the details of
-        # transferring data between the server and client...
-        usernames = []
-        users = []
-        usermap = {}
-        for user, info in payload.get('users').iteritems():
-            onid = info.get('onid')
-            usernames.append(onid)
-            users.append(user)
-            usermap[onid] = user
-        if len(usermap) == 0:
+        msg = check_find_access(payload)
+        if msg is not None:
+            return jsonify(msg=msg, status=401)
+
+        search = read_find_payload(payload)
+        if len(search['usermap']) == 0:
             return jsonify(msg='No results', status=200)
 
-        start_time = parser.parse(payload.get('start'))
-        end_time = parser.parse(payload.get('end'))
+        # Get the list of ranges during which the various users are free
+        with tracer.span('find_times'):
+            free_ranges = find_free_ranges(search)
 
-        # Check what kind of search we're doing.  If the value of 'search_type'
-        # is 'duration', we set the argument 'whole' to 'True'.
-        whole = False
-        duration = False
-        search_type = payload.get('search_type')
-        if search_type == 'whole':
-            whole = True
-        elif search_type == 'duration':
-            duration = True
+        with metrics.stage('json_encode'):
+            return jsonify(free_ranges=free_ranges)
 
+    except Exception as e:
+        tracer.exception("/find failed")
+        return jsonify(exception=str(e), status=400)
 
-        # Instantiate a CalendarAPI object for interacting with the Google Calendar API
-        gcal = gapi.CalendarAPI(is_cli_app=False, credentials=credentials)
 
-        # Get the list of ranges during which the various users are free
-        free_ranges = gcal.get_ranges_overlaps(users=usernames,
-                                               start_time=start_time,
-                                               end_time=end_time,
-                                               whole=whole,
-                                               duration=duration,
-                                               convert_func=utility.moment_format_date)
-
-        # Google's Calendar API returns calendars keyed to emails rather than
-        # usernames, and that propagates through many of the functions defined
-        # on the CalendarAPI class.  Therefore, in order to work with the
-        # JavaScript in search.js, we've got to strip off the email postfix.
+@socketio.on('find', namespace='/search')
+def stream_find_times(payload):
+    """ The /find search over SocketIO, answered as it goes.  Emits, in order:
+
+        'attendees': {'resolved': [...], 'missing': [...]}, the names that
+            have an ONID and those that don't
+        'freebusy': {'users': [...], 'received': n, 'total': m}, as each
+            chunk of attendees' calendars comes back from Google
+        'range': one free range at a time, in time order, labelled like the
+            items /find returns
+        'done': {'count': <number of ranges>}
+
+        or 'failed': {'msg': ..., 'status': ...} as soon as anything goes wrong.
+    """
+    try:
+        msg = check_find_access(payload)
+        if msg is not None:
+            emit('failed', {'msg': msg, 'status': 401})
+            return
+
+        search = read_find_payload(payload)
+        usernames = search['usernames']
+        usermap = search['usermap']
+        emit('attendees', {'resolved': search['users'], 'missing': search['missing']})
+        if len(usermap) == 0:
+            emit('done', {'count': 0})
+            return
+
+        with tracer.span('stream_find_times'):
+            key = find_cache.key(session.get('username'), usernames)
+            start_time = to_utc(search['start_time'])
+            end_time = to_utc(search['end_time'])
+
+            if not find_cache.covers(key, start_time, end_time):
+                with borrow_calendar() as gcal:
+                    received = 0
+                    for chunk, calendars in gcal.iter_calendars_free(usernames, start_time,
+                                                                     end_time, FREEBUSY_CHUNK):
+                        received += len(chunk)
+                        emit('freebusy', {'users': [usermap.get(onid) for onid in chunk],
+                                          'received': received,
+                                          'total': len(usernames)})
+
+                    free_ranges = find_free_ranges(search, gcal)
+            else:
+                emit('freebusy', {'users': search['users'],
+                                  'received': len(usernames),
+                                  'total': len(usernames)})
+
+                free_ranges = find_free_ranges(search)
+
         for item in free_ranges:
-            free_users = map(lambda onid: usermap.get(utility.strip_postfix(onid)), item.get('onids'))
-            item['free_users'] = free_users
-            item['busy_users'] = [user for user in users if user not in free_users]
+            emit('range', item)
+        emit('done', {'count': len(free_ranges)})
+
+    except Exception as e:
+        tracer.exception("find over SocketIO failed")
+        emit('failed', {'msg': str(e), 'status': 400})
+
+
+@app.route('/find_batch', methods=['POST'])
+@login_required
+def find_times_batch():
+    """ /find for many windows at once, e.g. the same hours on each day of a
+        week.  Freebusy is asked for once, for the range covering every
+        window, and the overlaps are computed in one pass and split between
+        the windows.  Returns {'windows': [{'start', 'end', 'free_ranges'},
+        ...]} in the order the windows were given.
+    """
+    try:
+        payload = request.get_json()
 
-        return jsonify(free_ranges=free_ranges)
+        msg = check_find_access(payload)
+        if msg is not None:
+            return jsonify(msg=msg, status=401)
+
+        search = read_attendees(payload)
+        windows = [(to_utc(start_time), to_utc(end_time))
+                   for start_time, end_time in read_batch_windows(payload)]
+        if len(search['usermap']) == 0 or len(windows) == 0:
+            return jsonify(msg='No results', status=200)
+
+        with tracer.span('find_times_batch'):
+            segments = overlap_segments(search['usernames'],
+                                        min(start_time for start_time, end_time in windows),
+                                        max(end_time for start_time, end_time in windows))
+
+            results = []
+            for start_time, end_time in windows:
+                window_segments = clip_segments(segments, start_time, end_time)
+                results.append({
+                    'start': utility.moment_format_date(start_time),
+                    'end': utility.moment_format_date(end_time),
+                    'free_ranges': segments_to_free_ranges(search, window_segments),
+                })
+
+        with metrics.stage('json_encode'):
+            return jsonify(windows=results)
 
     except Exception as e:
+        tracer.exception("/find_batch failed")
         return jsonify(exception=str(e), status=400)
 
 
@@ -275,7 +609,7 @@ def connect():
     # the other components validate the token before using it.
     gplus_id = credentials.id_token['sub']
 
-    stored_credentials = session.get('credentials')
+    stored_credentials = get_credentials()
     stored_gplus_id = session.get('gplus_id')
     if stored_credentials is not None and gplus_id == stored_gplus_id:
         response = jsonify(msg='Current user is already connected.', status=200, redirect=url_for('index'))
@@ -296,11 +630,12 @@ def connect():
     # Call the Flask-Login login_user function to set up user login session
     login_user(user)
 
-    # Store the access token and other items in the session for later use
-    session['credentials'] = credentials
+    # Keep the credentials on the server, and only what identifies them and
+    # the user in the session
+    credential_cache.put(onid, credentials)
+    session['credentials_id'] = onid
     session['gplus_id'] = gplus_id
     session['username'] = onid
-    session['person'] = person
 
     # Flash a success message
     flash("Logged in successfully.")
@@ -313,7 +648,7 @@ def disconnect():
     """Revoke current user's token and reset their session."""
 
     # Only disconnect a connected user.
-    credentials = session.get('credentials')
+    credentials = get_credentials()
     if credentials is None:
         response = jsonify(msg='Current user not connected.', status=401)
         return response
@@ -326,7 +661,9 @@ def disconnect():
 
     if result.get('status') == '200':
         # Reset the user's session.
-        del session['credentials']
+        credentials_id = session.pop('credentials_id')
+        credential_cache.discard(credentials_id)
+        calendar_pool.discard(credentials_id)
         flash('Successfully revoked your permissions.')
         response = jsonify(msg='Successfully disconnected.', status=200, redirect=url_for('index'))
         return response
@@ -379,5 +716,10 @@ def make_state():
 
 
 if __name__ == "__main__":
+    # One blocking Google call would stall every client of the worker
+    blocking = cooperative.verify()
+    if blocking:
+        raise RuntimeError("Not cooperative under gevent: {0}".format(', '.join(blocking)))
+
     app.debug = True
     socketio.run(app)